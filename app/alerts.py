@@ -0,0 +1,290 @@
+"""
+Slack alerts, coalesced per motion episode.
+
+An episode starts with the first alert of the decision engine and ends when
+the engine goes back to idle (or after max_episode_seconds). The first alert
+posts a message and uploads its image in a thread under it, or thumbnails of
+the frames leading up to it (see thumbnails.py). Further alerts
+of the episode only keep a thumbnail of their frame, and when the episode
+ends a contact sheet of them is uploaded to the thread, along with a single
+pair of tag buttons for the whole episode.
+
+Slack calls are made from a worker thread, so the camera loop never waits on
+them, and go through a token bucket. Rate limited calls are retried after
+the Retry-After delay Slack sends back.
+"""
+import logging
+import queue
+import threading
+import time
+
+import cv2
+
+try:
+    from app import config
+    from app import utils
+    from app.decision import IDLE
+    from app.thumbnails import contact_sheet
+except ImportError:
+    import config
+    import utils
+    from decision import IDLE
+    from thumbnails import contact_sheet
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+
+class TokenBucket():
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        """Initialize the TokenBucket class
+
+        Args:
+            rate (float): Tokens added per second
+            capacity (int): Maximum number of tokens, the allowed burst
+            clock (callable, optional): Returns the current time in seconds
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available"""
+        now = self.clock()
+        self.refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def acquire(self, sleep=time.sleep):
+        """Take a token, sleeping until one is available"""
+        wait = self.wait_time()
+        while wait > 0:
+            sleep(wait)
+            wait = self.wait_time()
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Hand out no tokens for <seconds>, i.e. after being rate limited"""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+class Episode():
+
+    def __init__(self, ts, started):
+        self.ts = ts
+        self.started = started
+        self.samples = [ts]
+        self.thumbnails = []
+        self.file_ids = []
+        self.thread_ts = None
+
+
+class AlertAggregator(threading.Thread):
+
+    def __init__(self, conf=None, events=None, tag=True, api_call=None,
+                 clock=time.monotonic):
+        """Initialize the AlertAggregator class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml
+            events (event_store.EventStore, optional): Store to record the
+                uploaded slack files in
+            tag (bool, optional): Post tag buttons for every episode
+            api_call (callable, optional): Slack API function, called as
+                api_call(method, **kwargs). Defaults to utils.slack_api_call,
+                replaced by a stub when testing
+            clock (callable, optional): Returns the current time in seconds
+        """
+        super(AlertAggregator, self).__init__(name='alerts', daemon=True)
+        conf = conf or CONF
+        settings = conf.get('alerts', {})
+        self.events = events
+        self.tag = tag
+        self.api_call = api_call or utils.slack_api_call
+        self.clock = clock
+        self.channel = settings.get('channel') or \
+            config.load_private_config()['alerts_channel']
+
+        self.max_episode_seconds = settings.get('max_episode_seconds', 300)
+        self.max_keyframes = settings.get('max_keyframes', 9)
+        self.thumbnail_width = settings.get('thumbnail_width', 320)
+        self.sheet_columns = settings.get('sheet_columns', 3)
+        self.max_retries = settings.get('max_retries', 3)
+        self.bucket = TokenBucket(settings.get('rate_per_minute', 20) / 60,
+                                  settings.get('burst', 5), clock)
+
+        self.episode = None
+        self._queue = queue.Queue()
+
+    def alert(self, ts, jpeg, frame, media=None):
+        """Add an alert to the current episode, starting one if needed.
+        Called from the camera loop
+
+        Args:
+            ts (str): Alert timestamp, as used in the image and sample names
+            jpeg (concurrent.futures.Future): Resolves to the JPEG bytes of
+                the frame
+            frame (numpy.ndarray): BGR frame, must not be modified after
+            media (tuple, optional): (filename, future of the bytes) to upload
+                instead of the JPEG when the alert starts an episode
+        """
+        if self.episode is None:
+            self.episode = Episode(ts, self.clock())
+            self._queue.put(('open', self.episode, (ts, jpeg, media)))
+        else:
+            self.episode.samples.append(ts)
+        self._queue.put(('frame', self.episode, frame))
+
+    def update(self, state):
+        """Close the current episode once the motion is over. Called from the
+        camera loop for every frame
+
+        Args:
+            state (str): State of the decision engine
+        """
+        if self.episode is None:
+            return
+        duration = self.clock() - self.episode.started
+        if state == IDLE or duration >= self.max_episode_seconds:
+            self._queue.put(('close', self.episode, None))
+            self.episode = None
+
+    def flush(self):
+        """Block until every queued alert has been handled"""
+        self._queue.join()
+
+    def run(self):
+        handlers = {'open': self.open_episode, 'frame': self.add_frame,
+                    'close': self.close_episode}
+        while True:
+            action, episode, arg = self._queue.get()
+            try:
+                handlers[action](episode, arg)
+            except Exception:
+                LOGGER.exception('Unable to %s alert episode %s', action,
+                                 episode.ts)
+            finally:
+                self._queue.task_done()
+
+    def call(self, method, **kwargs):
+        """Call the Slack API within the rate limit, retrying rate limited
+        calls after the delay slack asks for
+
+        Returns:
+            dict: Slack response object
+        """
+        for _ in range(self.max_retries + 1):
+            self.bucket.acquire()
+            response = self.api_call(method, **kwargs)
+            if response.get('ok') or response.get('error') != 'ratelimited':
+                break
+            retry_after = float(
+                response.get('headers', {}).get('Retry-After', 1))
+            LOGGER.warning('Rate limited on %s, retrying in %ss', method,
+                           retry_after)
+            self.bucket.pause(retry_after)
+        if not response.get('ok'):
+            LOGGER.error('Slack %s failed: %s', method, response)
+        return response
+
+    def upload(self, episode, filename, data, title=None):
+        response = self.call(
+            'files.upload', channels=self.channel, filename=filename,
+            file=data, title=title or filename, thread_ts=episode.thread_ts)
+        if response.get('ok'):
+            file_id = response['file']['id']
+            episode.file_ids.append(file_id)
+            if self.events is not None:
+                self.events.record_slack_file(file_id, episode.ts, filename)
+        return response
+
+    def open_episode(self, episode, first_alert):
+        ts, jpeg, media = first_alert
+        response = self.call(
+            'chat.postMessage', as_user=True, channel=self.channel,
+            text='Motion detected at {}'.format(ts))
+        episode.thread_ts = response.get('ts')
+
+        if media is not None:
+            filename, future = media
+            try:
+                self.upload(episode, filename, future.result())
+                return
+            except Exception:
+                LOGGER.exception('Unable to render %s, uploading the image',
+                                 filename)
+        self.upload(episode, '{}.jpg'.format(ts), jpeg.result())
+
+    def add_frame(self, episode, frame):
+        """Keep a thumbnail of the frame, spread out over the episode once
+        there are more than max_keyframes
+        """
+        height, width = frame.shape[:2]
+        thumbnail = cv2.resize(frame, (
+            self.thumbnail_width,
+            int(height * self.thumbnail_width / width)))
+        episode.thumbnails.append(thumbnail)
+        if len(episode.thumbnails) > self.max_keyframes:
+            # drop every other thumbnail after the first
+            episode.thumbnails = episode.thumbnails[:1] + \
+                episode.thumbnails[2::2]
+
+    def close_episode(self, episode, _):
+        duration = self.clock() - episode.started
+        LOGGER.info('Alert episode %s over after %.0fs, %s alerts',
+                    episode.ts, duration, len(episode.samples))
+        if len(episode.thumbnails) > 1:
+            ok, sheet = cv2.imencode('.jpg', contact_sheet(
+                episode.thumbnails, self.sheet_columns))
+            if ok:
+                self.upload(
+                    episode, '{}_sheet.jpg'.format(episode.ts),
+                    sheet.tobytes(), title='{} alerts over {:.0f}s'.format(
+                        len(episode.samples), duration))
+        if self.tag:
+            self.post_tag_buttons(episode)
+
+    def post_tag_buttons(self, episode):
+        def button(name, text, style, occupied):
+            return {
+                'name': name,
+                'text': text,
+                'type': 'button',
+                'style': style,
+                'value': str({
+                    'occupied': occupied,
+                    'episode': episode.ts,
+                    'samples': episode.samples,
+                    'file_ids': episode.file_ids,
+                })
+            }
+
+        self.call(
+            'chat.postMessage', as_user=True, channel=self.channel,
+            thread_ts=episode.thread_ts,
+            text='Tag episode {}'.format(episode.ts),
+            attachments=[{
+                'text': 'How should this episode be tagged',
+                'callback_id': 'tag_episode',
+                'color': '#3AA3E3',
+                'attachment_type': 'default',
+                'actions': [
+                    button('occupied', 'Occupied', 'primary', True),
+                    button('unoccupied', 'Unoccupied', 'danger', False),
+                ]
+            }])
@@ -0,0 +1,259 @@
+"""
+Arming profiles. A profile decides, by time of day and day of the week,
+whether the camera is armed, whether alerts are sent and how sensitive the
+motion detection is in each zone of the frame.
+
+Profiles are compiled at startup into a weekly timeline of the minutes at
+which their state changes. An ArmingController thread keeps the current
+state cached and wakes up at the next transition, or every poll_seconds to
+pick up the Redis flags (camera_status, camera_notifications and the
+arming_profile selected from slack), so the camera loop only ever reads one
+attribute per frame.
+
+    arming:
+      profile: default
+      zones:
+        door: [0, 0, 200, 375] # x1, y1, x2, y2 at frame_width
+      profiles:
+        default:
+          armed: True
+          schedule:
+            - {start: '23:00', end: '07:00', notifications: False}
+            - {days: [sat, sun], start: '10:00', end: '16:00',
+               zones: {door: 0}}
+
+Schedule windows override the profile's settings while they are active,
+later windows taking precedence. Windows that end before they start wrap
+around midnight.
+"""
+import bisect
+import collections
+import logging
+import threading
+from datetime import datetime
+
+try:
+    from app import config
+    from app import utils
+except ImportError:
+    import config
+    import utils
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config().get('arming', {})
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DEFAULT_PROFILES = {'default': {'armed': True}}
+
+# zones is a tuple of (name, (x1, y1, x2, y2), sensitivity)
+ArmingState = collections.namedtuple(
+    'ArmingState',
+    ['profile', 'armed', 'notifications', 'sensitivity', 'zones'])
+
+
+def parse_minute(value):
+    """Parse a 'HH:MM' time into minutes since midnight"""
+    hours, _, minutes = str(value).partition(':')
+    return int(hours) * 60 + int(minutes or 0)
+
+
+def window_ranges(window):
+    """Minute of the week ranges a schedule window is active in
+
+    Args:
+        window (dict): Schedule window, with start, end and optional days
+
+    Returns:
+        list: (start, end) minutes of the week, end excluded
+    """
+    start = parse_minute(window['start'])
+    end = parse_minute(window['end'])
+    if end <= start:
+        end += MINUTES_PER_DAY
+
+    ranges = []
+    for day in window.get('days', DAYS):
+        offset = DAYS.index(day[:3].lower()) * MINUTES_PER_DAY
+        range_start, range_end = offset + start, offset + end
+        if range_end > MINUTES_PER_WEEK:
+            # Sunday night into Monday morning
+            ranges.append((range_start, MINUTES_PER_WEEK))
+            ranges.append((0, range_end - MINUTES_PER_WEEK))
+        else:
+            ranges.append((range_start, range_end))
+    return ranges
+
+
+class Timeline():
+
+    def __init__(self, name, profile, zones=None):
+        """Compile a profile into the states between its transitions
+
+        Args:
+            name (str): Profile name
+            profile (dict): Profile settings
+            zones (dict, optional): Zone name -> (x1, y1, x2, y2)
+        """
+        self.name = name
+        zones = zones or {}
+        base = {
+            'armed': profile.get('armed', True),
+            'notifications': profile.get('notifications', True),
+            'sensitivity': profile.get('sensitivity', 1.0),
+            'zones': dict(profile.get('zones', {})),
+        }
+        windows = [(window, window_ranges(window))
+                   for window in profile.get('schedule', [])]
+
+        boundaries = {0}
+        for _, ranges in windows:
+            for start, end in ranges:
+                boundaries.update((start, end % MINUTES_PER_WEEK))
+
+        self.minutes = []
+        self.states = []
+        for minute in sorted(boundaries):
+            settings = dict(base, zones=dict(base['zones']))
+            for window, ranges in windows:
+                if any(start <= minute < end for start, end in ranges):
+                    settings.update((k, v) for k, v in window.items()
+                                    if k in ('armed', 'notifications',
+                                             'sensitivity'))
+                    settings['zones'].update(window.get('zones', {}))
+            state = ArmingState(
+                name, settings['armed'], settings['notifications'],
+                settings['sensitivity'],
+                tuple((zone, tuple(rect), settings['zones'].get(zone, 1.0))
+                      for zone, rect in sorted(zones.items())))
+            if self.states and self.states[-1] == state:
+                continue
+            self.minutes.append(minute)
+            self.states.append(state)
+
+    def lookup(self, minute):
+        """State at a minute of the week
+
+        Args:
+            minute (int): Minutes since Monday midnight
+
+        Returns:
+            tuple: (ArmingState, minutes until the next transition)
+        """
+        i = bisect.bisect_right(self.minutes, minute) - 1
+        if i + 1 < len(self.minutes):
+            next_minute = self.minutes[i + 1]
+        else:
+            next_minute = self.minutes[0] + MINUTES_PER_WEEK
+        return self.states[i], next_minute - minute
+
+
+def minute_of_week(now):
+    return now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+
+
+def compile_profiles(conf=None):
+    """Compile every profile of the arming settings
+
+    Args:
+        conf (dict, optional): Arming settings to use instead of config.yml
+
+    Returns:
+        dict: Profile name -> Timeline
+    """
+    conf = conf if conf is not None else CONF
+    zones = conf.get('zones', {})
+    return {name: Timeline(name, profile, zones)
+            for name, profile in conf.get('profiles', DEFAULT_PROFILES)
+            .items()}
+
+
+def profile_names(conf=None):
+    conf = conf if conf is not None else CONF
+    return sorted(conf.get('profiles', DEFAULT_PROFILES))
+
+
+def selected_profile(conf=None):
+    """Profile selected from slack, or the default profile of config.yml"""
+    conf = conf if conf is not None else CONF
+    profile = utils.redis_get('arming_profile')
+    if profile in conf.get('profiles', DEFAULT_PROFILES):
+        return profile
+    return conf.get('profile', 'default')
+
+
+class ArmingController(threading.Thread):
+
+    def __init__(self, conf=None, poll_seconds=None):
+        """Initialize the ArmingController class
+
+        Args:
+            conf (dict, optional): Arming settings to use instead of
+                config.yml
+            poll_seconds (float, optional): Seconds between reads of the
+                redis flags
+        """
+        super(ArmingController, self).__init__(name='arming', daemon=True)
+        self.conf = conf if conf is not None else CONF
+        self.timelines = compile_profiles(self.conf)
+        self.poll_seconds = poll_seconds or self.conf.get('poll_seconds', 2)
+
+        self._wake = threading.Event()
+        self._stopped = False
+        self.state = None
+        self.refresh()
+
+    def configure(self, conf):
+        """Recompile the profiles if the arming settings changed, and refresh
+        the state with them
+
+        Args:
+            conf (dict): Arming settings
+        """
+        if conf == self.conf:
+            return
+        self.timelines = compile_profiles(conf)
+        self.conf = conf
+        self.poll_seconds = conf.get('poll_seconds', self.poll_seconds)
+        self.wake()
+
+    def refresh(self):
+        """Recompute the cached state
+
+        Returns:
+            float: Seconds until the next scheduled transition
+        """
+        now = datetime.now()
+        timeline = self.timelines.get(selected_profile(self.conf))
+        if timeline is None:
+            # Read while configure swaps the settings, refresh again
+            return 0
+        state, minutes = timeline.lookup(minute_of_week(now))
+        state = state._replace(
+            armed=state.armed and bool(utils.redis_get('camera_status')),
+            notifications=state.notifications and
+            bool(utils.redis_get('camera_notifications')))
+        if state != self.state:
+            LOGGER.info('Arming state: %s', state)
+            self.state = state
+        return minutes * 60 - now.second - now.microsecond / 1e6
+
+    def run(self):
+        while not self._stopped:
+            try:
+                until_transition = self.refresh()
+            except Exception:
+                LOGGER.exception('Unable to refresh the arming state')
+                until_transition = self.poll_seconds
+            self._wake.wait(max(0, min(until_transition, self.poll_seconds)))
+            self._wake.clear()
+
+    def wake(self):
+        """Refresh the state now, i.e. after switching profiles"""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
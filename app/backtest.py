@@ -0,0 +1,336 @@
+"""
+Backtest the motion detection pipeline against the tagged training samples
+saved by the security system, sweeping a grid of parameters in parallel.
+
+Each sample (an `<occupied|unoccupied>_<ts>.pkl` pickle from save_pickle) is
+labelled with its `<True|False>_<ts>.txt` tag from the /interactive view.
+Untagged unoccupied samples are treated as negatives, untagged occupied
+samples are skipped. Every frame of a sample is replayed through
+MotionDetector and MotionModel.classify, starting from a background model
+seeded with the first frame, and the classifications drive a DecisionEngine
+on a clock simulated from the fps. The sample is predicted occupied if the
+engine reaches the confirmed state.
+
+The pipeline is split into stages, and each stage's output is cached under
+the parameters it depends on, so configs that only differ in a later stage
+(i.e. min_area) reuse the blurred frames and deltas of earlier ones.
+
+    python3 backtest.py --grid "min_area=[2000, 5000]" "delta_thresh=[5, 10]"
+"""
+import argparse
+import glob
+import itertools
+import logging
+import os
+import pickle
+import time
+from multiprocessing import Pool
+
+import cv2
+import numpy as np
+import yaml
+
+import config
+import decision
+from model import MotionModel
+from security_system import MotionDetector
+
+LOGGER = logging.getLogger('backtest')
+CONF = config.load_config()
+
+# Pipeline stages and the parameters each depends on, including the
+# parameters of the stages before it
+STAGES = [
+    ('gray', ['frame_width', 'ksize']),
+    ('delta', ['frame_width', 'ksize', 'alpha']),
+    ('contours', ['frame_width', 'ksize', 'alpha', 'delta_thresh',
+                  'dilate_iterations']),
+    ('classify', ['frame_width', 'ksize', 'alpha', 'delta_thresh',
+                  'dilate_iterations', 'min_area', 'min_occupied_fraction']),
+]
+PARAMS = STAGES[-1][1]
+
+
+def index_samples(train_dir):
+    """Index the samples in the training directory and join them with their
+    tags
+
+    Args:
+        train_dir (str): Directory with the pickles and tag files
+
+    Returns:
+        list: Samples, dicts with the ts, path and label of each pickle
+    """
+    tags = {}
+    for path in glob.glob(os.path.join(train_dir, '*.txt')):
+        tag, _, ts = os.path.basename(path)[:-len('.txt')].partition('_')
+        if tag in ('True', 'False'):
+            tags[ts] = tag == 'True'
+
+    samples = []
+    for path in sorted(glob.glob(os.path.join(train_dir, '*.pkl'))):
+        classification, _, ts = os.path.basename(path)[:-len('.pkl')] \
+            .partition('_')
+        label = tags.get(ts)
+        if label is None and classification == 'unoccupied':
+            label = False
+        if label is None:
+            continue
+        samples.append({'ts': ts, 'path': path, 'label': label})
+    LOGGER.info('Indexed %s labelled samples in %s', len(samples), train_dir)
+    return samples
+
+
+def stage_key(stage_params, conf):
+    return tuple(
+        tuple(conf[p]) if isinstance(conf[p], list) else conf[p]
+        for p in stage_params
+    )
+
+
+class SampleReplay():
+
+    def __init__(self, sample, cache_dir=None):
+        """Initialize the SampleReplay class
+
+        Args:
+            sample (dict): Sample from index_samples
+            cache_dir (str, optional): Directory to cache the blurred gray
+                frames in between runs
+        """
+        self.sample = sample
+        self.cache_dir = cache_dir
+        with open(sample['path'], 'rb') as file_in:
+            data = pickle.load(file_in)
+        self.frames = data['frames']
+        self.pir = data.get('pir', [])
+
+        # stage name -> {params key: (result, seconds it took to compute)}
+        self.cache = {stage: {} for stage, _ in STAGES}
+
+    def run_stage(self, stage, conf, func):
+        """Run a stage, or return its cached result
+
+        Returns:
+            tuple: (Stage result, seconds the stage took to compute)
+        """
+        stage_params = dict(STAGES)[stage]
+        key = stage_key(stage_params, conf)
+        if key not in self.cache[stage]:
+            start = time.perf_counter()
+            result = func()
+            self.cache[stage][key] = (result, time.perf_counter() - start)
+        return self.cache[stage][key]
+
+    def gray(self, detector, conf):
+        cache_path = None
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir, '{}_{}_{}.npy'.format(
+                self.sample['ts'], detector.frame_width,
+                'x'.join(map(str, detector.ksize))))
+            if os.path.exists(cache_path):
+                return np.load(cache_path)
+
+        gray = np.stack([detector.process_frame(f) for f in self.frames])
+        if cache_path:
+            np.save(cache_path, gray)
+        return gray
+
+    def delta(self, detector, conf):
+        gray, _ = self.run_stage('gray', conf,
+                                 lambda: self.gray(detector, conf))
+        avg = gray[0].astype('float')
+        deltas = []
+        for frame in gray[1:]:
+            cv2.accumulateWeighted(frame, avg, detector.alpha)
+            deltas.append(detector.frame_delta(frame, avg))
+        return deltas
+
+    def contours(self, detector, conf):
+        deltas, _ = self.run_stage('delta', conf,
+                                   lambda: self.delta(detector, conf))
+        return [detector.find_contours(delta)[0] for delta in deltas]
+
+    def classify(self, detector, model, conf):
+        contours, _ = self.run_stage('contours', conf,
+                                     lambda: self.contours(detector, conf))
+        engine = decision.DecisionEngine(conf, clock=lambda: 0.0)
+        pir = self.pir[-1] if self.pir else None
+        confirmed = False
+        frames = zip(self.frames[1:], contours)
+        for i, (frame, frame_contours) in enumerate(frames):
+            occupied = model.classify(frame, frame_contours, self.pir)
+            person_prob = None
+            if occupied and engine.needs_person_prob:
+                person_prob = model.get_person_prob(frame, frame_contours)
+            result = engine.update(occupied, pir, person_prob,
+                                   now=i / conf['fps'])
+            confirmed = confirmed or result.state == decision.CONFIRMED
+        return confirmed
+
+    def run(self, conf):
+        """Replay the sample through the pipeline with the given parameters
+
+        Args:
+            conf (dict): Pipeline settings
+
+        Returns:
+            tuple: (predicted occupied, seconds of pipeline time the config
+                costs, including the time of cached stages)
+        """
+        detector = MotionDetector(conf)
+        model = MotionModel(conf)
+        predicted, _ = self.run_stage(
+            'classify', conf, lambda: self.classify(detector, model, conf))
+        cost = sum(self.cache[stage][stage_key(params, conf)][1]
+                   for stage, params in STAGES)
+        return predicted, cost
+
+
+def replay_sample(task):
+    """Replay a single sample with every config. Run in the worker pool.
+
+    Args:
+        task (tuple): (sample, list of configs, cache directory)
+
+    Returns:
+        list: (config index, label, predicted, seconds, frames) per config
+    """
+    sample, configs, cache_dir = task
+    try:
+        replay = SampleReplay(sample, cache_dir)
+    except Exception:
+        LOGGER.exception('Unable to load sample %s', sample['path'])
+        return []
+
+    results = []
+    for i, conf in enumerate(configs):
+        predicted, cost = replay.run(conf)
+        results.append((i, sample['label'], bool(predicted), cost,
+                        len(replay.frames)))
+    return results
+
+
+def build_configs(grid):
+    """Build the configs for every combination of the grid values
+
+    Args:
+        grid (dict): Parameter -> list of values to try
+
+    Returns:
+        list: Configs, config.yml settings with the grid values applied
+    """
+    names = sorted(grid)
+    configs = []
+    for values in itertools.product(*[grid[name] for name in names]):
+        conf = dict(CONF)
+        conf.update(zip(names, values))
+        configs.append(conf)
+    return configs
+
+
+def summarize(configs, results):
+    """Compute precision, recall and throughput per config
+
+    Args:
+        configs (list): Configs that were backtested
+        results (list): Results from replay_sample
+
+    Returns:
+        list: Summary dict per config
+    """
+    summaries = [{'tp': 0, 'fp': 0, 'fn': 0, 'tn': 0, 'seconds': 0.0,
+                  'frames': 0} for _ in configs]
+    for i, label, predicted, cost, frames in results:
+        summary = summaries[i]
+        key = ('t' if predicted == label else 'f') + \
+            ('p' if predicted else 'n')
+        summary[key] += 1
+        summary['seconds'] += cost
+        summary['frames'] += frames
+
+    for conf, summary in zip(configs, summaries):
+        predicted_pos = summary['tp'] + summary['fp']
+        actual_pos = summary['tp'] + summary['fn']
+        summary['precision'] = summary['tp'] / predicted_pos \
+            if predicted_pos else 0.0
+        summary['recall'] = summary['tp'] / actual_pos if actual_pos else 0.0
+        summary['fps'] = summary['frames'] / summary['seconds'] \
+            if summary['seconds'] else 0.0
+        summary['params'] = {p: conf[p] for p in PARAMS}
+    return summaries
+
+
+def backtest(samples, grid, workers=None, cache_dir=None):
+    """Backtest every config of the grid over the samples
+
+    Args:
+        samples (list): Samples from index_samples
+        grid (dict): Parameter -> list of values to try
+        workers (int, optional): Number of processes. Defaults to the number
+            of CPUs
+        cache_dir (str, optional): Directory to cache the blurred gray frames
+
+    Returns:
+        list: Summary per config, see summarize
+    """
+    configs = build_configs(grid)
+    LOGGER.info('Backtesting %s configs over %s samples', len(configs),
+                len(samples))
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+
+    tasks = [(sample, configs, cache_dir) for sample in samples]
+    results = []
+    with Pool(workers) as pool:
+        for sample_results in pool.imap_unordered(replay_sample, tasks):
+            results.extend(sample_results)
+    return summarize(configs, results)
+
+
+def parse_grid(specs):
+    """Parse grid specs of the form `param=<yaml list>`
+
+    Args:
+        specs (list): i.e. ['min_area=[2000, 5000]', 'ksize=[[21, 21]]']
+
+    Returns:
+        dict: Parameter -> list of values
+    """
+    grid = {}
+    for spec in specs:
+        name, _, values = spec.partition('=')
+        if name not in PARAMS:
+            raise ValueError('Unknown parameter {}, expected one of {}'.format(
+                name, PARAMS))
+        values = yaml.safe_load(values)
+        grid[name] = values if isinstance(values, list) else [values]
+    return grid
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--train-dir', default=config.TRAIN_DIR)
+    parser.add_argument('--grid', nargs='*', default=[],
+                        help='param=<yaml list of values>')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--cache-dir', default=None,
+                        help='Cache blurred gray frames between runs')
+    args = parser.parse_args()
+
+    samples = index_samples(args.train_dir)
+    summaries = backtest(samples, parse_grid(args.grid), args.workers,
+                         args.cache_dir)
+
+    summaries.sort(key=lambda s: (s['precision'] + s['recall']), reverse=True)
+    print('{:>9} {:>9} {:>4} {:>4} {:>4} {:>4} {:>9}  {}'.format(
+        'precision', 'recall', 'tp', 'fp', 'fn', 'tn', 'frames/s', 'params'))
+    for s in summaries:
+        print('{:>9.3f} {:>9.3f} {:>4} {:>4} {:>4} {:>4} {:>9.1f}  {}'.format(
+            s['precision'], s['recall'], s['tp'], s['fp'], s['fn'], s['tn'],
+            s['fps'], s['params']))
+
+
+if __name__ == '__main__':
+    main()
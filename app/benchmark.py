@@ -0,0 +1,776 @@
+"""
+Micro-benchmarks for the hot paths of the security system. Run from the app
+directory, i.e.
+
+    python3 benchmark.py tail --iterations 200
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+
+import log_tail
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(APP_DIR)
+
+COMPONENT_MODULES = ['security_system', 'who_is_home', 's3_upload']
+
+# Entry point module -> directory it is run from
+ENTRY_POINTS = {
+    'run_flask': REPO_DIR,
+    'security_system': APP_DIR,
+    'who_is_home': APP_DIR,
+    's3_upload': APP_DIR,
+}
+
+# Preload the heavy modules once, then fork a child per component, as the
+# supervisor does. Every process prints "ready" once its imports are done.
+SUPERVISED_STARTUP = """
+import importlib, os, sys
+import supervisor
+supervisor.Supervisor([]).preload_modules()
+for module in sys.argv[1:]:
+    if os.fork() == 0:
+        importlib.import_module(module)
+        print('ready', flush=True)
+        sys.stdin.read()
+        os._exit(0)
+print('ready', flush=True)
+sys.stdin.read()
+"""
+
+
+def timeit(func, iterations):
+    """Time a function call
+
+    Args:
+        func (callable): Function to call with no arguments
+        iterations (int): Number of calls
+
+    Returns:
+        float: Mean milliseconds per call
+    """
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+def report(name, results):
+    """Print the results of a benchmark
+
+    Args:
+        name (str): Benchmark name
+        results (dict): Label -> mean milliseconds per call
+    """
+    print('### {}'.format(name))
+    for label, value in results.items():
+        print('{:<40} {:>10.3f} ms'.format(label, value))
+
+
+def bench_tail(args):
+    """Compare the `tail` subprocess with the in-process log_tail.tail"""
+    line = '2018/11/10 12:00:00|INFO|security_system: Saving latest image\n'
+    with tempfile.NamedTemporaryFile('w', suffix='.log', delete=False) as tmp:
+        tmp.write(line * args.file_lines)
+    try:
+        def subprocess_tail():
+            proc = subprocess.Popen(
+                ['tail', '-n', str(args.num_lines), tmp.name],
+                stdout=subprocess.PIPE)
+            proc.stdout.read()
+            proc.wait()
+
+        results = {
+            'subprocess tail': timeit(subprocess_tail, args.iterations),
+            'log_tail.tail': timeit(
+                lambda: log_tail.tail(tmp.name, args.num_lines),
+                args.iterations),
+        }
+    finally:
+        os.remove(tmp.name)
+    report('tail -n {} of {} lines'.format(args.num_lines, args.file_lines),
+           results)
+
+
+def memory_mb(pids):
+    """Sum the memory of processes, using the proportional set size where
+    available so pages shared between forked processes are not double counted
+
+    Args:
+        pids (list): Process ids
+
+    Returns:
+        tuple: (total rss in MB, total pss in MB or None)
+    """
+    rss = pss = 0
+    for pid in pids:
+        info = psutil.Process(pid).memory_full_info()
+        rss += info.rss
+        pss = None if pss is None or not hasattr(info, 'pss') \
+            else pss + info.pss
+    return rss / 1024 / 1024, pss / 1024 / 1024 if pss is not None else None
+
+
+def measure_startup(commands, ready_per_command):
+    """Start commands and wait until each has printed <ready_per_command>
+    "ready" lines
+
+    Args:
+        commands (list): Commands to start
+        ready_per_command (int): Number of "ready" lines to wait for from
+            each command
+
+    Returns:
+        tuple: (seconds until ready, total rss MB, total pss MB)
+    """
+    start = time.perf_counter()
+    procs = [subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                              stdout=subprocess.PIPE) for cmd in commands]
+    try:
+        for proc in procs:
+            ready = 0
+            while ready < ready_per_command:
+                line = proc.stdout.readline()
+                if not line:
+                    raise RuntimeError('Process {} exited before it was '
+                                       'ready'.format(proc.pid))
+                if line.strip() == b'ready':
+                    ready += 1
+        elapsed = time.perf_counter() - start
+        pids = []
+        for proc in procs:
+            parent = psutil.Process(proc.pid)
+            pids.extend([proc.pid] + [c.pid for c in parent.children()])
+        rss, pss = memory_mb(pids)
+    finally:
+        for proc in procs:
+            proc.stdin.close()
+            proc.wait()
+    return elapsed, rss, pss
+
+
+def bench_startup(args):
+    """Compare cold start time and memory of separately launched components
+    with components forked from the supervisor"""
+    modules = args.modules
+    separate = [
+        [sys.executable, '-c',
+         'import {}, sys; print("ready", flush=True); sys.stdin.read()'.format(
+             module)]
+        for module in modules
+    ]
+    supervised = [[sys.executable, '-c', SUPERVISED_STARTUP] + modules]
+
+    print('### cold start of {}'.format(', '.join(modules)))
+    print('{:<20} {:>10} {:>10} {:>10}'.format('', 'seconds', 'rss MB',
+                                               'pss MB'))
+    for label, commands, ready_per_command in [
+            ('separate', separate, 1),
+            ('supervised', supervised, len(modules) + 1)]:
+        elapsed, rss, pss = measure_startup(commands, ready_per_command)
+        print('{:<20} {:>10.2f} {:>10.1f} {:>10}'.format(
+            label, elapsed, rss, '-' if pss is None else '{:.1f}'.format(pss)))
+
+
+def import_time(module, cwd):
+    """Measure the import time of a module with `python -X importtime`
+
+    Args:
+        module (str): Module to import
+        cwd (str): Directory to run the import from
+
+    Returns:
+        tuple: (total microseconds, list of (cumulative microseconds, module)
+            for every imported module)
+    """
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    imports = []
+    total = None
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(cumulative)
+        except ValueError:
+            continue # header line
+        imports.append((cumulative, name.strip()))
+        if name.strip() == module:
+            total = cumulative
+    if proc.returncode != 0:
+        print('Importing {} failed:\n{}'.format(module, proc.stderr[-2000:]))
+    return total, imports
+
+
+def bench_importtime(args):
+    """Measure the import time of each entry point with -X importtime"""
+    for module in args.modules:
+        total, imports = import_time(module, ENTRY_POINTS.get(module, APP_DIR))
+        if total is None:
+            continue
+        print('### {}: {:.1f} ms'.format(module, total / 1000))
+        top_level = [(cumulative, name) for cumulative, name in imports
+                     if '.' not in name and name != module]
+        for cumulative, name in sorted(top_level, reverse=True)[:args.top]:
+            print('{:<40} {:>10.1f} ms'.format(name, cumulative / 1000))
+
+
+def bench_encode(args):
+    """Compare the latency and cpu cost of the JPEG encoders"""
+    import numpy as np
+    import encoder
+
+    width, height = args.resolution
+    rng = np.random.RandomState(0)
+    # smooth gradient plus noise, roughly as compressible as a camera frame
+    base = np.linspace(0, 255, width * height * 3).reshape(height, width, 3)
+    frames = [np.clip(base + rng.normal(0, 10, base.shape), 0, 255)
+              .astype(np.uint8) for _ in range(8)]
+
+    def measure(encode):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for i in range(args.iterations):
+            encode(frames[i % len(frames)])
+        return ((time.perf_counter() - wall) * 1000 / args.iterations,
+                (time.process_time() - cpu) * 1000 / args.iterations)
+
+    encoders = [('cpu, calling thread', encoder.CPUEncoder(args.quality),
+                 'encode_now'),
+                ('cpu, worker thread', encoder.CPUEncoder(args.quality),
+                 'encode')]
+    camera = None
+    if args.hardware:
+        import picamera
+        camera = picamera.PiCamera(resolution=(width, height), framerate=10)
+        time.sleep(2)
+        encoders.append(('hardware mjpeg', encoder.HardwareEncoder(
+            camera, quality=args.quality), 'encode'))
+
+    print('### jpeg encode of {}x{} frames'.format(width, height))
+    print('{:<30} {:>12} {:>12}'.format('', 'latency ms', 'cpu ms'))
+    try:
+        for label, jpeg_encoder, method in encoders:
+            func = getattr(jpeg_encoder, method)
+            if method == 'encode':
+                latency, cpu = measure(lambda f: func(f).result())
+            else:
+                latency, cpu = measure(func)
+            print('{:<30} {:>12.2f} {:>12.2f}'.format(label, latency, cpu))
+            jpeg_encoder.close()
+    finally:
+        if camera is not None:
+            camera.close()
+
+
+def bench_capture(args):
+    """Compare the frame rate and cpu cost of the bgr and yuv capture
+    formats"""
+    import numpy as np
+
+    import config
+    from security_system import MotionDetector
+
+    conf = dict(config.load_config(), resolution=args.resolution)
+    width, height = args.resolution
+    rng = np.random.RandomState(0)
+    bgr = rng.randint(0, 255, (height, width, 3), dtype=np.uint8)
+    detector = MotionDetector(dict(conf, capture_format='yuv'))
+    luma_width, luma_height = detector.detection_size()
+    luma = rng.randint(0, 255, (luma_height, luma_width), dtype=np.uint8)
+    report('process_frame, {}x{} frames'.format(width, height), {
+        'bgr, resize + gray + blur': timeit(
+            lambda: detector.process_frame(bgr), args.iterations),
+        'yuv luma plane, blur': timeit(
+            lambda: detector.process_frame(luma), args.iterations),
+    })
+    if not args.camera:
+        return
+
+    print('### camera capture, {} frames at up to {} fps'.format(
+        args.frames, args.fps))
+    print('{:<10} {:>10} {:>12}'.format('format', 'fps', 'cpu ms'))
+    for capture_format in ('bgr', 'yuv'):
+        detector = MotionDetector(dict(
+            conf, fps=args.fps, capture_format=capture_format))
+        detector.read_pir = lambda: 0
+        stream = detector.stream()
+        next(stream)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        for _ in range(args.frames):
+            next(stream)
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        stream.close()
+        print('{:<10} {:>10.1f} {:>12.2f}'.format(
+            capture_format, args.frames / wall, cpu * 1000 / args.frames))
+
+
+def night_frames(args):
+    """Synthetic night scene: a dark gradient with sensor noise, and a dim
+    square moving across it for the second half of the frames. The noise of
+    a high gain exposure is blotchy, which the blur doesn't remove, so most
+    of it is generated at 1/16th of the resolution and scaled up
+
+    Returns:
+        list: (luma frame, square bounding box or None)
+    """
+    import cv2
+    import numpy as np
+
+    width, height = args.resolution
+    rng = np.random.RandomState(0)
+    scene = np.tile(np.linspace(10, 40, width), (height, 1))
+    size = height // 4
+    frames = []
+    for i in range(args.frames):
+        blotches = cv2.resize(
+            rng.normal(0, args.noise, (height // 16, width // 16)),
+            (width, height), interpolation=cv2.INTER_CUBIC)
+        frame = scene + blotches + rng.normal(0, args.noise, scene.shape)
+        box = None
+        if i >= args.frames // 2:
+            x = (i * 8) % (width - size)
+            box = (x, height // 3, size, size)
+            frame[box[1]:box[1] + size, x:x + size] += args.contrast
+        frames.append((np.clip(frame, 0, 255).astype(np.uint8), box))
+    return frames
+
+
+def bench_lowlight(args):
+    """Compare the cpu cost per frame, noise contours and detections of the
+    motion detector on noisy night frames, without and with low-light mode
+    """
+    import cv2
+
+    import config
+    import low_light
+    from security_system import MotionDetector
+
+    conf = dict(config.load_config(), resolution=args.resolution,
+                capture_format='yuv')
+    frames = night_frames(args)
+    print('### {} night frames, {}x{}, noise sigma {}'.format(
+        len(frames), args.resolution[0], args.resolution[1], args.noise))
+    print('{:<10} {:>10} {:>10} {:>14} {:>10}'.format(
+        'mode', 'cpu ms', 'threshold', 'noise contours', 'detected'))
+    for mode in ('day', 'low-light'):
+        detector = MotionDetector(conf)
+        if mode == 'low-light':
+            detector.low_light = low_light.LowLightController(conf)
+        scale = detector.frame_width / args.resolution[0]
+        noise_contours = detected = moving = 0
+        cpu = time.process_time()
+        for frame, box in frames:
+            gray = detector.process_frame(frame)
+            if detector.low_light is not None:
+                gray, restart = detector.low_light.process(gray)
+                if restart:
+                    detector.avg = None
+            if detector.avg is None:
+                detector.avg = gray.astype('float')
+                continue
+            cv2.accumulateWeighted(gray, detector.avg, detector.alpha)
+            contours, _ = detector.compare_frame(gray, detector.avg)
+            if box is None:
+                noise_contours += len(contours)
+                continue
+            moving += 1
+            left = box[0] * scale
+            right = (box[0] + box[2]) * scale
+            detected += any(
+                c['coords'][0] < right and
+                c['coords'][0] + c['coords'][2] > left for c in contours)
+        cpu = time.process_time() - cpu
+        print('{:<10} {:>10.2f} {:>10} {:>14.1f} {:>10.2f}'.format(
+            mode, cpu * 1000 / len(frames), detector.threshold(),
+            noise_contours / max(1, len(frames) - moving),
+            detected / max(1, moving)))
+
+
+def https_stub(directory):
+    """Start a local HTTPS server that answers every POST like the Slack
+    API, with keep-alive connections and a self-signed certificate
+
+    Args:
+        directory (str): Directory to write the certificate to
+
+    Returns:
+        tuple: (server, url, certificate path)
+    """
+    import ssl
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    cert = os.path.join(directory, 'stub.pem')
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-days', '1', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost',
+         '-keyout', cert, '-out', cert],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # the headers and body are written separately
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            body = b'{"ok": true, "ts": "1.0"}'
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'https://localhost:{}/api/'.format(
+        server.server_address[1]), cert
+
+
+def bench_http(args):
+    """Compare a connection per Slack call with the shared keep-alive
+    session, against a local HTTPS stub"""
+    import requests
+
+    from utils import http
+
+    with tempfile.TemporaryDirectory() as directory:
+        server, url, cert = https_stub(directory)
+        data = {'channel': 'C0', 'text': 'Motion detected'}
+        try:
+            report('slack chat.postMessage to a local https stub', {
+                'new connection per call': timeit(
+                    lambda: requests.post(url + 'chat.postMessage',
+                                          data=data, verify=cert),
+                    args.iterations),
+                'shared session': timeit(
+                    lambda: http.request('POST', url + 'chat.postMessage',
+                                         endpoint='slack chat.postMessage',
+                                         data=data, verify=cert),
+                    args.iterations),
+            })
+            print(http.format_metrics())
+        finally:
+            server.shutdown()
+
+
+def load_labelled_frames(train_dir, max_samples):
+    """Load the last frame and contours of the tagged training samples
+
+    Args:
+        train_dir (str): Training data directory, defaults to config.TRAIN_DIR
+        max_samples (int): Maximum number of samples to load
+
+    Returns:
+        list: (label, frame, contours) per sample
+    """
+    import pickle
+
+    import backtest
+    import config
+
+    train_dir = train_dir or config.TRAIN_DIR
+    data = []
+    for sample in backtest.index_samples(train_dir)[:max_samples]:
+        with open(sample['path'], 'rb') as file_in:
+            pickled = pickle.load(file_in)
+        data.append((sample['label'], pickled['frame'], pickled['contours']))
+    if not data:
+        print('No labelled samples in {}'.format(train_dir))
+    return data
+
+
+def detection_rates(probs, threshold):
+    """Returns:
+        tuple: (recall, false positive rate) of (label, probability) pairs
+    """
+    positives = [p >= threshold for label, p in probs if label]
+    negatives = [p >= threshold for label, p in probs if not label]
+    recall = sum(positives) / len(positives) if positives else 0.0
+    fp_rate = sum(negatives) / len(negatives) if negatives else 0.0
+    return recall, fp_rate
+
+
+def bench_inference(args):
+    """Compare full frame and contour crop person detection on the tagged
+    training samples"""
+    import config
+    from model import MotionModel
+
+    data = load_labelled_frames(args.train_dir, args.max_samples)
+    if not data:
+        return
+
+    print('### person detection over {} samples'.format(len(data)))
+    print('{:<10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'mode', 'ms/frame', 'passes', 'recall', 'fp rate'))
+    for mode in ('full', 'crop'):
+        conf = dict(config.load_config(), inference_mode=mode)
+        model = MotionModel(conf)
+        model.model  # load outside of the timings
+
+        passes = 0
+        forward = model.forward
+
+        def counted_forward(images):
+            nonlocal passes
+            passes += 1
+            return forward(images)
+        model.forward = counted_forward
+
+        start = time.perf_counter()
+        probs = [(label, model.get_person_prob(frame, contours))
+                 for label, frame, contours in data]
+        elapsed = (time.perf_counter() - start) * 1000 / len(data)
+
+        recall, fp_rate = detection_rates(probs, args.threshold)
+        print('{:<10} {:>10.2f} {:>10} {:>10.3f} {:>10.3f}'.format(
+            mode, elapsed, passes, recall, fp_rate))
+
+
+def run_detector(task):
+    """Load a detector backend and run it over the samples. Run in a fresh
+    process per backend, so the memory of one doesn't count towards another
+
+    Args:
+        task (tuple): (backend, threads, samples, threshold)
+
+    Returns:
+        tuple: (load seconds, MB added by loading, ms per frame, recall,
+            false positive rate)
+    """
+    import config
+    import detector
+
+    backend, threads, data, threshold = task
+    settings = dict(config.load_config().get('detector', {}),
+                    backend=backend, threads=threads)
+    process = psutil.Process()
+    rss = process.memory_info().rss
+    start = time.perf_counter()
+    person_detector = detector.build_detector(settings)
+    load_seconds = time.perf_counter() - start
+    load_mb = (process.memory_info().rss - rss) / 1024 / 1024
+
+    start = time.perf_counter()
+    probs = [(label, person_detector.person_prob([frame]))
+             for label, frame, _ in data]
+    elapsed = (time.perf_counter() - start) * 1000 / len(data)
+    return (load_seconds, load_mb, elapsed) + \
+        detection_rates(probs, threshold)
+
+
+def bench_detector(args):
+    """Compare the latency, memory and accuracy of the person detector
+    backends on the tagged training samples, on the cpu"""
+    import multiprocessing
+
+    data = load_labelled_frames(args.train_dir, args.max_samples)
+    if not data:
+        return
+
+    print('### person detector backends over {} samples, {} threads'.format(
+        len(data), args.threads))
+    print('{:<12} {:>8} {:>8} {:>10} {:>8} {:>8}'.format(
+        'backend', 'load s', 'load MB', 'ms/frame', 'recall', 'fp rate'))
+    context = multiprocessing.get_context('spawn')
+    for backend in args.backends:
+        with context.Pool(1) as pool:
+            try:
+                result = pool.apply(run_detector, (
+                    (backend, args.threads, data, args.threshold),))
+            except Exception as e:
+                print('{:<12} unavailable: {}'.format(backend, e))
+                continue
+        print('{:<12} {:>8.2f} {:>8.1f} {:>10.2f} {:>8.3f} {:>8.3f}'.format(
+            backend, *result))
+
+
+def bench_decision(args):
+    """Measure how many frames per second the decision engine can replay"""
+    import random
+
+    import config
+    import decision
+
+    rng = random.Random(0)
+    # bursts of motion between quiet stretches
+    evidence = [(rng.random() < (0.8 if (i // 100) % 3 == 0 else 0.05),
+                 rng.random() < 0.3, rng.random())
+                for i in range(args.frames)]
+
+    engine = decision.DecisionEngine(config.load_config(),
+                                     clock=lambda: 0.0)
+    fps = config.load_config()['fps']
+
+    def replay():
+        for i, (contour, pir, person_prob) in enumerate(evidence):
+            engine.update(contour, pir, person_prob, now=i / fps)
+
+    ms = timeit(replay, args.iterations)
+    print('### decision engine')
+    print('{:<40} {:>10.0f} frames/s'.format(
+        'update', args.frames * 1000 / ms))
+
+
+def bench_thumbnails(args):
+    """Compare the thumbnail rendering time against the frame buffer size"""
+    import cv2
+    import numpy as np
+
+    import thumbnails
+
+    width, height = args.resolution
+    rng = np.random.RandomState(0)
+    frames = [rng.randint(0, 255, (height, width, 3), dtype=np.uint8)
+              for _ in range(max(args.buffer_sizes))]
+
+    def per_frame_sheet(buffer):
+        small = [cv2.resize(f, (args.width, args.width * height // width))
+                 for f in buffer]
+        rows = [np.concatenate(small[i:i + 6], axis=1)
+                for i in range(0, len(small) - len(small) % 6, 6)]
+        return np.concatenate(rows, axis=0)
+
+    def downsample_sheet(buffer):
+        return thumbnails.contact_sheet(
+            thumbnails.downsample(buffer, args.width)[0], 6)
+
+    print('### thumbnails of {}x{} frames, {}px wide'.format(
+        width, height, args.width))
+    print('{:<8} {:>14} {:>14} {:>10} {:>10}'.format(
+        'frames', 'per-frame ms', 'downsample ms', 'gif ms', 'webp ms'))
+    for size in args.buffer_sizes:
+        buffer = frames[:size]
+        small = thumbnails.downsample(buffer, args.width)[0]
+        results = [timeit(lambda: per_frame_sheet(buffer), args.iterations),
+                   timeit(lambda: downsample_sheet(buffer),
+                          args.iterations)]
+        for image_format in ('GIF', 'WEBP'):
+            try:
+                results.append(timeit(lambda: thumbnails.encode_animation(
+                    small, 5, image_format), args.iterations))
+            except (ImportError, OSError, KeyError):
+                results.append(float('nan'))
+        print('{:<8} {:>14.2f} {:>14.2f} {:>10.2f} {:>10.2f}'.format(
+            size, *results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    tail_parser = subparsers.add_parser('tail', help=bench_tail.__doc__)
+    tail_parser.add_argument('--iterations', type=int, default=200)
+    tail_parser.add_argument('--num-lines', type=int, default=50)
+    tail_parser.add_argument('--file-lines', type=int, default=100000)
+    tail_parser.set_defaults(func=bench_tail)
+
+    startup_parser = subparsers.add_parser('startup',
+                                           help=bench_startup.__doc__)
+    startup_parser.add_argument('--modules', nargs='+',
+                                default=COMPONENT_MODULES)
+    startup_parser.set_defaults(func=bench_startup)
+
+    importtime_parser = subparsers.add_parser(
+        'importtime', help=bench_importtime.__doc__)
+    importtime_parser.add_argument('--modules', nargs='+',
+                                   default=list(ENTRY_POINTS))
+    importtime_parser.add_argument('--top', type=int, default=10)
+    importtime_parser.set_defaults(func=bench_importtime)
+
+    encode_parser = subparsers.add_parser('encode', help=bench_encode.__doc__)
+    encode_parser.add_argument('--iterations', type=int, default=100)
+    encode_parser.add_argument('--resolution', type=int, nargs=2,
+                               default=[640, 480])
+    encode_parser.add_argument('--quality', type=int, default=90)
+    encode_parser.add_argument('--hardware', action='store_true',
+                               help='Include the camera MJPEG encoder')
+    encode_parser.set_defaults(func=bench_encode)
+
+    capture_parser = subparsers.add_parser('capture',
+                                           help=bench_capture.__doc__)
+    capture_parser.add_argument('--iterations', type=int, default=200)
+    capture_parser.add_argument('--resolution', type=int, nargs=2,
+                                default=[640, 480])
+    capture_parser.add_argument('--camera', action='store_true',
+                                help='Also stream from the camera')
+    capture_parser.add_argument('--frames', type=int, default=300)
+    capture_parser.add_argument('--fps', type=int, default=30)
+    capture_parser.set_defaults(func=bench_capture)
+
+    lowlight_parser = subparsers.add_parser('lowlight',
+                                            help=bench_lowlight.__doc__)
+    lowlight_parser.add_argument('--frames', type=int, default=200)
+    lowlight_parser.add_argument('--resolution', type=int, nargs=2,
+                                 default=[640, 480])
+    lowlight_parser.add_argument('--noise', type=float, default=6,
+                                 help='Sensor noise standard deviation')
+    lowlight_parser.add_argument('--contrast', type=float, default=25,
+                                 help='Luma of the moving square over the '
+                                 'scene')
+    lowlight_parser.set_defaults(func=bench_lowlight)
+
+    http_parser = subparsers.add_parser('http', help=bench_http.__doc__)
+    http_parser.add_argument('--iterations', type=int, default=50)
+    http_parser.set_defaults(func=bench_http)
+
+    inference_parser = subparsers.add_parser(
+        'inference', help=bench_inference.__doc__)
+    inference_parser.add_argument('--train-dir', default=None)
+    inference_parser.add_argument('--max-samples', type=int, default=200)
+    inference_parser.add_argument('--threshold', type=float, default=0.5)
+    inference_parser.set_defaults(func=bench_inference)
+
+    detector_parser = subparsers.add_parser(
+        'detector', help=bench_detector.__doc__)
+    detector_parser.add_argument(
+        '--backends', nargs='+', default=['opencv', 'onnxruntime', 'tflite'])
+    detector_parser.add_argument('--threads', type=int, default=4)
+    detector_parser.add_argument('--train-dir', default=None)
+    detector_parser.add_argument('--max-samples', type=int, default=200)
+    detector_parser.add_argument('--threshold', type=float, default=0.5)
+    detector_parser.set_defaults(func=bench_detector)
+
+    decision_parser = subparsers.add_parser(
+        'decision', help=bench_decision.__doc__)
+    decision_parser.add_argument('--frames', type=int, default=100000)
+    decision_parser.add_argument('--iterations', type=int, default=5)
+    decision_parser.set_defaults(func=bench_decision)
+
+    thumbnails_parser = subparsers.add_parser(
+        'thumbnails', help=bench_thumbnails.__doc__)
+    thumbnails_parser.add_argument('--buffer-sizes', type=int, nargs='+',
+                                   default=[6, 12, 30, 60])
+    thumbnails_parser.add_argument('--resolution', type=int, nargs=2,
+                                   default=[640, 480])
+    thumbnails_parser.add_argument('--width', type=int, default=160)
+    thumbnails_parser.add_argument('--iterations', type=int, default=10)
+    thumbnails_parser.set_defaults(func=bench_thumbnails)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
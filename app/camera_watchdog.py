@@ -0,0 +1,234 @@
+"""
+Camera watchdog. Tracks when frames arrive from the camera and when the
+camera loop last made progress, so the security system can recover from a
+hung or failing camera in the same process, keeping the model and the
+background average, instead of waiting for the supervisor to restart it.
+
+    stall         no frame within stall_seconds. picamera raises once its
+                  CAPTURE_TIMEOUT (set to stall_seconds) expires
+    fps collapse  frames arrive at less than min_fps_fraction of the
+                  configured fps for collapse_seconds
+
+Either way, and on any picamera error, MotionDetector.stream closes and
+reopens the camera, with a backoff, and gives up (letting the supervisor
+restart the process) after max_failures attempts in a row without a fully
+processed frame. Errors while processing a frame aren't camera failures,
+they stop the process.
+
+The metrics (seconds since the last frame, fps, recoveries...) are
+published to redis under camera_health every publish_seconds, for /status,
+with the time they were published at so a dead process shows as stale.
+"""
+import collections
+import logging
+import threading
+import time
+
+try:
+    from app import config
+    from app import utils
+except ImportError:
+    import config
+    import utils
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+# Seconds of frame arrivals the fps is measured over
+FPS_WINDOW = 5
+
+
+class CameraStalled(RuntimeError):
+    pass
+
+
+class CameraWatchdog(threading.Thread):
+
+    def __init__(self, conf=None, publish=None, clock=time.monotonic):
+        """Initialize the CameraWatchdog class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml
+            publish (callable, optional): Called with the metrics dict every
+                publish_seconds. Defaults to storing them in redis
+            clock (callable, optional): Returns the current time in seconds
+        """
+        super(CameraWatchdog, self).__init__(name='watchdog', daemon=True)
+        conf = conf or CONF
+        settings = conf.get('watchdog', {})
+        self.expected_fps = conf['fps']
+        self.stall_seconds = settings.get('stall_seconds', 10)
+        self.min_fps_fraction = settings.get('min_fps_fraction', 0.3)
+        self.collapse_seconds = settings.get('collapse_seconds', 30)
+        self.max_failures = settings.get('max_failures', 5)
+        self.backoff_seconds = settings.get('backoff_seconds', 2)
+        self.publish_seconds = settings.get('publish_seconds', 5)
+        self.publish = publish or (
+            lambda metrics: utils.redis_set('camera_health', metrics))
+        self.clock = clock
+
+        self.arrivals = collections.deque()
+        self.streaming = False
+        self.started = None
+        self.last_frame = None
+        self.last_beat = None
+        self.low_fps_since = None
+        self.failures = 0
+
+        self.recoveries = 0
+        self.stalls = 0
+        self.fps_collapses = 0
+        self.errors = 0
+        self.last_error = None
+        self._stopped = threading.Event()
+
+    def camera_started(self):
+        """Called once the camera is open, before the first frame"""
+        self.streaming = True
+        self.started = self.clock()
+        self.arrivals.clear()
+        self.low_fps_since = None
+
+    def camera_stopped(self):
+        self.streaming = False
+
+    def fps(self):
+        """Frames per second over the last FPS_WINDOW seconds"""
+        if len(self.arrivals) < 2:
+            return 0.0
+        return (len(self.arrivals) - 1) / max(
+            self.arrivals[-1] - self.arrivals[0], 1e-6)
+
+    def frame(self):
+        """Record a frame arrival. Called by the camera loop
+
+        Raises:
+            CameraStalled: The fps collapsed for collapse_seconds
+        """
+        now = self.clock()
+        self.last_frame = now
+        self.arrivals.append(now)
+        while self.arrivals[0] < now - FPS_WINDOW:
+            self.arrivals.popleft()
+
+        if now - self.started < FPS_WINDOW:
+            return
+        if self.fps() >= self.min_fps_fraction * self.expected_fps:
+            self.low_fps_since = None
+            return
+        if self.low_fps_since is None:
+            self.low_fps_since = now
+        elif now - self.low_fps_since >= self.collapse_seconds:
+            self.fps_collapses += 1
+            raise CameraStalled('Camera at {:.1f} fps for {:.0f}s'.format(
+                self.fps(), now - self.low_fps_since))
+
+    def beat(self):
+        """Record that the camera loop processed a frame, ending a run of
+        failures
+        """
+        self.last_beat = self.clock()
+        self.failures = 0
+
+    def failed(self, error):
+        """Record a camera failure
+
+        Args:
+            error (Exception): Error the stream stopped with
+
+        Returns:
+            float: Seconds to wait before reopening the camera
+
+        Raises:
+            CameraStalled: After max_failures failures without a processed
+                frame
+        """
+        self.streaming = False
+        self.failures += 1
+        self.last_error = repr(error)
+        if isinstance(error, CameraStalled):
+            pass
+        elif 'timed out' in str(error).lower():
+            self.stalls += 1
+        else:
+            self.errors += 1
+        if self.failures > self.max_failures:
+            raise CameraStalled('Camera failed {} times in a row'.format(
+                self.failures - 1)) from error
+        self.recoveries += 1
+        return min(self.backoff_seconds * 2 ** (self.failures - 1), 60)
+
+    def metrics(self):
+        """Returns:
+            dict: Watchdog metrics
+        """
+        now = self.clock()
+
+        def since(last):
+            return round(now - last, 1) if last is not None else None
+
+        return {
+            'published': time.time(),
+            'publish_seconds': self.publish_seconds,
+            'streaming': self.streaming,
+            'seconds_since_frame': since(self.last_frame),
+            'seconds_since_beat': since(self.last_beat),
+            'fps': round(self.fps(), 1),
+            'recoveries': self.recoveries,
+            'stalls': self.stalls,
+            'fps_collapses': self.fps_collapses,
+            'errors': self.errors,
+            'last_error': self.last_error,
+        }
+
+    def run(self):
+        warned = False
+        while not self._stopped.wait(self.publish_seconds):
+            metrics = self.metrics()
+            stalled = self.streaming and \
+                (metrics['seconds_since_frame'] or 0) > self.stall_seconds
+            if stalled and not warned:
+                if (self.last_beat or 0) < self.last_frame:
+                    # the frame arrived, but its processing never finished
+                    LOGGER.warning('Camera loop stuck on a frame for %ss',
+                                   metrics['seconds_since_frame'])
+                else:
+                    LOGGER.warning('No camera frame in %ss',
+                                   metrics['seconds_since_frame'])
+            warned = stalled
+            try:
+                self.publish(metrics)
+            except Exception:
+                LOGGER.exception('Unable to publish the camera metrics')
+
+    def stop(self):
+        self._stopped.set()
+
+
+def health_status(metrics, now=None):
+    """Format the metrics published by the watchdog
+
+    Args:
+        metrics (dict): Watchdog metrics, None if nothing was published
+        now (float, optional): Epoch seconds, defaults to now
+
+    Returns:
+        str: Summary for /status
+    """
+    if not isinstance(metrics, dict) or 'published' not in metrics:
+        return 'unknown'
+    age = (time.time() if now is None else now) - metrics['published']
+    if age > 3 * metrics['publish_seconds']:
+        # the security system stopped publishing, it's likely not running
+        state = 'no update in {:.0f}s'.format(age)
+    elif not metrics['streaming']:
+        state = 'camera off'
+    else:
+        since_frame = metrics['seconds_since_frame']
+        if since_frame is not None:
+            since_frame = round(since_frame + age, 1)
+        state = 'last frame {}s ago, {} fps'.format(
+            since_frame, metrics['fps'])
+    return '{}, {} recoveries ({} stalls, {} fps collapses, {} errors)'.format(
+        state, metrics['recoveries'], metrics['stalls'],
+        metrics['fps_collapses'], metrics['errors'])
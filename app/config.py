@@ -1,19 +1,28 @@
+import collections
+import copy
 import os
 import logging
+import logging.config
+import threading
 from datetime import datetime
 
 import yaml
 
 CURR_DIR = os.path.dirname(__file__)
 IMG_DIR = os.path.join(CURR_DIR, 'imgs')
-CONF_DIR = os.path.join(CURR_DIR, 'config')
+# Overridden to run against other settings, i.e. by soak_test.py
+CONF_DIR = os.environ.get('RPI_SECURITY_CONF_DIR',
+                          os.path.join(CURR_DIR, 'config'))
 LOG_DIR = os.path.join(CURR_DIR, 'logs')
 TRAIN_DIR = os.path.join(CURR_DIR, 'train-data')
 MODEL_DIR = os.path.join(CURR_DIR, 'model-files')
+DATA_DIR = os.path.join(CURR_DIR, 'data')
 
 MAIN_CONF_PATH = os.path.join(CONF_DIR, 'config.yml')
 PRIVATE_CONF_PATH = os.path.join(CONF_DIR, 'private.yml')
 
+LOGGER = logging.getLogger(__name__)
+
 def read_yaml(yaml_file):
     """Read a yaml file.
 
@@ -30,11 +39,204 @@ def read_yaml(yaml_file):
 
     return data
 
+# path -> ((mtime, size), parsed contents), see load_yaml
+_CACHE = {}
+_CACHE_LOCK = threading.Lock()
+
+def file_version(path):
+    """Returns:
+        tuple: (mtime in ns, size) of the file, which changes when it's
+        edited or replaced
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+def load_yaml(path):
+    """Read a yaml file, parsing it only once until it changes
+
+    Args:
+        path (str): Full path of the yaml file
+
+    Returns:
+        dict: Copy of the file contents, safe to modify
+    """
+    version = file_version(path)
+    with _CACHE_LOCK:
+        cached = _CACHE.get(path)
+        if cached is None or cached[0] != version:
+            cached = (version, read_yaml(path))
+            _CACHE[path] = cached
+    return copy.deepcopy(cached[1])
+
 def load_config():
-    return read_yaml(MAIN_CONF_PATH)
+    return load_yaml(MAIN_CONF_PATH)
 
 def load_private_config():
-    return read_yaml(PRIVATE_CONF_PATH)
+    return load_yaml(PRIVATE_CONF_PATH)
+
+
+class ConfigError(ValueError):
+    pass
+
+# type: expected type(s). check: returns True for valid values. reload:
+# whether a running security system applies changes, otherwise they need a
+# restart
+Field = collections.namedtuple('Field', ['type', 'check', 'reload'])
+
+def _positive(value):
+    return value > 0
+
+def _not_negative(value):
+    return value >= 0
+
+def _fraction(value):
+    return 0 <= value <= 1
+
+def _pair(check):
+    def check_pair(value):
+        return len(value) == 2 and all(
+            isinstance(v, int) and check(v) for v in value)
+    return check_pair
+
+def _one_of(*choices):
+    return lambda value: value in choices
+
+NUMBER = (int, float)
+
+SCHEMA = {
+    'min_save_seconds': Field(NUMBER, _not_negative, True),
+    'min_notify_seconds': Field(NUMBER, _not_negative, True),
+    'motion_classification_store_cnt': Field(int, _positive, True),
+    'min_occupied_fraction': Field(NUMBER, _fraction, True),
+    'train': Field(bool, None, False),
+    'min_area': Field(NUMBER, _not_negative, True),
+    'frame_store_cnt': Field(int, _positive, True),
+    'pir_store_cnt': Field(int, _positive, True),
+    'alpha': Field(NUMBER, lambda v: 0 < v <= 1, True),
+    'dilate_iterations': Field(int, _not_negative, True),
+    # Gaussian kernels must have odd sizes
+    'ksize': Field(list, _pair(lambda v: v > 0 and v % 2), True),
+    'delta_thresh': Field(int, lambda v: 0 <= v <= 255, True),
+    'resolution': Field(list, _pair(_positive), False),
+    'fps': Field(NUMBER, _positive, False),
+    'frame_width': Field(int, _positive, False),
+    'vflip': Field(bool, None, False),
+    'hflip': Field(bool, None, False),
+    'capture_format': Field(str, _one_of('bgr', 'yuv'), False),
+    'jpeg_encoder': Field(str, _one_of('cpu', 'hardware'), False),
+    'inference_mode': Field(str, _one_of('full', 'crop'), True),
+    'crop_padding': Field(NUMBER, _not_negative, True),
+    'max_crop_regions': Field(int, _not_negative, True),
+    'min_crop_area': Field(NUMBER, _not_negative, True),
+    'detector': Field(dict, None, True),
+    'decision': Field(dict, None, True),
+    'arming': Field(dict, None, True),
+}
+
+# Settings every component reads without a default
+REQUIRED = ['min_save_seconds', 'min_notify_seconds',
+            'motion_classification_store_cnt', 'min_occupied_fraction',
+            'train', 'min_area', 'frame_store_cnt', 'pir_store_cnt', 'alpha',
+            'dilate_iterations', 'ksize', 'delta_thresh', 'resolution',
+            'fps', 'frame_width', 'vflip', 'hflip']
+
+def validate(conf):
+    """Check the settings of config.yml against SCHEMA
+
+    Args:
+        conf (dict): Settings
+
+    Returns:
+        dict: The settings
+
+    Raises:
+        ConfigError: Listing every invalid setting
+    """
+    if not isinstance(conf, dict):
+        raise ConfigError('config.yml must be a mapping')
+    errors = ['{} is missing'.format(key) for key in REQUIRED
+              if key not in conf]
+    for key, field in SCHEMA.items():
+        if key not in conf:
+            continue
+        value = conf[key]
+        # bool is an int, but True is never a valid count or threshold
+        valid = isinstance(value, field.type) and (
+            field.type is bool or not isinstance(value, bool))
+        if valid and field.check is not None:
+            try:
+                valid = bool(field.check(value))
+            except TypeError:
+                valid = False
+        if not valid:
+            errors.append('{} has an invalid value {!r}'.format(key, value))
+    if errors:
+        raise ConfigError('Invalid config: {}'.format('; '.join(errors)))
+    return conf
+
+def changed_keys(old, new):
+    """Returns:
+        list: Top level settings that differ between the two configs
+    """
+    return sorted(key for key in set(old) | set(new)
+                  if old.get(key) != new.get(key))
+
+def restart_keys(keys):
+    """Returns:
+        list: Settings of <keys> that only take effect after a restart
+    """
+    return [key for key in keys
+            if key not in SCHEMA or not SCHEMA[key].reload]
+
+
+class ConfigWatcher(threading.Thread):
+
+    def __init__(self, path=MAIN_CONF_PATH, poll_seconds=None):
+        """Initialize the ConfigWatcher class. Loads and validates the
+        settings, so invalid settings fail at startup
+
+        Args:
+            path (str, optional): Yaml file to watch
+            poll_seconds (float, optional): Seconds between checks of the
+                file's modification time
+        """
+        super(ConfigWatcher, self).__init__(name='config', daemon=True)
+        self.path = path
+        self.version = file_version(path)
+        self.conf = validate(load_yaml(path))
+        self.poll_seconds = poll_seconds or \
+            self.conf.get('config_poll_seconds', 2)
+        self._stopped = threading.Event()
+
+    def check(self):
+        """Reload the settings if the file changed. The new settings replace
+        conf in one assignment, and only once they are valid
+
+        Returns:
+            bool: Whether new settings were loaded
+        """
+        version = file_version(self.path)
+        if version == self.version:
+            return False
+        self.version = version
+        try:
+            conf = validate(load_yaml(self.path))
+        except (yaml.YAMLError, ConfigError) as err:
+            LOGGER.error('Keeping the current settings: %s', err)
+            return False
+        self.conf = conf
+        return True
+
+    def run(self):
+        while not self._stopped.wait(self.poll_seconds):
+            try:
+                self.check()
+            except OSError:
+                # i.e. the file being replaced
+                LOGGER.exception('Unable to read %s', self.path)
+
+    def stop(self):
+        self._stopped.set()
 
 def init_logging(log_file=None):
     """Initialize the logging setup
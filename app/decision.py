@@ -0,0 +1,235 @@
+"""
+Decision engine that turns the per-frame evidence of the motion pipeline
+(PIR sensor, motion contours and person probability) into alerts.
+
+The evidence of every frame is fused into one weighted value, and the score
+is the mean of those values over a sliding window of the last <window>
+frames. A state machine with hysteresis decides on the score:
+
+    idle       no motion. A frame with evidence >= suspect_threshold moves
+               to suspect
+    suspect    some motion, not enough to alert. Moves to confirmed once the
+               score reaches confirm_threshold, back to idle on a quiet frame
+               once the score is below release_threshold
+    confirmed  alerting, at most once every min_notify_seconds. Moves to
+               cooldown once the score drops below release_threshold
+    cooldown   motion just stopped. Back to confirmed if the score reaches
+               confirm_threshold again, to idle after cooldown_seconds
+
+All the timers run on the monotonic clock, and the clock can be replaced so
+the backtests can replay recorded frames faster than real time.
+"""
+import collections
+import logging
+import time
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+IDLE = 'idle'
+SUSPECT = 'suspect'
+CONFIRMED = 'confirmed'
+COOLDOWN = 'cooldown'
+
+Decision = collections.namedtuple('Decision', ['state', 'score', 'alert'])
+
+
+class SlidingWindow():
+    """Mean of the last <size> values, updated in O(1) per value"""
+
+    def __init__(self, size):
+        self.size = size
+        self.values = collections.deque(maxlen=size)
+        self.total = 0.0
+        self.pushes = 0
+
+    def push(self, value):
+        if len(self.values) == self.size:
+            self.total -= self.values[0]
+        self.values.append(value)
+        self.total += value
+
+        # Recompute the sum once per window length, so the float error of
+        # the running sum doesn't build up
+        self.pushes += 1
+        if self.pushes >= self.size:
+            self.total = sum(self.values)
+            self.pushes = 0
+
+    def resize(self, size):
+        """Change the window length, keeping the most recent values"""
+        self.size = size
+        self.values = collections.deque(self.values, maxlen=size)
+        self.total = sum(self.values)
+        self.pushes = 0
+
+    def mean(self):
+        """Mean over the full window length, so a window that is still
+        filling up (i.e. after the camera starts) scores low
+        """
+        return self.total / self.size
+
+    def clear(self):
+        self.values.clear()
+        self.total = 0.0
+        self.pushes = 0
+
+
+class Timer():
+    """Gate that opens once <seconds> have elapsed since it was last reset"""
+
+    def __init__(self, seconds, clock=time.monotonic, ready=True):
+        """Initialize the Timer class
+
+        Args:
+            seconds (float): Seconds to wait after a reset
+            clock (callable, optional): Returns the current time in seconds
+            ready (bool, optional): Whether the gate starts open
+        """
+        self.seconds = seconds
+        self.clock = clock
+        self.last = None if ready else clock()
+
+    def ready(self, now=None):
+        if self.last is None:
+            return True
+        now = self.clock() if now is None else now
+        return now - self.last >= self.seconds
+
+    def reset(self, now=None):
+        self.last = self.clock() if now is None else now
+
+    def elapsed(self, now=None):
+        if self.last is None:
+            return None
+        return (self.clock() if now is None else now) - self.last
+
+
+class DecisionEngine():
+
+    def __init__(self, conf=None, clock=time.monotonic):
+        """Initialize the DecisionEngine class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml, i.e.
+                when backtesting other parameters
+            clock (callable, optional): Returns the current time in seconds,
+                defaults to the monotonic clock
+        """
+        conf = conf or CONF
+        self.clock = clock
+        self.window = None
+        # Like before, no alert in the first min_notify_seconds after start
+        self.notify_timer = Timer(conf['min_notify_seconds'], clock,
+                                  ready=False)
+        self.state_timer = Timer(0, clock, ready=False)
+        self.state = IDLE
+        self.configure(conf)
+
+    def configure(self, conf):
+        """Apply new settings, keeping the state and the evidence of the
+        last frames
+
+        Args:
+            conf (dict): Settings
+        """
+        settings = conf.get('decision', {})
+        weights = settings.get('weights', {})
+        self.pir_weight = weights.get('pir', 0.0)
+        self.contour_weight = weights.get('contour', 1.0)
+        self.person_weight = weights.get('person', 0.0)
+        self.total_weight = (self.pir_weight + self.contour_weight +
+                             self.person_weight) or 1.0
+
+        self.suspect_threshold = settings.get('suspect_threshold', 0.5)
+        self.confirm_threshold = settings.get(
+            'confirm_threshold', conf['min_occupied_fraction'])
+        self.release_threshold = settings.get('release_threshold', 0.3)
+        self.cooldown_seconds = settings.get('cooldown_seconds', 30)
+
+        window = settings.get('window',
+                              conf['motion_classification_store_cnt'])
+        if self.window is None:
+            self.window = SlidingWindow(window)
+        elif window != self.window.size:
+            self.window.resize(window)
+        self.notify_timer.seconds = conf['min_notify_seconds']
+
+    @property
+    def needs_person_prob(self):
+        """Whether the person probability is part of the score, so callers
+        only run the detector when it matters
+        """
+        return self.person_weight > 0
+
+    def evidence(self, contour, pir=None, person_prob=None):
+        """Fuse the evidence of a frame into a single value
+
+        Args:
+            contour (bool): Motion contours classification
+            pir (int, optional): Latest PIR sensor value
+            person_prob (float, optional): Person probability, counts as 0
+                when the detector wasn't run
+
+        Returns:
+            float: Weighted evidence between 0 and 1
+        """
+        return (self.contour_weight * bool(contour) +
+                self.pir_weight * bool(pir) +
+                self.person_weight * (person_prob or 0.0)) / self.total_weight
+
+    def transition(self, state, now):
+        LOGGER.debug('Decision state %s -> %s', self.state, state)
+        self.state = state
+        self.state_timer.reset(now)
+
+    def update(self, contour, pir=None, person_prob=None, now=None):
+        """Add the evidence of a new frame and update the state
+
+        Args:
+            contour (bool): Motion contours classification
+            pir (int, optional): Latest PIR sensor value
+            person_prob (float, optional): Person probability
+            now (float, optional): Current time, defaults to the engine clock
+
+        Returns:
+            Decision: State, score and whether to send an alert
+        """
+        now = self.clock() if now is None else now
+        evidence = self.evidence(contour, pir, person_prob)
+        self.window.push(evidence)
+        score = self.window.mean()
+
+        if self.state == IDLE:
+            if evidence >= self.suspect_threshold:
+                self.transition(SUSPECT, now)
+        if self.state == SUSPECT:
+            if score >= self.confirm_threshold:
+                self.transition(CONFIRMED, now)
+            elif (score < self.release_threshold and
+                  evidence < self.suspect_threshold):
+                self.transition(IDLE, now)
+        elif self.state == CONFIRMED:
+            if score < self.release_threshold:
+                self.transition(COOLDOWN, now)
+        elif self.state == COOLDOWN:
+            if score >= self.confirm_threshold:
+                self.transition(CONFIRMED, now)
+            elif self.state_timer.elapsed(now) >= self.cooldown_seconds:
+                self.transition(IDLE, now)
+
+        alert = self.state == CONFIRMED and self.notify_timer.ready(now)
+        if alert:
+            self.notify_timer.reset(now)
+        return Decision(self.state, score, alert)
+
+    def reset(self):
+        """Forget the evidence, i.e. when the camera is turned off"""
+        self.window.clear()
+        self.state = IDLE
+        self.state_timer.reset()
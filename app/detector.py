@@ -0,0 +1,236 @@
+"""
+Person detector backends used by MotionModel. Every backend takes a batch of
+BGR images and returns the highest probability of a person in any of them.
+
+    opencv       cv2.dnn, with an explicit preferable backend and target. Runs
+                 the MobileNetSSD Caffe model shipped in model-files/, or any
+                 model cv2.dnn.readNet can load
+    onnxruntime  ONNX Runtime, for SSD models exported from the TensorFlow
+                 object detection API (i.e. the ONNX model zoo's
+                 ssd_mobilenet_v1)
+    tflite       TensorFlow Lite, for SSD models with the TFLite detection
+                 postprocess op. Meant for int8 quantized models such as
+                 coco_ssd_mobilenet_v1_quant, several times faster than the
+                 fp32 Caffe model on the Pi's ARM cores
+
+onnxruntime and tflite_runtime (or tensorflow) are only imported when their
+backend is selected, they aren't needed otherwise.
+"""
+import logging
+import os
+
+import cv2
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config().get('detector', {})
+
+
+def model_path(filename):
+    """Resolve a model file relative to config.MODEL_DIR"""
+    return os.path.join(config.MODEL_DIR, filename)
+
+
+class OpenCVDetector():
+
+    def __init__(self, settings, threads=None):
+        """Initialize the OpenCVDetector class
+
+        Args:
+            settings (dict): opencv section of the detector settings
+            threads (int, optional): Number of threads cv2 may use
+        """
+        self.person_class = settings.get('person_class', 15)
+        self.input_size = tuple(settings.get('input_size', [300, 300]))
+        self.scale = settings.get('scale', 0.007843)
+        self.mean = settings.get('mean', 127.5)
+        if threads:
+            cv2.setNumThreads(threads)
+
+        self.net = cv2.dnn.readNet(
+            model_path(settings.get('model',
+                                    'MobileNetSSD_deploy.caffemodel')),
+            model_path(settings.get('config',
+                                    'MobileNetSSD_deploy.prototxt.txt')))
+        # i.e. backend: opencv -> cv2.dnn.DNN_BACKEND_OPENCV, target:
+        # opencl_fp16 -> cv2.dnn.DNN_TARGET_OPENCL_FP16
+        backend = settings.get('backend', 'default').upper()
+        target = settings.get('target', 'cpu').upper()
+        self.net.setPreferableBackend(
+            getattr(cv2.dnn, 'DNN_BACKEND_' + backend))
+        self.net.setPreferableTarget(getattr(cv2.dnn, 'DNN_TARGET_' + target))
+
+    def person_prob(self, images):
+        """Get the probability of a person being in any of the images, in a
+        single forward pass
+
+        Args:
+            images (list): BGR images
+
+        Returns:
+            float: Probability between 0 and 1
+        """
+        blob = cv2.dnn.blobFromImages(images, self.scale, self.input_size,
+                                      self.mean)
+        self.net.setInput(blob)
+        detections = self.net.forward()
+
+        # detections have shape (1, 1, N, 7), the columns being
+        # [image id, class, confidence, x1, y1, x2, y2]
+        detections = detections.reshape(-1, 7)
+        is_person = detections[:, 1].astype(int) == self.person_class
+        if not is_person.any():
+            return 0.0
+        return float(detections[is_person, 2].max())
+
+
+class ONNXDetector():
+
+    def __init__(self, settings, threads=None):
+        """Initialize the ONNXDetector class
+
+        Args:
+            settings (dict): onnxruntime section of the detector settings
+            threads (int, optional): Number of intra-op threads
+        """
+        import onnxruntime
+
+        self.person_class = settings.get('person_class', 1)
+        self.input_size = tuple(settings.get('input_size', [300, 300]))
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            model_path(settings.get('model', 'ssd_mobilenet_v1.onnx')),
+            options, providers=['CPUExecutionProvider'])
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.input_float = model_input.type == 'tensor(float)'
+        outputs = [o.name for o in self.session.get_outputs()]
+        self.scores_name = next(o for o in outputs if 'scores' in o)
+        self.classes_name = next(o for o in outputs if 'classes' in o)
+
+    def preprocess(self, images):
+        batch = np.stack([
+            cv2.cvtColor(cv2.resize(image, self.input_size), cv2.COLOR_BGR2RGB)
+            for image in images
+        ])
+        if self.input_float:
+            batch = (batch.astype(np.float32) - 127.5) / 127.5
+        return batch
+
+    def person_prob(self, images):
+        """Get the probability of a person being in any of the images, in a
+        single run of the session
+
+        Args:
+            images (list): BGR images
+
+        Returns:
+            float: Probability between 0 and 1
+        """
+        scores, classes = self.session.run(
+            [self.scores_name, self.classes_name],
+            {self.input_name: self.preprocess(images)})
+        is_person = classes.astype(int) == self.person_class
+        if not is_person.any():
+            return 0.0
+        return float(scores[is_person].max())
+
+
+class TFLiteDetector():
+
+    def __init__(self, settings, threads=None):
+        """Initialize the TFLiteDetector class
+
+        Args:
+            settings (dict): tflite section of the detector settings
+            threads (int, optional): Number of interpreter threads
+        """
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+
+        self.person_class = settings.get('person_class', 0)
+        self.interpreter = Interpreter(
+            model_path=model_path(settings.get('model',
+                                               'detect_quant.tflite')),
+            num_threads=threads)
+        self.interpreter.allocate_tensors()
+
+        model_input = self.interpreter.get_input_details()[0]
+        self.input_index = model_input['index']
+        self.input_dtype = model_input['dtype']
+        self.input_size = (int(model_input['shape'][2]),
+                           int(model_input['shape'][1]))
+
+        # The detection postprocess op outputs boxes, classes, scores, count
+        outputs = self.interpreter.get_output_details()
+        self.classes_index = outputs[1]['index']
+        self.scores_index = outputs[2]['index']
+
+    def preprocess(self, image):
+        tensor = cv2.cvtColor(cv2.resize(image, self.input_size),
+                              cv2.COLOR_BGR2RGB)[np.newaxis]
+        if self.input_dtype == np.float32:
+            return (tensor.astype(np.float32) - 127.5) / 127.5
+        return tensor.astype(self.input_dtype)
+
+    def person_prob(self, images):
+        """Get the probability of a person being in any of the images. The
+        postprocess op has a fixed batch size of 1, so images are run one at
+        a time
+
+        Args:
+            images (list): BGR images
+
+        Returns:
+            float: Probability between 0 and 1
+        """
+        prob = 0.0
+        for image in images:
+            self.interpreter.set_tensor(self.input_index,
+                                        self.preprocess(image))
+            self.interpreter.invoke()
+            classes = self.interpreter.get_tensor(self.classes_index)[0]
+            scores = self.interpreter.get_tensor(self.scores_index)[0]
+            is_person = classes.astype(int) == self.person_class
+            if is_person.any():
+                prob = max(prob, float(scores[is_person].max()))
+        return prob
+
+
+BACKENDS = {
+    'opencv': OpenCVDetector,
+    'onnxruntime': ONNXDetector,
+    'tflite': TFLiteDetector,
+}
+
+
+def build_detector(settings=None):
+    """Build the detector backend selected in the detector section of
+    config.yml
+
+    Args:
+        settings (dict, optional): Detector settings to use instead of
+            config.yml
+
+    Returns:
+        OpenCVDetector, ONNXDetector or TFLiteDetector: Detector
+    """
+    settings = settings if settings is not None else CONF
+    backend = settings.get('backend', 'opencv')
+    if backend not in BACKENDS:
+        raise ValueError('Unknown detector backend {}, expected one of {}'
+                         .format(backend, sorted(BACKENDS)))
+    LOGGER.info('Loading %s person detector', backend)
+    return BACKENDS[backend](settings.get(backend, {}),
+                             settings.get('threads'))
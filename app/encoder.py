@@ -0,0 +1,184 @@
+"""
+JPEG encoders for snapshots and alerts. Encoded images are kept in memory
+and handed to the uploaders as bytes.
+
+CPUEncoder runs cv2.imencode on a worker thread, off the detection loop.
+HardwareEncoder records MJPEG from a camera splitter port, so the JPEGs come
+from the GPU's encoder, and only keeps the latest complete frame.
+"""
+import io
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import cv2
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+JPEG_SOI = b'\xff\xd8'
+
+
+class CPUEncoder():
+
+    def __init__(self, quality=90, workers=1):
+        """Initialize the CPUEncoder class
+
+        Args:
+            quality (int, optional): JPEG quality, 0 to 100
+            workers (int, optional): Number of encoding threads
+        """
+        self.params = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix='jpeg-encoder')
+
+    def encode_now(self, frame):
+        """Encode a frame on the calling thread
+
+        Args:
+            frame (numpy.ndarray): BGR image
+
+        Returns:
+            bytes: JPEG image
+        """
+        ok, buffer = cv2.imencode('.jpg', frame, self.params)
+        if not ok:
+            raise ValueError('Unable to encode frame')
+        return buffer.tobytes()
+
+    def encode(self, frame):
+        """Encode a frame on the worker thread
+
+        Args:
+            frame (numpy.ndarray): BGR image. Must not be modified until the
+                returned future is done
+
+        Returns:
+            concurrent.futures.Future: Resolves to the JPEG bytes
+        """
+        return self.pool.submit(self.encode_now, frame)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
+class LatestFrameOutput():
+    """File-like output for picamera that keeps the latest complete MJPEG
+    frame. picamera writes each MJPEG frame in one or more write() calls, and
+    every frame starts with the JPEG start-of-image marker.
+    """
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.frame = None
+        self.frame_time = None
+        self.condition = threading.Condition()
+
+    def write(self, data):
+        if data.startswith(JPEG_SOI) and self.buffer.tell():
+            with self.condition:
+                self.frame = self.buffer.getvalue()
+                self.frame_time = time.monotonic()
+                self.condition.notify_all()
+            self.buffer.seek(0)
+            self.buffer.truncate()
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+
+class HardwareEncoder():
+
+    def __init__(self, camera, splitter_port=1, quality=90, resize=None,
+                 max_age=1.0):
+        """Initialize the HardwareEncoder class and start recording MJPEG on
+        the splitter port
+
+        Args:
+            camera (picamera.PiCamera): Open camera
+            splitter_port (int, optional): Splitter port to record from. Port
+                0 is used by the detection stream
+            quality (int, optional): JPEG quality, 1 to 100
+            resize (tuple, optional): (width, height) to have the GPU resize
+                to. Defaults to the camera resolution
+            max_age (float, optional): Seconds a frame can be old before
+                encode waits for the next one
+        """
+        self.camera = camera
+        self.splitter_port = splitter_port
+        self.max_age = max_age
+        self.output = LatestFrameOutput()
+        self.fallback = CPUEncoder(quality)
+        camera.start_recording(self.output, format='mjpeg',
+                               splitter_port=splitter_port, quality=quality,
+                               resize=resize)
+
+    def latest(self, timeout=1.0):
+        """Get the latest JPEG from the hardware encoder
+
+        Args:
+            timeout (float, optional): Seconds to wait for a fresh frame
+
+        Returns:
+            bytes: JPEG image, None if no fresh frame arrived in time
+        """
+        with self.output.condition:
+            self.output.condition.wait_for(
+                lambda: self.output.frame_time is not None and
+                time.monotonic() - self.output.frame_time <= self.max_age,
+                timeout)
+            return self.output.frame
+
+    def encode(self, frame):
+        """Get the current camera frame as a JPEG. The frame argument is only
+        used when the hardware encoder has no fresh frame
+
+        Args:
+            frame (numpy.ndarray): BGR image of the current frame
+
+        Returns:
+            concurrent.futures.Future: Resolves to the JPEG bytes
+        """
+        jpeg = self.latest()
+        if jpeg is None:
+            LOGGER.warning('No frame from the hardware encoder, falling back '
+                           'to the cpu')
+            return self.fallback.encode(frame)
+        future = Future()
+        future.set_result(jpeg)
+        return future
+
+    def encode_now(self, frame):
+        return self.encode(frame).result()
+
+    def close(self):
+        try:
+            self.camera.stop_recording(splitter_port=self.splitter_port)
+        except Exception:
+            LOGGER.exception('Unable to stop recording on splitter port %s',
+                             self.splitter_port)
+        self.fallback.close()
+
+
+def build_encoder(camera=None):
+    """Build the encoder selected by jpeg_encoder in config.yml
+
+    Args:
+        camera (picamera.PiCamera, optional): Open camera, needed for the
+            hardware encoder
+
+    Returns:
+        CPUEncoder or HardwareEncoder: Encoder
+    """
+    kind = CONF.get('jpeg_encoder', 'cpu')
+    quality = CONF.get('jpeg_quality', 90)
+    if kind == 'hardware' and camera is not None:
+        return HardwareEncoder(camera, quality=quality)
+    return CPUEncoder(quality)
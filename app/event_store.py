@@ -0,0 +1,299 @@
+"""
+Local event store for motion events, alerts, slack files, tags and training
+samples, backed by SQLite in WAL mode.
+
+Writes are queued and applied by a background thread in batched
+transactions, so recording an event from the camera loop or a Flask view
+never waits on the SD card. Reads use a connection per thread.
+"""
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config().get('event_store', {})
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    ts TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    classification INTEGER NOT NULL,
+    motion_fraction REAL,
+    contour_count INTEGER,
+    max_contour_area REAL,
+    pir INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_created ON events (created);
+
+CREATE TABLE IF NOT EXISTS alerts (
+    ts TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    image TEXT
+);
+CREATE INDEX IF NOT EXISTS alerts_created ON alerts (created);
+
+CREATE TABLE IF NOT EXISTS slack_files (
+    file_id TEXT PRIMARY KEY,
+    ts TEXT NOT NULL,
+    filename TEXT,
+    created REAL NOT NULL,
+    deleted REAL
+);
+CREATE INDEX IF NOT EXISTS slack_files_ts ON slack_files (ts);
+
+CREATE TABLE IF NOT EXISTS tags (
+    ts TEXT PRIMARY KEY,
+    occupied INTEGER NOT NULL,
+    tagged REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tags_occupied ON tags (occupied);
+
+CREATE TABLE IF NOT EXISTS samples (
+    ts TEXT PRIMARY KEY,
+    path TEXT,
+    s3_key TEXT,
+    created REAL NOT NULL,
+    uploaded REAL
+);
+CREATE INDEX IF NOT EXISTS samples_uploaded ON samples (uploaded);
+"""
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+class EventStore():
+
+    def __init__(self, path=None, batch_size=None, flush_seconds=None):
+        """Initialize the EventStore class
+
+        Args:
+            path (str, optional): Path of the SQLite database. Defaults to
+                event_store.path in config.yml, relative to config.DATA_DIR
+            batch_size (int, optional): Maximum writes per transaction
+            flush_seconds (float, optional): Maximum seconds a write waits in
+                the queue before its batch is committed
+        """
+        self.path = path or os.path.join(
+            config.DATA_DIR, CONF.get('path', 'events.db'))
+        self.batch_size = batch_size or CONF.get('batch_size', 100)
+        self.flush_seconds = flush_seconds or CONF.get('flush_seconds', 2)
+
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._closed = False
+
+        conn = self.connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+        self._writer = threading.Thread(
+            target=self._write_loop, name='event-store-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def connect(self):
+        """Open a connection in WAL mode, which lets the other processes
+        read while one of them writes
+
+        Returns:
+            sqlite3.Connection: New connection
+        """
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    @property
+    def conn(self):
+        """Connection for reads in the current thread"""
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = self.connect()
+        return self._local.conn
+
+    def _write_loop(self):
+        conn = self.connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_seconds
+            stop = False
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.task_done()
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._commit(conn, batch)
+            if stop:
+                break
+        conn.close()
+
+    def _commit(self, conn, batch):
+        """Apply a batch of writes in a single transaction"""
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+        except sqlite3.Error:
+            LOGGER.exception('Unable to commit %s writes to %s', len(batch),
+                             self.path)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def write(self, sql, params=()):
+        """Queue a write, applied by the writer thread in the next batch
+
+        Args:
+            sql (str): Statement to execute
+            params (tuple, optional): Statement parameters
+        """
+        self._queue.put((sql, params))
+
+    def flush(self):
+        """Block until all queued writes are committed"""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join()
+
+    def record_event(self, ts, classification, contours, pir=None,
+                     motion_fraction=None):
+        """Record a motion event
+
+        Args:
+            ts (str): Event timestamp, as used in the image and sample names
+            classification (bool): Occupied classification
+            contours (list): List of contours metadata
+            pir (list, optional): PIR sensor values
+            motion_fraction (float, optional): Fraction of recent frames
+                classified as motion
+        """
+        self.write(
+            'INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (ts, time.time(), int(bool(classification)), motion_fraction,
+             len(contours),
+             max([c['size'] for c in contours], default=None),
+             int(bool(pir[-1])) if pir else None))
+
+    def record_alert(self, ts, image=None):
+        self.write('INSERT OR REPLACE INTO alerts VALUES (?, ?, ?)',
+                   (ts, time.time(), image))
+
+    def record_slack_file(self, file_id, ts, filename=None):
+        self.write(
+            'INSERT OR REPLACE INTO slack_files VALUES (?, ?, ?, ?, NULL)',
+            (file_id, ts, filename, time.time()))
+
+    def record_slack_file_deleted(self, file_id):
+        self.write('UPDATE slack_files SET deleted = ? WHERE file_id = ?',
+                   (time.time(), file_id))
+
+    def record_tag(self, ts, occupied):
+        self.write('INSERT OR REPLACE INTO tags VALUES (?, ?, ?)',
+                   (ts, int(bool(occupied)), time.time()))
+
+    def record_sample(self, ts, path):
+        self.write(
+            'INSERT OR REPLACE INTO samples VALUES (?, ?, NULL, ?, NULL)',
+            (ts, path, time.time()))
+
+    def record_upload(self, ts, s3_key):
+        """Record that a sample was uploaded to S3 and removed locally"""
+        self.write(
+            'UPDATE samples SET path = NULL, s3_key = ?, uploaded = ? '
+            'WHERE ts = ?', (s3_key, time.time(), ts))
+
+    def untagged_alerts(self, since):
+        """Alerts that haven't been tagged in slack
+
+        Args:
+            since (float): Unix timestamp to look back to
+
+        Returns:
+            list: alerts rows, newest first
+        """
+        return self.conn.execute(
+            'SELECT alerts.* FROM alerts LEFT JOIN tags USING (ts) '
+            'WHERE alerts.created >= ? AND tags.ts IS NULL '
+            'ORDER BY alerts.created DESC', (since,)).fetchall()
+
+    def false_positive_rate_per_hour(self, since=0):
+        """Fraction of tagged alerts that were tagged unoccupied, by hour of
+        the day
+
+        Args:
+            since (float, optional): Unix timestamp to look back to
+
+        Returns:
+            list: Rows of (hour, tagged, false_positives, rate)
+        """
+        return self.conn.execute(
+            "SELECT strftime('%H', alerts.created, 'unixepoch', 'localtime') "
+            'AS hour, COUNT(*) AS tagged, '
+            'SUM(tags.occupied = 0) AS false_positives, '
+            'AVG(tags.occupied = 0) AS rate '
+            'FROM alerts JOIN tags USING (ts) WHERE alerts.created >= ? '
+            'GROUP BY hour ORDER BY hour', (since,)).fetchall()
+
+    def pending_samples(self):
+        """Samples saved locally that haven't been uploaded to S3
+
+        Returns:
+            list: samples rows, oldest first
+        """
+        return self.conn.execute(
+            'SELECT * FROM samples WHERE uploaded IS NULL AND path IS NOT NULL '
+            'ORDER BY created').fetchall()
+
+    def labelled_samples(self):
+        """Samples joined with their tags
+
+        Returns:
+            list: Rows of (ts, path, s3_key, occupied), occupied is None for
+                untagged samples
+        """
+        return self.conn.execute(
+            'SELECT samples.ts, samples.path, samples.s3_key, tags.occupied '
+            'FROM samples LEFT JOIN tags USING (ts) '
+            'ORDER BY samples.created').fetchall()
+
+
+def get_store():
+    """Get the process wide EventStore, opening it on first use
+
+    Returns:
+        EventStore: Event store
+    """
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = EventStore()
+    return _STORE
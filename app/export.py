@@ -0,0 +1,510 @@
+"""
+Export of the training samples to a columnar dataset, so analyses don't
+unpickle every sample. The pickles are streamed, one at a time, and their
+rows written in batches of batch_rows, so memory stays flat however many
+samples there are:
+
+    events/      one row per sample: classification, pir and contour stats
+    contours/    one row per contour of the sample
+    thumbnails/  (optional) JPEG of the last frame, thumbnail_width wide
+    tags/        the latest tag of every sample, rewritten on each run
+
+events, contours and thumbnails are partitioned by date (date=YYYY-MM-DD
+directories), in Parquet or Arrow IPC files. A run only appends the samples
+that aren't in events yet, in new part files, so it can run every time new
+tagged samples arrive:
+
+    python3 export.py --out ../analysis/data train-data
+    python3 export.py --format arrow --thumbnails train-data
+
+Analyses read the dataset with load(), which prunes the date partitions and
+pushes the other filters down to the files, memory-mapping them:
+
+    events = export.load('events', start='2018-11-06', end='2018-11-08',
+                         columns=['ts', 'classification', 'max_area'])
+    df = export.with_tags(events).to_pandas()
+
+Needs pyarrow, which isn't needed on the pi.
+"""
+import argparse
+import glob
+import logging
+import os
+import pickle
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+TS_FORMAT = '%Y-%m-%d-%H-%M-%S.%f'
+DATE_FORMAT = '%Y-%m-%d'
+EXTENSIONS = {'parquet': 'parquet', 'arrow': 'arrow'}
+DATASET_FORMATS = {'parquet': 'parquet', 'arrow': 'ipc'}
+TABLES = ['events', 'contours', 'thumbnails']
+
+
+def default_settings():
+    settings = dict(CONF.get('export', {}))
+    settings['path'] = os.path.join(
+        config.CURR_DIR, settings.get('path', 'data/dataset'))
+    settings.setdefault('format', 'parquet')
+    settings.setdefault('thumbnails', False)
+    settings.setdefault('thumbnail_width', 160)
+    settings.setdefault('batch_rows', 500)
+    return settings
+
+
+def schemas():
+    """Returns:
+        dict: Table name -> pyarrow.Schema, without the date partition
+    """
+    import pyarrow as pa
+
+    return {
+        'events': pa.schema([
+            ('ts', pa.string()),
+            ('timestamp', pa.timestamp('us')),
+            ('classification', pa.bool_()),
+            ('frames', pa.int32()),
+            ('width', pa.int32()),
+            ('height', pa.int32()),
+            ('pir_count', pa.int32()),
+            ('pir_high', pa.int32()),
+            ('pir_last', pa.int8()),
+            ('contour_count', pa.int32()),
+            ('max_area', pa.float32()),
+            ('total_area', pa.float32()),
+            ('motion_fraction', pa.float32()),
+            ('source', pa.string()),
+        ]),
+        'contours': pa.schema([
+            ('ts', pa.string()),
+            ('timestamp', pa.timestamp('us')),
+            ('x', pa.int32()),
+            ('y', pa.int32()),
+            ('w', pa.int32()),
+            ('h', pa.int32()),
+            ('area', pa.float32()),
+        ]),
+        'thumbnails': pa.schema([
+            ('ts', pa.string()),
+            ('timestamp', pa.timestamp('us')),
+            ('width', pa.int32()),
+            ('height', pa.int32()),
+            ('jpeg', pa.binary()),
+        ]),
+        'tags': pa.schema([
+            ('ts', pa.string()),
+            ('timestamp', pa.timestamp('us')),
+            ('occupied', pa.bool_()),
+        ]),
+    }
+
+
+def read_tags(directories):
+    """Read the <True|False>_<ts>.txt tag files saved by the slack buttons.
+    A sample tagged more than once keeps the tag written last
+
+    Returns:
+        dict: ts -> occupied
+    """
+    latest = {}
+    for directory in directories:
+        for path in glob.glob(os.path.join(directory, '*.txt')):
+            tag, _, ts = os.path.basename(path)[:-len('.txt')].partition('_')
+            if tag not in ('True', 'False'):
+                continue
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            # the path only breaks ties, so the result doesn't depend on
+            # the glob order
+            if ts not in latest or (mtime, path) > latest[ts][0]:
+                latest[ts] = ((mtime, path), tag == 'True')
+    return {ts: occupied for ts, (_, occupied) in latest.items()}
+
+
+def list_samples(directories):
+    """List the pickles, oldest first
+
+    Returns:
+        list: (ts, path)
+    """
+    samples = []
+    for directory in directories:
+        for path in glob.glob(os.path.join(directory, '*.pkl')):
+            ts = os.path.basename(path)[:-len('.pkl')].partition('_')[2]
+            samples.append((ts, path))
+    return sorted(samples)
+
+
+def thumbnail(frame, width):
+    """Returns:
+        tuple: (width, height, JPEG bytes), None if it can't be encoded
+    """
+    import cv2
+
+    height = int(frame.shape[0] * width / frame.shape[1])
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    ok, jpeg = cv2.imencode('.jpg', small)
+    if not ok:
+        return None
+    return width, height, jpeg.tobytes()
+
+
+def sample_rows(data, ts, source, thumbnail_width=None):
+    """Rows of a sample, in the format of SecuritySystem.save_pickle
+
+    Args:
+        data (dict): Unpickled sample
+        ts (str): Timestamp of the sample
+        source (str): File it was read from
+        thumbnail_width (int, optional): Width of the thumbnail, None for
+            no thumbnail
+
+    Returns:
+        dict: Table name -> list of rows
+    """
+    timestamp = datetime.strptime(ts, TS_FORMAT)
+    frames = data.get('frames') or []
+    frame = data.get('frame')
+    if frame is None and frames:
+        frame = frames[-1]
+    contours = data.get('contours') or []
+    areas = [contour['size'] for contour in contours]
+    pir = [value for value in (data.get('pir') or []) if value is not None]
+    delta = data.get('frame_delta')
+
+    rows = {
+        'events': [{
+            'ts': ts,
+            'timestamp': timestamp,
+            'classification': bool(data.get('classification')),
+            'frames': len(frames),
+            'width': frame.shape[1] if frame is not None else None,
+            'height': frame.shape[0] if frame is not None else None,
+            'pir_count': len(pir),
+            'pir_high': int(sum(bool(value) for value in pir)),
+            'pir_last': int(pir[-1]) if pir else None,
+            'contour_count': len(contours),
+            'max_area': max(areas) if areas else 0.0,
+            'total_area': sum(areas),
+            'motion_fraction': float(np.count_nonzero(delta)) / delta.size
+            if delta is not None else None,
+            'source': os.path.basename(source),
+        }],
+        'contours': [],
+        'thumbnails': [],
+    }
+    for contour in contours:
+        x, y, w, h = contour['coords']
+        rows['contours'].append({
+            'ts': ts, 'timestamp': timestamp, 'x': x, 'y': y, 'w': w,
+            'h': h, 'area': contour['size']})
+    if thumbnail_width and frame is not None:
+        small = thumbnail(frame, thumbnail_width)
+        if small is not None:
+            rows['thumbnails'].append({
+                'ts': ts, 'timestamp': timestamp, 'width': small[0],
+                'height': small[1], 'jpeg': small[2]})
+    return rows
+
+
+def open_writer(path, schema, fmt):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    if fmt == 'parquet':
+        return pq.ParquetWriter(path, schema, compression='zstd')
+    return pa.ipc.new_file(path, schema)
+
+
+class TableWriter():
+    """Writes the batches of a table to a new part file per date partition.
+    The files are hidden (dot prefixed) until they're complete, so readers
+    never see a file without its footer
+    """
+
+    def __init__(self, directory, schema, fmt, run):
+        self.directory = directory
+        self.schema = schema
+        self.fmt = fmt
+        self.run = run
+        self.writers = {}
+        self.rows = 0
+
+    def write(self, date, rows):
+        import pyarrow as pa
+
+        if not rows:
+            return
+        writer = self.writers.get(date)
+        if writer is None:
+            directory = os.path.join(self.directory, 'date=' + date)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, 'part-{}.{}'.format(
+                self.run, EXTENSIONS[self.fmt]))
+            hidden = os.path.join(directory, '.' + os.path.basename(path))
+            writer = (open_writer(hidden, self.schema, self.fmt), hidden,
+                      path)
+            self.writers[date] = writer
+        table = pa.Table.from_pylist(rows, schema=self.schema)
+        writer[0].write_table(table)
+        self.rows += len(rows)
+
+    def close(self):
+        for writer, hidden, path in self.writers.values():
+            writer.close()
+            os.replace(hidden, path)
+        self.writers = {}
+
+
+def dataset(table, path=None, fmt=None):
+    """Open a table of the dataset, memory-mapping its files
+
+    Args:
+        table (str): events, contours, thumbnails or tags
+        path (str, optional): Dataset directory
+        fmt (str, optional): parquet or arrow
+
+    Returns:
+        pyarrow.dataset.Dataset: Dataset, None if the table doesn't exist
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    settings = default_settings()
+    directory = os.path.join(path or settings['path'], table)
+    if not os.path.isdir(directory):
+        return None
+    return ds.dataset(
+        directory, format=DATASET_FORMATS[fmt or settings['format']],
+        partitioning='hive', filesystem=fs.LocalFileSystem(use_mmap=True))
+
+
+def load(table, start=None, end=None, columns=None, filter=None, path=None,
+         fmt=None):
+    """Load a table, reading only the partitions and columns needed
+
+    Args:
+        table (str): events, contours, thumbnails or tags
+        start (str, optional): First date, YYYY-MM-DD
+        end (str, optional): Last date, YYYY-MM-DD
+        columns (list, optional): Columns to read, defaults to all
+        filter (pyarrow.dataset.Expression, optional): Row filter, i.e.
+            pyarrow.dataset.field('max_area') > 5000
+        path (str, optional): Dataset directory
+        fmt (str, optional): parquet or arrow
+
+    Returns:
+        pyarrow.Table: Rows, None if the table doesn't exist
+    """
+    import pyarrow.dataset as ds
+
+    data = dataset(table, path, fmt)
+    if data is None:
+        return None
+    conditions = []
+    if table == 'tags':
+        # not partitioned, filtered on the timestamps
+        if start:
+            conditions.append(ds.field('timestamp') >= datetime.strptime(
+                start, DATE_FORMAT))
+        if end:
+            conditions.append(ds.field('timestamp') < datetime.strptime(
+                end, DATE_FORMAT) + timedelta(days=1))
+    else:
+        if start:
+            conditions.append(ds.field('date') >= start)
+        if end:
+            conditions.append(ds.field('date') <= end)
+    for condition in conditions:
+        filter = condition if filter is None else filter & condition
+    return data.to_table(columns=columns, filter=filter)
+
+
+def with_tags(table, path=None, fmt=None):
+    """Join the latest tags to a table with a ts column
+
+    Returns:
+        pyarrow.Table: table with an occupied column, null when untagged
+    """
+    tags = load('tags', columns=['ts', 'occupied'], path=path, fmt=fmt)
+    if tags is None:
+        import pyarrow as pa
+
+        return table.append_column(
+            'occupied', pa.nulls(table.num_rows, pa.bool_()))
+    return table.join(tags, 'ts', join_type='left outer')
+
+
+class Exporter():
+
+    def __init__(self, path=None, fmt=None, thumbnails=None,
+                 thumbnail_width=None, batch_rows=None):
+        """Initialize the Exporter class
+
+        Args:
+            path (str, optional): Dataset directory
+            fmt (str, optional): parquet or arrow
+            thumbnails (bool, optional): Whether to export thumbnails
+            thumbnail_width (int, optional): Width of the thumbnails
+            batch_rows (int, optional): Samples per written batch
+        """
+        settings = default_settings()
+        self.path = path or settings['path']
+        self.fmt = fmt or settings['format']
+        if self.fmt not in EXTENSIONS:
+            raise ValueError('Unknown format {}'.format(self.fmt))
+        self.thumbnail_width = None
+        if settings['thumbnails'] if thumbnails is None else thumbnails:
+            self.thumbnail_width = thumbnail_width or \
+                settings['thumbnail_width']
+        self.batch_rows = batch_rows or settings['batch_rows']
+
+    def exported(self):
+        """Returns:
+            set: ts of the samples already in the dataset
+        """
+        events = load('events', columns=['ts'], path=self.path, fmt=self.fmt)
+        if events is None:
+            return set()
+        return set(events.column('ts').to_pylist())
+
+    def export(self, directories):
+        """Append the samples of directories that aren't exported yet, and
+        rewrite the tags
+
+        Args:
+            directories (list): Directories with the pickles and tag files
+
+        Returns:
+            dict: Rows written per table, and samples skipped
+        """
+        table_schemas = schemas()
+        done = self.exported()
+        run = datetime.now().strftime('%Y%m%d%H%M%S%f')
+        writers = {
+            table: TableWriter(os.path.join(self.path, table),
+                               table_schemas[table], self.fmt, run)
+            for table in TABLES}
+        # date -> table -> rows, written every batch_rows samples
+        pending = {}
+        count = skipped = 0
+
+        def flush():
+            for date, tables in sorted(pending.items()):
+                for table, rows in tables.items():
+                    writers[table].write(date, rows)
+            pending.clear()
+
+        try:
+            for ts, path in list_samples(directories):
+                if ts in done:
+                    skipped += 1
+                    continue
+                try:
+                    with open(path, 'rb') as file_in:
+                        data = pickle.load(file_in)
+                    rows = sample_rows(data, ts, path, self.thumbnail_width)
+                except Exception:
+                    LOGGER.exception('Unable to export %s', path)
+                    continue
+                done.add(ts)
+                tables = pending.setdefault(
+                    ts[:10], {table: [] for table in TABLES})
+                for table in TABLES:
+                    tables[table].extend(rows[table])
+                count += 1
+                if count % self.batch_rows == 0:
+                    flush()
+                    LOGGER.info('Exported %s samples', count)
+            flush()
+        finally:
+            for writer in writers.values():
+                writer.close()
+
+        tags = self.write_tags(read_tags(directories))
+        result = {table: writers[table].rows for table in TABLES}
+        result.update(skipped=skipped, tags=tags)
+        return result
+
+    def write_tags(self, tags):
+        """Merge tags into the tags table, and rewrite it
+
+        Args:
+            tags (dict): ts -> occupied
+
+        Returns:
+            int: Tags in the table
+        """
+        import pyarrow as pa
+
+        existing = load('tags', columns=['ts', 'occupied'], path=self.path,
+                        fmt=self.fmt)
+        merged = dict(zip(existing.column('ts').to_pylist(),
+                          existing.column('occupied').to_pylist())) \
+            if existing is not None else {}
+        merged.update(tags)
+        directory = os.path.join(self.path, 'tags')
+        os.makedirs(directory, exist_ok=True)
+        rows = []
+        for ts, occupied in sorted(merged.items()):
+            try:
+                timestamp = datetime.strptime(ts, TS_FORMAT)
+            except ValueError:
+                LOGGER.warning('Skipping the tag of %s', ts)
+                continue
+            rows.append({'ts': ts, 'timestamp': timestamp,
+                         'occupied': occupied})
+        schema = schemas()['tags']
+        path = os.path.join(directory, 'tags.' + EXTENSIONS[self.fmt])
+        hidden = os.path.join(directory, '.tags.' + EXTENSIONS[self.fmt])
+        writer = open_writer(hidden, schema, self.fmt)
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        writer.close()
+        os.replace(hidden, path)
+        return len(rows)
+
+
+def main():
+    settings = default_settings()
+    samples_dir = CONF['storage']['classes']['samples']['dir']
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('directories', nargs='*',
+                        default=[os.path.join(config.CURR_DIR, samples_dir)],
+                        help='Directories with the pickles and tag files')
+    parser.add_argument('--out', default=settings['path'])
+    parser.add_argument('--format', choices=sorted(EXTENSIONS),
+                        default=settings['format'])
+    parser.add_argument('--thumbnails', action='store_true',
+                        default=settings['thumbnails'])
+    parser.add_argument('--thumbnail-width', type=int,
+                        default=settings['thumbnail_width'])
+    parser.add_argument('--batch-rows', type=int,
+                        default=settings['batch_rows'])
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    exporter = Exporter(args.out, args.format, args.thumbnails,
+                        args.thumbnail_width, args.batch_rows)
+    result = exporter.export(args.directories)
+    print('Exported {events} samples, {contours} contours and {thumbnails} '
+          'thumbnails, {tags} tags, skipped {skipped} already exported '
+          'samples in {seconds:.1f}s'.format(
+              seconds=time.perf_counter() - start, **result))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,256 @@
+"""
+Shared memory frame bus. The security system publishes its latest frame,
+thresholded delta mask, fps and decision state, and any other process (i.e.
+the gunicorn workers) reads a consistent snapshot without touching the disk.
+
+The shared memory block holds a header and a ring of slots. Each slot starts
+with a sequence number that is odd while the slot is being written (a
+seqlock): a reader copies the slot and retries if the sequence number was
+odd or changed in the meantime. The writer never waits on readers, and
+writes to the slot after the one readers are pointed to.
+"""
+import collections
+import logging
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+MAGIC = b'RPFB'
+VERSION = 1
+STATES = ['idle', 'suspect', 'confirmed', 'cooldown']
+
+# magic, version, number of slots, bytes of data per slot, latest slot
+HEADER = struct.Struct('<4sIIQq')
+# sequence, timestamp, fps, state index, score, frame height, width and
+# channels, mask height and width
+SLOT_HEADER = struct.Struct('<QddidIIIII')
+SEQUENCE = struct.Struct('<Q')
+
+Snapshot = collections.namedtuple(
+    'Snapshot', ['timestamp', 'fps', 'state', 'score', 'frame', 'mask'])
+
+
+def default_settings():
+    settings = CONF.get('frame_bus', {})
+    width, height = CONF['resolution']
+    return (settings.get('name', 'rpi_security_frames'),
+            settings.get('slots', 3),
+            # a BGR frame and a mask no larger than it
+            width * height * 4)
+
+
+class FrameBus():
+
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        magic, version, self.slots, self.slot_bytes, _ = \
+            HEADER.unpack_from(shm.buf, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{} is not a version {} frame bus'.format(
+                shm.name, VERSION))
+        self.slot_size = SLOT_HEADER.size + self.slot_bytes
+        self.sequences = [0] * self.slots
+
+    @classmethod
+    def create(cls, name=None, slots=None, slot_bytes=None):
+        """Create the shared memory block, replacing a stale one left by a
+        process that didn't exit cleanly
+
+        Args:
+            name (str, optional): Shared memory name
+            slots (int, optional): Number of slots in the ring
+            slot_bytes (int, optional): Bytes of frame and mask data per slot
+
+        Returns:
+            FrameBus: Bus to publish to
+        """
+        default_name, default_slots, default_bytes = default_settings()
+        name = name or default_name
+        slots = slots or default_slots
+        slot_bytes = slot_bytes or default_bytes
+        size = HEADER.size + slots * (SLOT_HEADER.size + slot_bytes)
+        try:
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        shm = shared_memory.SharedMemory(name, create=True, size=size)
+        HEADER.pack_into(shm.buf, 0, MAGIC, VERSION, slots, slot_bytes, -1)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name=None):
+        """Attach to the bus of the security system
+
+        Args:
+            name (str, optional): Shared memory name
+
+        Returns:
+            FrameBus: Bus to read from, None if it doesn't exist
+        """
+        name = name or default_settings()[0]
+        try:
+            shm = shared_memory.SharedMemory(name)
+        except FileNotFoundError:
+            return None
+        # Readers must not unlink the block when they exit, only the
+        # security system does
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    def slot_offset(self, slot):
+        return HEADER.size + slot * self.slot_size
+
+    def latest_slot(self):
+        return HEADER.unpack_from(self.shm.buf, 0)[4]
+
+    def publish(self, frame, mask=None, fps=0.0, state=None, score=0.0):
+        """Publish the latest frame and detector state
+
+        Args:
+            frame (numpy.ndarray): BGR frame
+            mask (numpy.ndarray, optional): Thresholded delta mask
+            fps (float, optional): Frames per second of the detector
+            state (str, optional): Decision engine state
+            score (float, optional): Decision engine score
+        """
+        frame = np.ascontiguousarray(frame)
+        mask_bytes = mask.nbytes if mask is not None else 0
+        if frame.nbytes + mask_bytes > self.slot_bytes:
+            LOGGER.warning('Frame of %s bytes too large for the frame bus',
+                           frame.nbytes + mask_bytes)
+            return
+
+        slot = (self.latest_slot() + 1) % self.slots
+        offset = self.slot_offset(slot)
+        data = offset + SLOT_HEADER.size
+        buf = self.shm.buf
+
+        sequence = self.sequences[slot] + 1
+        SEQUENCE.pack_into(buf, offset, sequence)
+
+        height, width = frame.shape[:2]
+        channels = frame.shape[2] if frame.ndim == 3 else 1
+        buf[data:data + frame.nbytes] = frame.reshape(-1)
+        mask_shape = (0, 0)
+        if mask is not None:
+            mask = np.ascontiguousarray(mask, dtype=np.uint8)
+            mask_shape = mask.shape[:2]
+            start = data + frame.nbytes
+            buf[start:start + mask.nbytes] = mask.reshape(-1)
+        state_index = STATES.index(state) if state in STATES else -1
+
+        SLOT_HEADER.pack_into(
+            buf, offset, sequence, time.time(), fps, state_index, score,
+            height, width, channels, mask_shape[0], mask_shape[1])
+        self.sequences[slot] = sequence + 1
+        SEQUENCE.pack_into(buf, offset, sequence + 1)
+        struct.pack_into('<q', buf, HEADER.size - 8, slot)
+
+    def read(self, retries=5):
+        """Read a consistent snapshot of the latest publication
+
+        Args:
+            retries (int, optional): Attempts when the slot is overwritten
+                while it is being copied
+
+        Returns:
+            Snapshot: Latest snapshot, None if nothing was published yet
+        """
+        buf = self.shm.buf
+        for _ in range(retries):
+            slot = self.latest_slot()
+            if slot < 0:
+                return None
+            offset = self.slot_offset(slot)
+            data = offset + SLOT_HEADER.size
+            (sequence, timestamp, fps, state_index, score, height, width,
+             channels, mask_height, mask_width) = \
+                SLOT_HEADER.unpack_from(buf, offset)
+            if sequence % 2:
+                continue
+
+            frame_bytes = height * width * channels
+            frame = np.frombuffer(buf, np.uint8, frame_bytes, data).copy()
+            mask = None
+            if mask_height:
+                mask = np.frombuffer(buf, np.uint8, mask_height * mask_width,
+                                     data + frame_bytes).copy()
+
+            if SEQUENCE.unpack_from(buf, offset)[0] != sequence:
+                continue
+            shape = (height, width, channels) if channels > 1 \
+                else (height, width)
+            return Snapshot(
+                timestamp, fps,
+                STATES[state_index] if state_index >= 0 else None, score,
+                frame.reshape(shape),
+                mask.reshape(mask_height, mask_width)
+                if mask is not None else None)
+        return None
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+_READER = None
+# Flask serves requests from several threads, which must not close the
+# reader while another one reads from it
+_READER_LOCK = threading.RLock()
+
+
+def get_reader():
+    """Get the process wide reader, attaching once the security system has
+    created the bus
+
+    Returns:
+        FrameBus: Bus to read from, None if it doesn't exist yet
+    """
+    global _READER
+    with _READER_LOCK:
+        if _READER is None:
+            _READER = FrameBus.attach()
+        return _READER
+
+
+def read_snapshot(max_age=None):
+    """Read the latest snapshot of the security system
+
+    Args:
+        max_age (float, optional): Seconds after which a snapshot is treated
+            as stale, and the bus re-attached in case the security system
+            restarted and created a new one
+
+    Returns:
+        Snapshot: Latest snapshot, None if there is no fresh one
+    """
+    global _READER
+    with _READER_LOCK:
+        for _ in range(2):
+            reader = get_reader()
+            if reader is None:
+                return None
+            snapshot = reader.read()
+            fresh = snapshot is not None and (
+                max_age is None or
+                time.time() - snapshot.timestamp <= max_age)
+            if fresh:
+                return snapshot
+            reader.close()
+            _READER = None
+        return None
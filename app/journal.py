@@ -0,0 +1,622 @@
+"""
+Frame journal: an always-on record of every frame the security system
+processes, kept in a memory-mapped circular file so false alerts and missed
+motion can be looked at after the fact.
+
+Every frame appends a fixed size record (timestamp, PIR value, contour
+stats, decision and stage timings) to a ring of records, and a downsampled
+frame is added to a second ring at frame_fps. Appending is a struct pack and,
+for frames, a resize and copy into the mapping, so the cost per frame is
+constant and nothing is read back. The mapping is flushed to disk from a
+background thread every flush_seconds.
+
+Each record and frame carries a sequence number and a CRC, so after a crash
+(or power loss) the journal is recovered by scanning for the latest valid
+record, and records that were only partially written are skipped.
+
+    python3 journal.py list --last 600
+    python3 journal.py extract --start '2026-10-19 17:00:00' \\
+        --end '2026-10-19 17:05:00' --out window.pkl
+    python3 journal.py replay --last 300 --set min_area=3000
+
+extract saves the window in the format of SecuritySystem.save_pickle, so it
+can also be stepped through with webcam.py --source window.pkl. replay runs
+the records of the window through the decision engine, and its frames
+through the motion detector, with the current settings or overrides.
+"""
+import argparse
+import collections
+import logging
+import math
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+MAGIC = b'RPJL'
+VERSION = 1
+STATES = ['idle', 'suspect', 'confirmed', 'cooldown']
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# magic, version, record capacity, frame capacity, bytes per frame
+HEADER = struct.Struct('<4sIIII')
+HEADER_SIZE = 64
+# sequence, timestamp, pir, contours, max and total contour area, bounding
+# box of the largest contour, occupied, person probability, state index,
+# score, alert, detect, classify and loop milliseconds, frame slot. The
+# record's CRC follows
+RECORD = struct.Struct('<QdbHffHHHH?fbf?fffi')
+CRC = struct.Struct('<I')
+RECORD_SIZE = RECORD.size + CRC.size
+# sequence of the record the frame belongs to, timestamp, height, width,
+# channels, CRC of the frame data
+FRAME_HEADER = struct.Struct('<QdHHBI')
+
+Record = collections.namedtuple('Record', [
+    'seq', 'timestamp', 'pir', 'contours', 'max_area', 'total_area',
+    'box', 'occupied', 'person_prob', 'state', 'score', 'alert',
+    'detect_ms', 'classify_ms', 'loop_ms', 'frame_slot'])
+
+
+def default_settings(conf=None):
+    """Journal settings, with the frame size derived from the resolution
+
+    Returns:
+        dict: Settings
+    """
+    conf = conf or CONF
+    settings = dict(conf.get('journal', {}))
+    width, height = conf['resolution']
+    settings.setdefault('path', 'data/journal.bin')
+    settings['path'] = os.path.join(config.CURR_DIR, settings['path'])
+    settings.setdefault('records', 36000)
+    settings.setdefault('frames', 1200)
+    settings.setdefault('frame_width', 160)
+    settings.setdefault('frame_fps', 1)
+    settings.setdefault('color', False)
+    settings.setdefault('flush_seconds', 5)
+    settings['frame_height'] = int(
+        height * settings['frame_width'] / width)
+    settings['channels'] = 3 if settings['color'] else 1
+    return settings
+
+
+def contour_stats(contours):
+    """Summarize the contours of a frame
+
+    Args:
+        contours (list): List of contours meta
+
+    Returns:
+        tuple: (count, max area, total area, (x, y, w, h) of the largest)
+    """
+    if not contours:
+        return 0, 0.0, 0.0, (0, 0, 0, 0)
+    largest = max(contours, key=lambda c: c['size'])
+    return (len(contours), largest['size'],
+            sum(c['size'] for c in contours), tuple(largest['coords']))
+
+
+class Journal():
+
+    def __init__(self, path, records, frames, frame_bytes, writable=False):
+        """Map a journal file. Use Journal.open or Journal.create
+
+        Args:
+            path (str): Journal file
+            records (int): Capacity of the record ring
+            frames (int): Capacity of the frame ring
+            frame_bytes (int): Bytes of frame data per frame slot
+            writable (bool, optional): Map the file for writing
+        """
+        self.path = path
+        self.capacity = records
+        self.frame_capacity = frames
+        self.frame_bytes = frame_bytes
+        self.frame_slot_size = FRAME_HEADER.size + frame_bytes
+        self.frames_offset = HEADER_SIZE + records * RECORD_SIZE
+        size = self.frames_offset + frames * self.frame_slot_size
+
+        with open(path, 'r+b' if writable else 'rb') as file_in:
+            self.mmap = mmap.mmap(
+                file_in.fileno(), size,
+                access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        # frame slot written last, the next frame goes to the one after it
+        self.seq, self.frame_slot = self.recover()
+
+    @classmethod
+    def open(cls, path, writable=False):
+        """Open an existing journal
+
+        Args:
+            path (str): Journal file
+            writable (bool, optional): Map the file for writing
+
+        Returns:
+            Journal: Journal, None if the file isn't a journal
+        """
+        try:
+            with open(path, 'rb') as file_in:
+                magic, version, records, frames, frame_bytes = \
+                    HEADER.unpack(file_in.read(HEADER.size))
+        except (OSError, struct.error):
+            return None
+        if magic != MAGIC or version != VERSION:
+            return None
+        return cls(path, records, frames, frame_bytes, writable)
+
+    @classmethod
+    def create(cls, settings=None):
+        """Open the journal for writing, creating it (or replacing it if its
+        capacity changed) as needed
+
+        Args:
+            settings (dict, optional): Settings, see default_settings
+
+        Returns:
+            Journal: Writable journal
+        """
+        settings = settings or default_settings()
+        path = settings['path']
+        frame_bytes = settings['frame_width'] * settings['frame_height'] * \
+            settings['channels']
+        journal = cls.open(path, writable=True)
+        if journal is not None:
+            if (journal.capacity, journal.frame_capacity,
+                    journal.frame_bytes) == (settings['records'],
+                                             settings['frames'], frame_bytes):
+                return journal
+            LOGGER.info('Journal capacity changed, replacing %s', path)
+            journal.close()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = HEADER_SIZE + settings['records'] * RECORD_SIZE + \
+            settings['frames'] * (FRAME_HEADER.size + frame_bytes)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as file_out:
+            file_out.write(HEADER.pack(MAGIC, VERSION, settings['records'],
+                                       settings['frames'], frame_bytes))
+            # sparse, the zeroed slots read as empty
+            file_out.truncate(size)
+        os.replace(tmp_path, path)
+        return cls(path, settings['records'], settings['frames'],
+                   frame_bytes, writable=True)
+
+    def record_offset(self, seq):
+        return HEADER_SIZE + (seq % self.capacity) * RECORD_SIZE
+
+    def frame_offset(self, slot):
+        return self.frames_offset + slot * self.frame_slot_size
+
+    def read_record(self, index):
+        """Returns:
+            Record: Record in slot <index>, None if empty or torn
+        """
+        offset = HEADER_SIZE + index * RECORD_SIZE
+        data = self.mmap[offset:offset + RECORD.size]
+        crc = CRC.unpack_from(self.mmap, offset + RECORD.size)[0]
+        if data[:8] == bytes(8) or zlib.crc32(data) != crc:
+            return None
+        fields = RECORD.unpack(data)
+        return Record(*fields[:6], fields[6:10], *fields[10:])
+
+    def recover(self):
+        """Find the latest valid record and frame, i.e. after a crash
+
+        Returns:
+            tuple: (last record sequence, slot of the last frame). The
+            frame slots hold the sequence of their record, so the last
+            frame is in the slot with the highest one
+        """
+        seq = 0
+        for index in range(self.capacity):
+            offset = HEADER_SIZE + index * RECORD_SIZE
+            record_seq = struct.unpack_from('<Q', self.mmap, offset)[0]
+            if record_seq > seq and self.read_record(index) is not None:
+                seq = record_seq
+        frame_slot, frame_record = 0, 0
+        for slot in range(self.frame_capacity):
+            record_seq = struct.unpack_from(
+                '<Q', self.mmap, self.frame_offset(slot))[0]
+            if record_seq > frame_record:
+                frame_slot, frame_record = slot, record_seq
+        return seq, frame_slot
+
+    def append(self, timestamp, pir, contours, occupied, person_prob, state,
+               score, alert, timings, frame=None):
+        """Append the record of a frame
+
+        Args:
+            timestamp (float): Unix timestamp of the frame
+            pir (int): Latest PIR value, None if unknown
+            contours (list): List of contours meta
+            occupied (bool): Motion classification
+            person_prob (float): Person probability, None if not computed
+            state (str): Decision engine state
+            score (float): Decision engine score
+            alert (bool): Whether an alert was sent
+            timings (tuple): (detect, classify, loop) milliseconds
+            frame (numpy.ndarray, optional): Downsampled frame to add
+
+        Returns:
+            int: Sequence number of the record
+        """
+        self.seq += 1
+        slot = -1
+        if frame is not None:
+            slot = self.write_frame(self.seq, timestamp, frame)
+        count, max_area, total_area, box = contour_stats(contours)
+        offset = self.record_offset(self.seq)
+        RECORD.pack_into(
+            self.mmap, offset, self.seq, timestamp,
+            -1 if pir is None else int(pir), min(count, 0xffff), max_area,
+            total_area, *box, bool(occupied),
+            float('nan') if person_prob is None else person_prob,
+            STATES.index(state) if state in STATES else -1, score,
+            bool(alert), *timings, slot)
+        CRC.pack_into(self.mmap, offset + RECORD.size, zlib.crc32(
+            self.mmap[offset:offset + RECORD.size]))
+        return self.seq
+
+    def write_frame(self, seq, timestamp, frame):
+        """Copy a downsampled frame into the next frame slot
+
+        Returns:
+            int: Frame slot
+        """
+        frame = np.ascontiguousarray(frame)
+        if frame.nbytes > self.frame_bytes:
+            raise ValueError('Frame of {} bytes too large for the journal'
+                             .format(frame.nbytes))
+        self.frame_slot = slot = (self.frame_slot + 1) % self.frame_capacity
+        offset = self.frame_offset(slot)
+        data = offset + FRAME_HEADER.size
+        self.mmap[data:data + frame.nbytes] = frame.tobytes()
+        height, width = frame.shape[:2]
+        FRAME_HEADER.pack_into(
+            self.mmap, offset, seq, timestamp, height, width,
+            frame.shape[2] if frame.ndim == 3 else 1,
+            zlib.crc32(self.mmap[data:data + frame.nbytes]))
+        return slot
+
+    def read_frame(self, record):
+        """Returns:
+            numpy.ndarray: Frame of the record, None if it has none or it
+            was overwritten since
+        """
+        if record.frame_slot < 0:
+            return None
+        offset = self.frame_offset(record.frame_slot)
+        seq, _, height, width, channels, crc = FRAME_HEADER.unpack_from(
+            self.mmap, offset)
+        if seq != record.seq:
+            return None
+        data = offset + FRAME_HEADER.size
+        size = height * width * channels
+        buffer = self.mmap[data:data + size]
+        if zlib.crc32(buffer) != crc:
+            return None
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        return np.frombuffer(buffer, np.uint8).reshape(shape)
+
+    def records(self, start=None, end=None):
+        """Valid records in a time window, oldest first
+
+        Args:
+            start (float, optional): Unix timestamp, inclusive
+            end (float, optional): Unix timestamp, inclusive
+
+        Returns:
+            list: Records
+        """
+        records = []
+        for index in range(self.capacity):
+            record = self.read_record(index)
+            if record is None:
+                continue
+            if start is not None and record.timestamp < start:
+                continue
+            if end is not None and record.timestamp > end:
+                continue
+            records.append(record)
+        records.sort(key=lambda r: r.seq)
+        return records
+
+    def flush(self):
+        self.mmap.flush()
+
+    def close(self):
+        self.mmap.close()
+
+
+class JournalWriter():
+    """Appends the frames of the security system to the journal, adding a
+    downsampled frame at frame_fps, and flushes it in the background
+    """
+
+    def __init__(self, conf=None):
+        """Initialize the JournalWriter class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml
+        """
+        self.settings = default_settings(conf)
+        self.journal = Journal.create(self.settings)
+        self.size = (self.settings['frame_width'],
+                     self.settings['frame_height'])
+        self.frame_interval = 1 / self.settings['frame_fps'] \
+            if self.settings['frame_fps'] else None
+        self.last_frame = 0.0
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self.flush_loop,
+                                         name='journal', daemon=True)
+        self._flusher.start()
+
+    def downsample(self, frame):
+        import cv2
+
+        if frame.ndim == 3 and self.settings['channels'] == 1:
+            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        elif frame.ndim == 2 and self.settings['channels'] == 3:
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        return cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+
+    def append(self, frame, contours, pir, occupied, person_prob, result,
+               alert, timings):
+        """Append the record of a frame, called from the camera loop
+
+        Args:
+            frame (numpy.ndarray): Latest frame
+            contours (list): List of contours meta
+            pir (int): Latest PIR value
+            occupied (bool): Motion classification
+            person_prob (float): Person probability, None if not computed
+            result (decision.Decision): Decision for the frame
+            alert (bool): Whether an alert was sent
+            timings (tuple): (detect, classify, loop) milliseconds
+        """
+        now = time.time()
+        small = None
+        if self.frame_interval is not None and \
+                now - self.last_frame >= self.frame_interval:
+            small = self.downsample(frame)
+            self.last_frame = now
+        self.journal.append(now, pir, contours, occupied, person_prob,
+                            result.state, result.score, alert, timings, small)
+
+    def flush_loop(self):
+        while not self._stopped.wait(self.settings['flush_seconds']):
+            try:
+                self.journal.flush()
+            except (OSError, ValueError):
+                LOGGER.exception('Unable to flush the journal')
+
+    def close(self):
+        self._stopped.set()
+        self.journal.flush()
+        self.journal.close()
+
+
+def record_dict(record):
+    """Returns:
+        dict: Record fields, with the state name and None for unknown values
+    """
+    data = record._asdict()
+    data['state'] = STATES[record.state] if record.state >= 0 else None
+    data['pir'] = None if record.pir < 0 else record.pir
+    data['person_prob'] = None if math.isnan(record.person_prob) \
+        else record.person_prob
+    return data
+
+
+def extract(journal, start=None, end=None):
+    """Extract a time window of the journal in the format of
+    SecuritySystem.save_pickle, with the records added
+
+    Args:
+        journal (Journal): Journal to read
+        start (float, optional): Unix timestamp
+        end (float, optional): Unix timestamp
+
+    Returns:
+        dict: Sample, frames are the journaled frames of the window
+    """
+    records = journal.records(start, end)
+    frames, frame_records = [], []
+    for record in records:
+        frame = journal.read_frame(record)
+        if frame is not None:
+            frames.append(frame.copy())
+            frame_records.append(record.seq)
+    pir = [r.pir for r in records if r.pir >= 0]
+    return {
+        'frame': frames[-1] if frames else None,
+        'frames': frames,
+        'frame_delta': None,
+        'avg': None,
+        'contours': [],
+        'pir': pir,
+        'classification': any(r.alert for r in records),
+        'ts': datetime.fromtimestamp(records[-1].timestamp).strftime(
+            '%Y-%m-%d-%H-%M-%S.%f') if records else None,
+        'records': [record_dict(r) for r in records],
+        'frame_records': frame_records,
+    }
+
+
+def replay_decisions(sample, conf):
+    """Replay the records of an extracted window through the decision
+    engine, at the recorded frame rate. The recorded area of the largest
+    contour of each record is classified against min_area (zones aren't
+    journaled)
+
+    Args:
+        sample (dict): Window from extract
+        conf (dict): Pipeline settings
+
+    Returns:
+        list: (timestamp, recorded state, replayed state, replayed alert)
+    """
+    import decision
+    from model import MotionModel
+
+    engine = decision.DecisionEngine(conf, clock=lambda: 0.0)
+    model = MotionModel(conf)
+    rows = []
+    for record in sample['records']:
+        occupied = record['max_area'] > model.area_threshold
+        result = engine.update(occupied, record['pir'],
+                               record['person_prob'], now=record['timestamp'])
+        rows.append((record['timestamp'], record['state'], result.state,
+                     result.alert))
+    return rows
+
+
+def replay_frames(sample, conf):
+    """Replay the journaled frames of an extracted window through
+    MotionDetector and MotionModel, scaled back up to frame_width. The
+    background model only sees the journaled frames, so it converges
+    slower than the live one
+
+    Args:
+        sample (dict): Window from extract
+        conf (dict): Pipeline settings
+
+    Returns:
+        list: (timestamp, recorded occupied, replayed occupied, replayed
+            largest contour area)
+    """
+    import cv2
+
+    from model import MotionModel
+    from security_system import MotionDetector
+
+    records = {r['seq']: r for r in sample['records']}
+    detector = MotionDetector(conf)
+    model = MotionModel(conf)
+    avg = None
+    rows = []
+    for seq, frame in zip(sample['frame_records'], sample['frames']):
+        record = records[seq]
+        gray = detector.process_frame(frame)
+        if avg is None:
+            avg = gray.astype('float')
+            continue
+        cv2.accumulateWeighted(gray, avg, detector.alpha)
+        contours, _ = detector.compare_frame(gray, avg)
+        rows.append((record['timestamp'], record['occupied'],
+                     model.classify(frame, contours, []),
+                     contour_stats(contours)[1]))
+    return rows
+
+
+def parse_window(args):
+    """Returns:
+        tuple: (start, end) unix timestamps of the --start, --end or --last
+        arguments
+    """
+    if args.last:
+        return time.time() - args.last, None
+    start = end = None
+    if args.start:
+        start = datetime.strptime(args.start, TS_FORMAT).timestamp()
+    if args.end:
+        end = datetime.strptime(args.end, TS_FORMAT).timestamp()
+    return start, end
+
+
+def parse_settings(specs):
+    """Parse settings of the form `name=<yaml value>`"""
+    import yaml
+
+    settings = {}
+    for spec in specs:
+        name, _, value = spec.partition('=')
+        settings[name] = yaml.safe_load(value)
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--journal', default=default_settings()['path'])
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    for name in ('list', 'extract', 'replay'):
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument('--start', help=TS_FORMAT.replace('%', '%%'))
+        subparser.add_argument('--end', help=TS_FORMAT.replace('%', '%%'))
+        subparser.add_argument('--last', type=float,
+                               help='Seconds before now')
+        if name == 'extract':
+            subparser.add_argument('--out', required=True)
+        if name == 'replay':
+            subparser.add_argument('--set', nargs='*', default=[],
+                                   help='name=<yaml value> overrides')
+    args = parser.parse_args()
+
+    journal = Journal.open(args.journal)
+    if journal is None:
+        parser.error('{} is not a journal'.format(args.journal))
+    start, end = parse_window(args)
+
+    if args.command == 'list':
+        print('{:<19} {:>4} {:>8} {:>9} {:>6} {:>6} {:>8} {:>8} {:>5}'.format(
+            'time', 'pir', 'contours', 'max area', 'state', 'score',
+            'detect', 'classify', 'frame'))
+        for record in journal.records(start, end):
+            data = record_dict(record)
+            print('{:<19} {:>4} {:>8} {:>9.0f} {:>6} {:>6.2f} {:>8.1f} '
+                  '{:>8.1f} {:>5}'.format(
+                      datetime.fromtimestamp(data['timestamp'])
+                      .strftime(TS_FORMAT), str(data['pir']),
+                      data['contours'], data['max_area'],
+                      (data['state'] or '')[:6], data['score'],
+                      data['detect_ms'], data['classify_ms'],
+                      'yes' if data['frame_slot'] >= 0 else ''))
+        return
+
+    sample = extract(journal, start, end)
+    print('{} records, {} frames'.format(len(sample['records']),
+                                         len(sample['frames'])))
+    if args.command == 'extract':
+        with open(args.out, 'wb') as file_out:
+            pickle.dump(sample, file_out)
+        return
+
+    conf = dict(CONF, **parse_settings(args.set))
+    rows = replay_decisions(sample, conf)
+    changed = 0
+    for timestamp, recorded, replayed, alert in rows:
+        if recorded != replayed or alert:
+            changed += recorded != replayed
+            print('{} {:>9} -> {:<9} {}'.format(
+                datetime.fromtimestamp(timestamp).strftime(TS_FORMAT),
+                recorded, replayed, 'alert' if alert else ''))
+    print('{} of {} decisions changed, {} alerts recorded, {} replayed'
+          .format(changed, len(rows),
+                  sum(r['alert'] for r in sample['records']),
+                  sum(row[3] for row in rows)))
+
+    rows = replay_frames(sample, conf)
+    if rows:
+        print('motion on {} of {} journaled frames, {} recorded'.format(
+            sum(row[2] for row in rows), len(rows),
+            sum(row[1] for row in rows)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+In-process log tailing. Replaces spawning a `tail` subprocess for every log
+stream request with a few reads from the end of the file.
+"""
+import os
+import time
+import logging
+
+LOGGER = logging.getLogger(__name__)
+BLOCK_SIZE = 4096
+
+
+def tail(filepath, num_lines=50, block_size=BLOCK_SIZE):
+    """Return the last lines of a file by reading blocks backwards from the
+    end of the file, equivalent to `tail -n <num_lines> <filepath>`
+
+    Args:
+        filepath (str): Path of the file to tail
+        num_lines (int, optional): Number of lines to return. Defaults to 50
+        block_size (int, optional): Number of bytes to read per seek
+
+    Returns:
+        bytes: Last <num_lines> lines of the file. Empty if the file can't be
+            read
+    """
+    num_lines = int(num_lines)
+    try:
+        with open(filepath, 'rb') as file_in:
+            pos = file_in.seek(0, os.SEEK_END)
+            blocks = []
+            newlines = 0
+            # need one more newline than lines requested, since the last
+            # line of a log file is usually newline terminated
+            while pos > 0 and newlines <= num_lines:
+                read_size = min(block_size, pos)
+                pos -= read_size
+                file_in.seek(pos)
+                block = file_in.read(read_size)
+                newlines += block.count(b'\n')
+                blocks.append(block)
+    except OSError as exc:
+        LOGGER.warning('Unable to tail %s: %s', filepath, exc)
+        return b''
+
+    data = b''.join(reversed(blocks))
+    lines = data.splitlines(keepends=True)
+    return b''.join(lines[-num_lines:]) if num_lines else b''
+
+
+def follow(filepath, num_lines=50, poll_interval=1.0, keepalive=15,
+           max_seconds=None):
+    """Follow a file as it is appended to, similar to `tail -f`.
+
+    The current end of the file is tracked as an offset, so each poll is a
+    single `os.stat` plus a read of any new bytes. Truncation and rotation
+    (the path pointing at a new inode) are detected and the file is re-read
+    from the start.
+
+    Args:
+        filepath (str): Path of the file to follow
+        num_lines (int, optional): Number of existing lines to yield first
+        poll_interval (float, optional): Seconds to wait between checks
+        keepalive (float, optional): Yield an empty chunk after this many
+            seconds without new data, so callers can detect dead clients
+        max_seconds (float, optional): Stop following after this many
+            seconds. Defaults to None, which follows forever
+
+    Yields:
+        bytes: New data appended to the file, or b'' as a keepalive
+    """
+    for _, data in follow_many({filepath: filepath}, num_lines,
+                               poll_interval, keepalive, max_seconds):
+        yield data
+
+
+def follow_many(filepaths, num_lines=50, poll_interval=1.0, keepalive=15,
+                max_seconds=None):
+    """Follow several files in a single loop, see follow
+
+    Args:
+        filepaths (dict): Name -> path of the files to follow
+        num_lines (int, optional): Number of existing lines to yield first
+        poll_interval (float, optional): Seconds to wait between checks
+        keepalive (float, optional): Yield (None, b'') after this many
+            seconds without new data, so callers can detect dead clients
+        max_seconds (float, optional): Stop following after this many
+            seconds. Defaults to None, which follows forever
+
+    Yields:
+        tuple: (name, new data appended to the file), (None, b'') as a
+            keepalive
+    """
+    started = time.monotonic()
+    last_yield = started
+    # name -> [offset, inode]
+    positions = {}
+    for name, filepath in filepaths.items():
+        try:
+            stat = os.stat(filepath)
+            positions[name] = [stat.st_size, stat.st_ino]
+        except OSError:
+            positions[name] = [0, None]
+
+    for name, filepath in filepaths.items():
+        initial = tail(filepath, num_lines)
+        if initial:
+            yield name, initial
+
+    while max_seconds is None or time.monotonic() - started < max_seconds:
+        time.sleep(poll_interval)
+        sent = False
+        for name, filepath in filepaths.items():
+            data = read_new(filepath, positions[name])
+            if data:
+                sent = True
+                yield name, data
+
+        now = time.monotonic()
+        if sent:
+            last_yield = now
+        elif now - last_yield >= keepalive:
+            last_yield = now
+            yield None, b''
+
+
+def read_new(filepath, position):
+    """Read the bytes appended to a file since the last read
+
+    Args:
+        filepath (str): Path of the file
+        position (list): [offset, inode] of the last read, updated in place
+
+    Returns:
+        bytes: New data, empty if there is none
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return b''
+
+    offset, inode = position
+    if stat.st_ino != inode or stat.st_size < offset:
+        LOGGER.debug('%s was rotated or truncated', filepath)
+        inode, offset = stat.st_ino, 0
+    data = b''
+    if stat.st_size > offset:
+        with open(filepath, 'rb') as file_in:
+            file_in.seek(offset)
+            data = file_in.read(stat.st_size - offset)
+        offset += len(data)
+    position[:] = [offset, inode]
+    return data
@@ -0,0 +1,205 @@
+"""
+Low-light mode. At night the camera frames are dark and noisy, and with the
+daytime delta_thresh the noise alone makes small contours all over the
+frame, which costs findContours time and sends false alerts.
+
+The scene brightness is measured on a subsample of the gray frame every
+check_frames frames, normalized by the camera's exposure time and gain when
+they're known, so raising them at night doesn't switch the mode back. Below
+enter_brightness the camera switches to the night exposure settings (iso,
+exposure_mode), and the gray frames are denoised with a running average
+computed in place. The sensor noise is measured from the difference of
+consecutive frames, and the delta threshold is raised to noise_k standard
+deviations of the noise left after denoising.
+
+    low_light:
+      enabled: True
+      enter_brightness: 40 # mean luma, 0-255
+      exit_ratio: 2.5 # leave once the scene is this much brighter
+      iso: 800
+      exposure_mode: night
+      denoise_alpha: 0.5
+      noise_k: 3
+      settle_frames: 20 # frames the exposure takes to settle
+
+The background image restarts while the exposure settles after a switch.
+"""
+import logging
+import math
+
+import cv2
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+# Pixels between the samples of the brightness and noise measurements
+SAMPLE_STEP = 4
+
+
+def brightness(gray):
+    """Mean luma of a subsample of the frame"""
+    return float(gray[::SAMPLE_STEP, ::SAMPLE_STEP].mean())
+
+
+def noise_sigma(gray, previous):
+    """Standard deviation of the per-pixel sensor noise, estimated from the
+    difference of two consecutive frames (the scene mostly doesn't move, and
+    the difference of two noisy frames has twice the noise variance)
+
+    Args:
+        gray (numpy.ndarray): Gray frame
+        previous (numpy.ndarray): Previous gray frame
+
+    Returns:
+        float: Noise standard deviation in luma levels
+    """
+    a = gray[::SAMPLE_STEP, ::SAMPLE_STEP].astype(np.int16)
+    b = previous[::SAMPLE_STEP, ::SAMPLE_STEP].astype(np.int16)
+    diff = a - b
+    # the median absolute deviation ignores the pixels that did move
+    mad = np.median(np.abs(diff - np.median(diff)))
+    return float(mad * 1.4826 / math.sqrt(2))
+
+
+def exposure_level(camera):
+    """Exposure time times gain of the camera, None if unknown"""
+    if camera is None:
+        return None
+    try:
+        level = camera.exposure_speed * float(camera.analog_gain) * \
+            float(camera.digital_gain)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return level or None
+
+
+class LowLightController():
+
+    def __init__(self, conf=None):
+        """Initialize the LowLightController class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml
+        """
+        conf = conf or CONF
+        settings = conf.get('low_light', {})
+        self.enter_brightness = settings.get('enter_brightness', 40)
+        self.exit_ratio = settings.get('exit_ratio', 2.5)
+        self.check_frames = settings.get('check_frames', 10)
+        self.iso = settings.get('iso', 800)
+        self.exposure_mode = settings.get('exposure_mode', 'night')
+        self.denoise_alpha = settings.get('denoise_alpha', 0.5)
+        self.noise_k = settings.get('noise_k', 3)
+        self.settle_frames = settings.get('settle_frames', 20)
+
+        self.night = False
+        # Scene light level when night mode started
+        self.entry_level = None
+        self.sigma = 0.0
+        self.frames = 0
+        # Frames left until the exposure settles after a switch
+        self.settling = 0
+        self.previous = None
+        # Running average of the gray frames at night, and its uint8 copy
+        self.average = None
+        self.denoised = None
+
+    def scene_level(self, gray, camera):
+        """Brightness normalized by the camera exposure, when known"""
+        level = exposure_level(camera)
+        value = brightness(gray)
+        return value / level if level else value
+
+    def check(self, gray, camera=None):
+        """Measure the scene and switch modes if needed
+
+        Returns:
+            bool: Whether the mode changed
+        """
+        value = brightness(gray)
+        if self.previous is not None:
+            sigma = noise_sigma(gray, self.previous)
+            self.sigma = sigma if not self.sigma else \
+                0.8 * self.sigma + 0.2 * sigma
+        self.previous = gray.copy()
+
+        if not self.night and value < self.enter_brightness:
+            self.set_night(True, camera)
+            self.entry_level = self.scene_level(gray, camera)
+            return True
+        if self.night and self.entry_level is not None and \
+                self.scene_level(gray, camera) > \
+                self.entry_level * self.exit_ratio:
+            self.set_night(False, camera)
+            return True
+        return False
+
+    def set_night(self, night, camera=None):
+        LOGGER.info('Switching to %s mode (noise sigma %.1f)',
+                    'night' if night else 'day', self.sigma)
+        self.night = night
+        self.average = None
+        self.settling = self.settle_frames
+        if camera is None:
+            return
+        try:
+            if night:
+                camera.iso = self.iso
+                camera.exposure_mode = self.exposure_mode
+            else:
+                camera.iso = 0
+                camera.exposure_mode = 'auto'
+        except Exception:
+            LOGGER.exception('Unable to change the camera exposure')
+
+    def process(self, gray, camera=None):
+        """Check the scene every check_frames frames, and denoise the frame
+        at night
+
+        Args:
+            gray (numpy.ndarray): Blurred, grayscale frame
+            camera (picamera.PiCamera, optional): Camera to adjust
+
+        Returns:
+            tuple: (frame to detect motion on, whether the background image
+                should restart because the exposure is changing)
+        """
+        self.frames += 1
+        if self.frames % self.check_frames == 1 or self.check_frames <= 1:
+            self.check(gray, camera)
+        restart = self.settling > 0
+        self.settling = max(0, self.settling - 1)
+        if not self.night:
+            return gray, restart
+
+        if self.average is None or self.average.shape != gray.shape:
+            self.average = gray.astype(np.float32)
+            self.denoised = gray.copy()
+        else:
+            cv2.accumulateWeighted(gray, self.average, self.denoise_alpha)
+            cv2.convertScaleAbs(self.average, self.denoised)
+        return self.denoised, restart
+
+    def delta_thresh(self, base):
+        """Delta threshold for the current mode
+
+        Args:
+            base (int): Daytime delta_thresh
+
+        Returns:
+            int: base during the day, raised above the remaining noise at
+                night
+        """
+        if not self.night:
+            return base
+        # An exponential average with weight a keeps a / (2 - a) of the
+        # noise variance
+        alpha = self.denoise_alpha
+        sigma = self.sigma * math.sqrt(alpha / (2 - alpha))
+        return int(min(255, max(base, math.ceil(self.noise_k * sigma))))
@@ -1,13 +1,9 @@
 """Model used to classify an image as having been triggered by motion 
 """
 import logging
-import os
 
-import numpy as np
-import cv2
-
-import utils
 import config
+import detector
 
 LOGGER = logging.getLogger(__name__)
 CONF = config.load_config()
@@ -16,45 +12,174 @@ config.init_logging()
 
 class MotionModel():
 
-    def __init__(self):
+    def __init__(self, conf=None):
         """Initialize the MotionModel class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml, i.e.
+                when backtesting other parameters
+        """
+        conf = conf or CONF
+        self.frame_width = conf['frame_width']
+        self.min_area = None
+        self.sensitivity = (1.0, ())
+        self.detector_settings = None
+        self._model = None
+        self.configure(conf)
+
+    def configure(self, conf):
+        """Apply new settings. The area thresholds are only recomputed when
+        min_area changes, and the detector only reloaded when its settings
+        change
+
+        Args:
+            conf (dict): Settings
+        """
+        if conf['min_area'] != self.min_area:
+            self.min_area = conf['min_area']
+            self.set_sensitivity(*self.sensitivity)
+
+        # Inference settings, see get_person_prob
+        self.inference_mode = conf.get('inference_mode', 'full')
+        self.crop_padding = conf.get('crop_padding', 0.25)
+        self.max_crop_regions = conf.get('max_crop_regions', 4)
+        self.min_crop_area = conf.get('min_crop_area', 0)
+        detector_settings = conf.get('detector')
+        if detector_settings != self.detector_settings:
+            if self._model is not None:
+                LOGGER.info('Detector settings changed, reloading the model')
+            self.detector_settings = detector_settings
+            self._model = None
+
+    @property
+    def model(self):
+        """The pre-trained network, loaded on first use so importing or
+        constructing the class doesn't pay for reading the model files
+
+        Returns:
+            Person detector backend, see detector.build_detector
         """
-        self.min_area = CONF['min_area']
-        self.model = self.load_model()
-        self.person_class = 15 # index of the person class of the pre-trained model
+        if self._model is None:
+            LOGGER.info('Loading person detection model')
+            self._model = self.load_model()
+        return self._model
 
     def load_model(self):
-        proto_path = os.path.join(
-            config.MODEL_DIR, 'MobileNetSSD_deploy.prototxt.txt')
-        model_path = os.path.join(
-            config.MODEL_DIR, 'MobileNetSSD_deploy.caffemodel')
-        net = cv2.dnn.readNetFromCaffe(proto_path, model_path)
-        return net
-
-    def get_person_prob(self, image):
+        return detector.build_detector(self.detector_settings)
+
+    def get_person_prob(self, image, contours=None):
         """Get the probability of a person being present in an image
-        
+
+        In 'crop' inference mode, when the contours of the motion in the
+        image are provided, only padded crops around them are classified (see
+        get_region_person_prob). Otherwise the whole image is classified.
+
         Args:
             image (numpy.ndarray): Image to classify
-        
+            contours (list, optional): List of contours meta, with coords at
+                <frame_width> resolution
+
         Returns:
             float: Probability between 0 and 1 of a person being present
         """
-        resized = cv2.resize(image, (300, 300))
-        blob = cv2.dnn.blobFromImage(resized, 0.007843, (300, 300), 127.5)
-        self.model.setInput(blob)
-        detections = self.model.forward()
-        probs = [
-            detections[0, 0, i, 2] if int(detections[0, 0, i, 1]) == 15 else 0 
-            for i in np.arange(0, detections.shape[2])
-        ]
-        person_prob = max(probs)
-        return person_prob
+        if self.inference_mode == 'crop' and contours is not None:
+            regions = self.get_regions(image, contours)
+            if not regions:
+                return 0.0
+            if len(regions) <= self.max_crop_regions:
+                return self.get_region_person_prob(image, regions)
+            LOGGER.debug('%s regions, classifying the full frame',
+                         len(regions))
+
+        return self.forward([image])
+
+    def forward(self, images):
+        """Run the detector over a batch of images, in a single forward pass
+        where the backend supports it
+
+        Args:
+            images (list): Images to classify
+
+        Returns:
+            float: Highest probability of a person in any of the images
+        """
+        return self.model.person_prob(images)
+
+    def get_regions(self, image, contours):
+        """Scale the contour bounding boxes up to the image resolution, pad
+        them into squares (the detector's input shape) and merge the
+        overlapping ones
+
+        Args:
+            image (numpy.ndarray): Full resolution image
+            contours (list): List of contours meta, with coords at
+                <frame_width> resolution
+
+        Returns:
+            list: Regions as (x1, y1, x2, y2) in image coordinates
+        """
+        height, width = image.shape[:2]
+        scale = width / self.frame_width
+        regions = []
+        for contour in contours:
+            if contour['size'] < self.min_crop_area:
+                continue
+            x, y, w, h = [v * scale for v in contour['coords']]
+            side = max(w, h) * (1 + 2 * self.crop_padding)
+            cx, cy = x + w / 2, y + h / 2
+            regions.append((
+                max(0, int(cx - side / 2)), max(0, int(cy - side / 2)),
+                min(width, int(cx + side / 2)), min(height, int(cy + side / 2))
+            ))
+        return merge_regions(regions)
+
+    def get_region_person_prob(self, image, regions):
+        """Classify crops of the image, batched into one forward pass
+
+        Args:
+            image (numpy.ndarray): Full resolution image
+            regions (list): Regions as (x1, y1, x2, y2)
+
+        Returns:
+            float: Highest probability of a person in any of the regions
+        """
+        crops = [image[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+        return self.forward(crops)
+
+    def set_sensitivity(self, sensitivity=1.0, zones=()):
+        """Scale the minimum contour area, for the whole frame and per zone.
+        A sensitivity of 2 halves the area, 0 ignores the motion entirely
+
+        Args:
+            sensitivity (float, optional): Sensitivity of the whole frame
+            zones (tuple, optional): (name, (x1, y1, x2, y2), sensitivity) per
+                zone, with coords at <frame_width> resolution
+        """
+        def area(scale):
+            return self.min_area / scale if scale else float('inf')
+
+        self.sensitivity = (sensitivity, zones)
+        self.area_threshold = area(sensitivity)
+        self.zones = [(rect, area(sensitivity * zone_sensitivity))
+                      for _, rect, zone_sensitivity in zones]
+
+    def contour_threshold(self, contour):
+        """Minimum area of a contour, from the zone its center is in"""
+        x, y, w, h = contour['coords']
+        cx, cy = x + w / 2, y + h / 2
+        for (x1, y1, x2, y2), threshold in self.zones:
+            if x1 <= cx < x2 and y1 <= cy < y2:
+                return threshold
+        return self.area_threshold
 
     def check_contours(self, contours):
         contour_check = False
         for contour in contours:
-            if contour['size'] > self.min_area:
+            if self.zones:
+                threshold = self.contour_threshold(contour)
+            else:
+                threshold = self.area_threshold
+            if contour['size'] > threshold:
                 contour_check = True
         return contour_check
 
@@ -73,10 +198,40 @@ class MotionModel():
         classification = False
         
         contour_check = self.check_contours(contours)
-        # person_prob = self.get_person_prob(frame)
+        # person_prob = self.get_person_prob(frame, contours)
 
         # Decide classification strictly on contour_check
         if contour_check:
             classification = True
 
         return classification
+
+
+def merge_regions(regions):
+    """Merge overlapping regions into their bounding box, until none overlap
+
+    Args:
+        regions (list): Regions as (x1, y1, x2, y2)
+
+    Returns:
+        list: Merged regions
+    """
+    regions = list(regions)
+    merged = True
+    while merged:
+        merged = False
+        result = []
+        for region in regions:
+            for i, other in enumerate(result):
+                if (region[0] <= other[2] and other[0] <= region[2] and
+                        region[1] <= other[3] and other[1] <= region[3]):
+                    result[i] = (min(region[0], other[0]),
+                                 min(region[1], other[1]),
+                                 max(region[2], other[2]),
+                                 max(region[3], other[3]))
+                    merged = True
+                    break
+            else:
+                result.append(region)
+        regions = result
+    return regions
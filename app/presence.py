@@ -0,0 +1,282 @@
+"""
+Presence detection. Several sources (the router's connected devices API, the
+ARP table and a ping of known devices) are polled concurrently, and their
+results merged and debounced into a single home/away state.
+"""
+import logging
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+
+import requests
+
+LOGGER = logging.getLogger(__name__)
+
+ARP_TABLE = '/proc/net/arp'
+ARP_COMPLETE = 0x2
+
+
+class RouterSource():
+
+    name = 'router'
+
+    def __init__(self, router_conf, known_hosts, session_ttl=600, timeout=5):
+        """Initialize the RouterSource class
+
+        Args:
+            router_conf (dict): router section of private.yml
+            known_hosts (list): Host names of the devices to look for
+            session_ttl (float, optional): Seconds to reuse an authenticated
+                session before logging in again
+            timeout (float, optional): Request timeout in seconds
+        """
+        self.conf = router_conf
+        self.known_hosts = set(known_hosts)
+        self.session_ttl = session_ttl
+        self.timeout = timeout
+
+        self.session = None
+        self.headers = None
+        self.logged_in_at = 0
+
+    def login(self):
+        """Log in to the router and store the authenticated session"""
+        LOGGER.debug('Logging in to router')
+        session = requests.session()
+        session.get(self.conf['login_get'], timeout=self.timeout)
+
+        headers = self.conf['headers'].copy()
+        login_data = {'user': self.conf['user'], 'pws': self.conf['pws']}
+        response = session.post(self.conf['login_post'], login_data,
+                                headers=headers, timeout=self.timeout)
+        user_str = response.headers['Set-Cookie']
+        user_id = user_str.split(';')[0].split('userid=')[1]
+
+        headers['Cookie'] = self.conf['base_cookie'].format(
+            self.conf['user'], self.conf['pws'], user_id)
+
+        if self.session is not None:
+            self.session.close()
+        self.session = session
+        self.headers = headers
+        self.logged_in_at = time.monotonic()
+
+    def session_expired(self):
+        return (self.session is None or
+                time.monotonic() - self.logged_in_at > self.session_ttl)
+
+    def get_devices(self):
+        """Fetch the devices connected to the router, logging in again if
+        the session has expired or the router rejects it
+
+        Returns:
+            list: Connected devices
+        """
+        for attempt in range(2):
+            if attempt or self.session_expired():
+                self.login()
+            url = self.conf['get_connected_url'].format(int(time.time())*1000)
+            response = self.session.get(url, headers=self.headers,
+                                        timeout=self.timeout)
+            try:
+                devices = response.json()
+            except ValueError:
+                # an expired session gets the login page instead of json
+                LOGGER.debug('Router session rejected, logging in again')
+                continue
+            if isinstance(devices, list):
+                return devices
+        raise RuntimeError('Unable to fetch connected devices from router')
+
+    def detect(self):
+        """Returns:
+            set: Known hosts connected to the router
+        """
+        device_names = [d['hostName'] for d in self.get_devices()]
+        return self.known_hosts.intersection(device_names)
+
+
+class ArpSource():
+
+    name = 'arp'
+
+    def __init__(self, known_macs, arp_table=ARP_TABLE):
+        """Initialize the ArpSource class
+
+        Args:
+            known_macs (dict): MAC address -> name of the devices to look for
+            arp_table (str, optional): Path of the kernel ARP table
+        """
+        self.known_macs = {mac.lower(): name
+                           for mac, name in known_macs.items()}
+        self.arp_table = arp_table
+
+    def detect(self):
+        """Returns:
+            set: Names of known devices with a complete ARP entry
+        """
+        present = set()
+        with open(self.arp_table) as file_in:
+            next(file_in) # header
+            for line in file_in:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                flags, mac = int(fields[2], 16), fields[3].lower()
+                if flags & ARP_COMPLETE and mac in self.known_macs:
+                    present.add(self.known_macs[mac])
+        return present
+
+
+class PingSource():
+
+    name = 'ping'
+
+    def __init__(self, known_ips, timeout=1, max_workers=8):
+        """Initialize the PingSource class
+
+        Args:
+            known_ips (dict): IP address -> name of the devices to ping
+            timeout (int, optional): Seconds to wait for each reply
+            max_workers (int, optional): Number of pings to run at once
+        """
+        self.known_ips = known_ips
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+
+    def ping(self, ip):
+        result = subprocess.run(
+            ['ping', '-c', '1', '-W', str(self.timeout), ip],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return result.returncode == 0
+
+    def detect(self):
+        """Returns:
+            set: Names of known devices that replied to a ping
+        """
+        ips = list(self.known_ips)
+        replies = self.pool.map(self.ping, ips)
+        return {self.known_ips[ip] for ip, alive in zip(ips, replies) if alive}
+
+
+class PresenceEngine():
+
+    def __init__(self, sources, home_debounce=1, away_debounce=3,
+                 timeout=15, intervals=None, transition_windows=None):
+        """Initialize the PresenceEngine class
+
+        Args:
+            sources (list): Presence sources, objects with a name and a
+                detect() method returning the set of people present
+            home_debounce (int, optional): Consecutive polls with someone
+                present before switching to home
+            away_debounce (int, optional): Consecutive polls with no one
+                present before switching to away
+            timeout (float, optional): Seconds to wait for the sources
+            intervals (dict, optional): Seconds between polls when 'home',
+                'away', 'pending' (a state change is being debounced) and
+                'transition' (inside a transition window)
+            transition_windows (list, optional): [start, end] times of day,
+                as "HH:MM", when people usually leave or arrive
+        """
+        self.sources = sources
+        self.home_debounce = home_debounce
+        self.away_debounce = away_debounce
+        self.timeout = timeout
+        self.intervals = {'home': 60, 'away': 30, 'pending': 5,
+                          'transition': 10}
+        self.intervals.update(intervals or {})
+        self.transition_windows = [
+            (datetime.strptime(start, '%H:%M').time(),
+             datetime.strptime(end, '%H:%M').time())
+            for start, end in (transition_windows or [])
+        ]
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(sources)))
+
+        self.home = None
+        self.present = set()
+        self.streak = 0
+        # Whether any source answered the last poll
+        self.last_poll_ok = False
+
+    def detect(self):
+        """Poll all sources concurrently and merge their results
+
+        Returns:
+            set: People detected by any source, None if every source failed
+        """
+        futures = {self.pool.submit(source.detect): source
+                   for source in self.sources}
+        done, not_done = wait(futures, timeout=self.timeout)
+
+        present = set()
+        succeeded = 0
+        for future in done:
+            source = futures[future]
+            try:
+                found = future.result()
+            except Exception:
+                LOGGER.exception('Presence source %s failed', source.name)
+                continue
+            LOGGER.debug('%s detected %s', source.name, found)
+            present.update(found)
+            succeeded += 1
+        for future in not_done:
+            LOGGER.warning('Presence source %s timed out',
+                           futures[future].name)
+
+        return present if succeeded else None
+
+    def poll(self):
+        """Poll the sources and update the debounced home/away state
+
+        Returns:
+            bool: True if the home/away state changed
+        """
+        present = self.detect()
+        self.last_poll_ok = present is not None
+        if present is None:
+            return False
+        self.present = present
+
+        someone_home = bool(present)
+        if self.home is None:
+            self.home = someone_home
+            self.streak = 0
+            return True
+
+        if someone_home == self.home:
+            self.streak = 0
+            return False
+
+        self.streak += 1
+        required = self.home_debounce if someone_home else self.away_debounce
+        if self.streak >= required:
+            self.home = someone_home
+            self.streak = 0
+            return True
+        return False
+
+    def in_transition_window(self, now=None):
+        now = (now or datetime.now()).time()
+        for start, end in self.transition_windows:
+            if start <= end and start <= now <= end:
+                return True
+            # window wraps around midnight
+            if start > end and (now >= start or now <= end):
+                return True
+        return False
+
+    def next_interval(self):
+        """Seconds to wait before the next poll. Poll quickly while a state
+        change is being debounced or around expected transitions.
+
+        Returns:
+            float: Seconds until the next poll
+        """
+        if self.streak:
+            return self.intervals['pending']
+        if self.in_transition_window():
+            return self.intervals['transition']
+        return self.intervals['home' if self.home else 'away']
@@ -6,10 +6,13 @@ import os
 
 import utils
 import config
+import event_store
+import storage
 
 LOGGER = logging.getLogger('s3_upload')
 CONF = config.load_config()
 BUCKET = CONF['bucket']
+UPLOAD_SECONDS = CONF.get('s3_upload_seconds', 60*5)
 
 config.init_logging()
 
@@ -17,18 +20,24 @@ def loop():
     """Loop through the training data directory, upload files to S3, 
     delete after uploading
     """
+    events = event_store.get_store()
+    store = storage.get_storage()
     while True:
-        files = utils.search_path(config.TRAIN_DIR, filetypes=['.pkl', '.txt'])
+        files = store.files('samples', suffixes=['.pkl', '.txt'])
         LOGGER.info('Uploading %s files', len(files))
         for file in files:
             key = os.path.basename(file)
             try:
                 utils.upload_to_s3(BUCKET, file, key)
-                os.remove(file)
+                store.remove(file)
+                if key.endswith('.pkl'):
+                    # <occupied|unoccupied>_<ts>.pkl
+                    ts = key[:-len('.pkl')].partition('_')[2]
+                    events.record_upload(ts, key)
             except:
                 LOGGER.exception("message")
                 LOGGER.error('Error while uploading file %s', file)
-        time.sleep(60*5)
+        time.sleep(UPLOAD_SECONDS)
 
 if __name__ == '__main__':
     loop()
@@ -3,22 +3,31 @@ Main camera module; handles motion detection based on background subtraction.
 
 Inspired & based off Adrian Rosebrock's excellent pyimagesearch tutorials.
 """
-import os
+import atexit
 import logging
 import threading
 import time
-from datetime import datetime, timedelta
+from datetime import datetime
 import pickle
 
-import picamera
 import cv2
-from picamera.array import PiRGBArray
-import numpy as np
 import imutils
-import RPi.GPIO as GPIO
+import numpy as np
 
 import utils
 import config
+import supervisor
+import event_store
+import storage
+import encoder
+import decision
+import arming
+import alerts
+import thumbnails
+import frame_bus
+import journal
+import camera_watchdog
+import low_light
 from model import MotionModel
 
 LOGGER = logging.getLogger('security_system')
@@ -29,35 +38,70 @@ config.init_logging()
 
 class MotionDetector():
 
-    def __init__(self):
+    def __init__(self, conf=None):
         """Initialize the MotionDetector class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml, i.e.
+                when backtesting other parameters
         """
         LOGGER.debug('Initializing motion detector class')
+        conf = conf or CONF
 
         # Store the avg in memory
         self.avg = None 
 
-        # Store last <frame_store_cnt> frames in memory
+        # Store last <frame_store_cnt> frames in memory, and their contours
         self.frames = []
-        self.frame_store_cnt = CONF['frame_store_cnt'] 
+        self.frame_contours = []
 
         # PIR motion sensor settings
-        self.pir_store_cnt = CONF['pir_store_cnt']
         self.PIR = 21
         self.pir_values = []
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.PIR, GPIO.IN)
+        self.gpio = None
 
         # Camera Configuration
-        self.resolution = CONF['resolution']
-        self.fps = CONF['fps']
-        self.frame_width = CONF['frame_width']
-        self.vflip = CONF['vflip']
-        self.hflip = CONF['hflip']
-        self.alpha = CONF['alpha']
-        self.dilate_iterations = CONF['dilate_iterations']
-        self.ksize = tuple(CONF['ksize'])
-        self.delta_thresh = CONF["delta_thresh"]
+        self.resolution = conf['resolution']
+        self.fps = conf['fps']
+        self.frame_width = conf['frame_width']
+        self.vflip = conf['vflip']
+        self.hflip = conf['hflip']
+        self.configure(conf)
+
+        # bgr captures full resolution frames, yuv only the luma plane at
+        # <frame_width>, see capture_luma
+        self.capture_format = conf.get('capture_format', 'bgr')
+        self.full_frame_port = conf.get('full_frame_splitter_port', 2)
+        self.camera = None
+        # Seconds spent detecting motion in the latest frame
+        self.detect_seconds = 0.0
+        # Recovers a failed camera, see camera_watchdog.py
+        self.watchdog = None
+        # Night exposure and denoising, see low_light.py
+        self.low_light = None
+
+    def configure(self, conf):
+        """Apply the settings that can change while the camera is running,
+        see SecuritySystem.apply_config
+
+        Args:
+            conf (dict): Settings
+        """
+        self.frame_store_cnt = conf['frame_store_cnt']
+        self.pir_store_cnt = conf['pir_store_cnt']
+        self.alpha = conf['alpha']
+        self.dilate_iterations = conf['dilate_iterations']
+        self.ksize = tuple(conf['ksize'])
+        self.delta_thresh = conf["delta_thresh"]
+
+    def setup_pir(self):
+        """Set up the GPIO pin of the PIR motion sensor. Called on the first
+        read, so the detector can be used off the pi (i.e. for backtesting)
+        """
+        import RPi.GPIO as GPIO
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.PIR, GPIO.IN)
+        self.gpio = GPIO
 
     def read_pir(self):
         """Read signal from PIR motion sensor
@@ -65,7 +109,9 @@ class MotionDetector():
         Returns:
             int: 1 if motion is present, 0 otherwise
         """
-        return GPIO.input(self.PIR)
+        if self.gpio is None:
+            self.setup_pir()
+        return self.gpio.input(self.PIR)
 
     def store_pir(self, pir_value):
         """Store the latest PIR value and trim the list of stored PIR values
@@ -86,17 +132,53 @@ class MotionDetector():
         """
         self.frames.append(frame)
         self.frames = self.frames[-1*self.frame_store_cnt:]
+        self.frame_contours.append(None)
+        self.frame_contours = self.frame_contours[-1*self.frame_store_cnt:]
+
+    def store_contours(self, contours):
+        """Store the contours of the latest frame
+
+        Args:
+            contours (list): List of contours meta
+        """
+        self.frame_contours[-1] = contours
 
     def stream(self):
         """Loop through frames in the camera feed, process them, and return the
         contours from the frame delta (difference between current frame and
         background image) and the value of the PIR motion sensor.
 
+        If the camera fails or stalls (see camera_watchdog.py), it's closed
+        and reopened, keeping the background image.
+
         Yields:
             tuple: (Latest frame, thresholded frame delta, list of contours meta info)
         """
         LOGGER.info('Starting camera process')
+        import picamera
 
+        self.avg = None
+        while True:
+            try:
+                yield from self.stream_camera(picamera)
+                return
+            except (picamera.PiCameraError,
+                    camera_watchdog.CameraStalled) as err:
+                # errors while processing a frame aren't the camera's, and
+                # would fail again on the next one
+                if self.watchdog is None:
+                    raise
+                delay = self.watchdog.failed(err)
+                LOGGER.exception('Camera failed, reopening it in %ss', delay)
+                supervisor.heartbeat()
+                time.sleep(delay)
+
+    def stream_camera(self, picamera):
+        """Open the camera and stream its frames, see stream
+
+        Args:
+            picamera (module): picamera
+        """
         with picamera.PiCamera() as camera:
             LOGGER.debug('Warming up camera')
             time.sleep(2)
@@ -105,47 +187,149 @@ class MotionDetector():
             camera.hflip = self.hflip
             camera.resolution = tuple(self.resolution)
             camera.framerate = self.fps
-            self.avg = None
+            if self.watchdog is not None:
+                # raise instead of waiting forever on a hung camera
+                camera.CAPTURE_TIMEOUT = self.watchdog.stall_seconds
 
-            raw_capture = PiRGBArray(camera, size=tuple(self.resolution))
-            for frame in camera.capture_continuous(raw_capture, 'bgr',
-                                                   use_video_port=True):
-                # return current frame
-                frame = frame.array
+            if self.capture_format == 'yuv':
+                frames = self.capture_luma(camera)
+            else:
+                frames = self.capture_bgr(camera)
+            self.camera = camera
+            self.camera_started(camera)
+            if self.watchdog is not None:
+                self.watchdog.camera_started()
+            try:
+                for frame in frames:
+                    if self.watchdog is not None:
+                        self.watchdog.frame()
+
+                    # save it. Luma frames are views of the capture buffer
+                    self.store_frame(frame.copy() if frame.ndim == 2
+                                     else frame)
+
+                    start = time.perf_counter()
+                    gray = self.process_frame(frame)
+                    if self.low_light is not None:
+                        gray, restart = self.low_light.process(gray, camera)
+                        if restart:
+                            self.avg = None
+
+                    if self.avg is None:
+                        LOGGER.info("Starting background model...")
+                        self.avg = gray.copy().astype("float")
+                        continue
+
+                    # Update the background image
+                    cv2.accumulateWeighted(gray, self.avg, self.alpha)
+
+                    contours, frame_delta = self.compare_frame(gray, self.avg)
+                    self.detect_seconds = time.perf_counter() - start
+                    self.store_contours(contours)
+                    self.store_pir(self.read_pir())
+
+                    yield (self.frames[-1], frame_delta, contours)
+            finally:
+                if self.watchdog is not None:
+                    self.watchdog.camera_stopped()
+                self.camera_stopped(camera)
+                self.camera = None
+
+    def capture_bgr(self, camera):
+        """Capture full resolution BGR frames from the video port
 
-                # save it
-                self.store_frame(frame)
+        Args:
+            camera (picamera.PiCamera): Open camera
+
+        Yields:
+            numpy.ndarray: BGR frame
+        """
+        from picamera.array import PiRGBArray
+
+        raw_capture = PiRGBArray(camera, size=tuple(self.resolution))
+        for frame in camera.capture_continuous(raw_capture, 'bgr',
+                                               use_video_port=True):
+            yield frame.array
+            # reset stream for next frame
+            raw_capture.truncate(0)
+
+    def detection_size(self):
+        """Returns:
+            tuple: (width, height) of the frames motion is detected on
+        """
+        width, height = self.resolution
+        return self.frame_width, int(height * self.frame_width / width)
+
+    def capture_luma(self, camera):
+        """Capture YUV frames resized to the detection resolution by the
+        camera's resizer, and yield their Y (luma) plane, which is the
+        grayscale frame, without copying it
+
+        Args:
+            camera (picamera.PiCamera): Open camera
+
+        Yields:
+            numpy.ndarray: Grayscale frame at <frame_width>, a view of the
+                capture buffer that is overwritten by the next capture
+        """
+        width, height = self.detection_size()
+        # The camera pads YUV rows to 32 pixels and the planes to 16 rows
+        padded_width = (width + 31) // 32 * 32
+        padded_height = (height + 15) // 16 * 16
+        luma_size = padded_width * padded_height
+        buffer = np.empty(luma_size * 3 // 2, dtype=np.uint8)
+        luma = buffer[:luma_size].reshape(padded_height, padded_width)
+        for _ in camera.capture_continuous(buffer, 'yuv', use_video_port=True,
+                                           resize=(width, height)):
+            yield luma[:height, :width]
+
+    def full_frame(self):
+        """Capture a full resolution BGR frame from another splitter port,
+        i.e. for alerts when capturing luma frames
 
-                gray = self.process_frame(frame)
+        Returns:
+            numpy.ndarray: BGR frame, None if the camera isn't running
+        """
+        if self.camera is None:
+            return None
+        from picamera.array import PiRGBArray
 
-                if self.avg is None:
-                    LOGGER.info("Starting background model...")
-                    self.avg = gray.copy().astype("float")
-                    raw_capture.truncate(0)
-                    continue
+        with PiRGBArray(self.camera) as output:
+            self.camera.capture(output, 'bgr', use_video_port=True,
+                                splitter_port=self.full_frame_port)
+            return output.array
 
-                # Update the background image
-                cv2.accumulateWeighted(gray, self.avg, self.alpha)
+    def camera_started(self, camera):
+        """Called once the camera is configured, before the first frame
 
-                contours, frame_delta = self.compare_frame(gray, self.avg)
-                self.store_pir(self.read_pir())
-                
-                # reset stream for next frame
-                raw_capture.truncate(0)
+        Args:
+            camera (picamera.PiCamera): Open camera
+        """
+        pass
 
-                yield (frame, frame_delta, contours)
+    def camera_stopped(self, camera):
+        """Called when the stream stops, before the camera is closed
+
+        Args:
+            camera (picamera.PiCamera): Open camera
+        """
+        pass
 
     def process_frame(self, frame):
         """Convert the latest frame to grayscale and blur it
 
         Args:
-            frame (numpy.ndarray): Original frame
+            frame (numpy.ndarray): Original BGR frame, or a luma frame that
+                is already gray
 
         Returns:
             numpy.ndarray: Blurred, grayscale frame
         """
-        frame = imutils.resize(frame, width=self.frame_width)
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if frame.shape[1] != self.frame_width:
+            frame = imutils.resize(frame, width=self.frame_width)
+        gray = frame
+        if frame.ndim == 3:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         gray = cv2.GaussianBlur(gray, self.ksize, 0)
         return gray
 
@@ -164,18 +348,49 @@ class MotionDetector():
         Returns:
             tuple: (List of metadata for delta areas, delta frame)
         """
+        frame_delta = self.frame_delta(frame, avg)
+        return self.find_contours(frame_delta)
 
+    def frame_delta(self, frame, avg):
+        """Take the absolute difference between the latest frame and the
+        background image
 
-        frame_delta = cv2.absdiff(frame, cv2.convertScaleAbs(avg))
+        Args:
+            frame (numpy.ndarray): Blurred, grayscale frame
+            avg (numpy.ndarray): Running average of the images
 
+        Returns:
+            numpy.ndarray: Delta frame
+        """
+        return cv2.absdiff(frame, cv2.convertScaleAbs(avg))
+
+    def threshold(self):
+        """Returns:
+            int: delta_thresh, raised above the noise in low-light mode
+        """
+        if self.low_light is None:
+            return self.delta_thresh
+        return self.low_light.delta_thresh(self.delta_thresh)
+
+    def find_contours(self, frame_delta):
+        """Threshold and dilate the delta frame, then find the contours in it
+
+        Args:
+            frame_delta (numpy.ndarray): Delta frame
+
+        Returns:
+            tuple: (List of metadata for delta areas, thresholded delta frame)
+        """
         # threshold the delta image, dilate the thresholded image to fill
         # in holes, then find contours on thresholded image
-        thresh = cv2.threshold(frame_delta, self.delta_thresh, 255,
+        thresh = cv2.threshold(frame_delta, self.threshold(), 255,
                                cv2.THRESH_BINARY)[1]
         thresh = cv2.dilate(thresh, None, iterations=self.dilate_iterations)
         contours = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL,
                                     cv2.CHAIN_APPROX_SIMPLE)
-        contours = contours[1]
+        # (image, contours, hierarchy) on OpenCV 3, (contours, hierarchy)
+        # on 2 and 4+
+        contours = imutils.grab_contours(contours)
 
         contours_meta = []
 
@@ -194,32 +409,65 @@ class SecuritySystem(MotionDetector):
         """Initialize the SecuritySystem class"""
         LOGGER.debug('Initializing security system class')
 
-        self.model = MotionModel()
+        # Settings, reloaded when config.yml changes, see apply_config
+        self.config_watcher = config.ConfigWatcher()
+        self.config_watcher.start()
+        self.conf = self.config_watcher.conf
+
+        self.model = MotionModel(self.conf)
+        self.events = event_store.get_store()
+        self.storage = storage.get_storage()
+        self.cpu_encoder = encoder.CPUEncoder(CONF.get('jpeg_quality', 90))
+        self.encoder = self.cpu_encoder
 
         # Timestamp formats
         self.ts_format_1 = "%Y-%m-%d %H:%M:%S"
         self.ts_format_2 = "%Y-%m-%d-%H-%M-%S.%f"
 
-        # last time notification was sent in slack
-        self.last_notified = datetime.now()
-
-        # last time image was saved
-        self.last_save = datetime.now() - timedelta(minutes=10)
+        # Alert decisions over the last frames, see decision.py
+        self.decision = decision.DecisionEngine(self.conf)
 
-        # record of last X frames and their classifications
-        self.motion_store_cnt = CONF['motion_classification_store_cnt']
-        self.motion_counter = []
+        # Cached arming state, kept up to date by its own thread
+        self.arming = arming.ArmingController(self.conf.get('arming', {}))
+        self.arming.start()
+        self.arming_state = None
 
         # Training settings
         self.train = CONF['train']
         self.bucket = CONF['bucket']
+        self.s3_alert_images = CONF.get('s3_alert_images', False)
+
+        # Slack alerts, coalesced per motion episode
+        self.alerts = alerts.AlertAggregator(events=self.events,
+                                             tag=self.train)
+        self.alerts.start()
+        # Latest frame and state, for the Flask views
+        self.frame_bus = frame_bus.FrameBus.create()
+        atexit.register(self.frame_bus.close)
+        self.measured_fps = 0.0
+        self.last_frame_time = None
+        # Full resolution capture of the latest luma frame, see color_frame
+        self._color_frame = (None, None)
+
+        # Record of every frame, see journal.py
+        self.journal = None
+        if self.conf.get('journal', {}).get('enabled', False):
+            self.journal = journal.JournalWriter(self.conf)
+            atexit.register(self.journal.close)
+
+        self.thumbnails = None
+        if CONF.get('thumbnails', {}).get('kind', 'none') != 'none':
+            self.thumbnails = thumbnails.ThumbnailRenderer()
 
         # Notification/image saving options
-        self.min_save_seconds = CONF["min_save_seconds"]
-        self.min_notify_seconds = CONF['min_notify_seconds']
-        self.min_occupied_fraction = CONF['min_occupied_fraction']
+        self.save_timer = decision.Timer(self.conf["min_save_seconds"])
 
-        super(SecuritySystem, self).__init__()
+        super(SecuritySystem, self).__init__(self.conf)
+
+        self.watchdog = camera_watchdog.CameraWatchdog(self.conf)
+        self.watchdog.start()
+        if self.conf.get('low_light', {}).get('enabled', False):
+            self.low_light = low_light.LowLightController(self.conf)
 
     def clear_stored_data(self):
         """Clear all stored values used in classification or in backtesting
@@ -228,28 +476,165 @@ class SecuritySystem(MotionDetector):
         """
         self.pir_values = []
         self.frames = []
-        self.motion_counter = []
+        self.frame_contours = []
+        self._color_frame = (None, None)
+        self.decision.reset()
+        self.alerts.update(decision.IDLE)
+
+    def apply_arming(self, state):
+        """Apply the sensitivity of a new arming state to the model"""
+        self.model.set_sensitivity(state.sensitivity, state.zones)
+        self.arming_state = state
+
+    def apply_config(self, conf):
+        """Apply settings reloaded from config.yml, between two frames. Each
+        component only rebuilds what depends on the settings that changed
+
+        Args:
+            conf (dict): Validated settings, see config.ConfigWatcher
+        """
+        changed = config.changed_keys(self.conf, conf)
+        LOGGER.info('Applying new settings: %s', ', '.join(changed))
+        restart = config.restart_keys(changed)
+        if restart:
+            LOGGER.warning('Restart the security system to apply: %s',
+                           ', '.join(restart))
+        self.configure(conf)
+        self.model.configure(conf)
+        self.decision.configure(conf)
+        self.arming.configure(conf.get('arming', {}))
+        self.save_timer.seconds = conf['min_save_seconds']
+        self.conf = conf
+
+    def camera_started(self, camera):
+        if CONF.get('jpeg_encoder') == 'hardware':
+            self.encoder = encoder.build_encoder(camera)
+
+    def camera_stopped(self, camera):
+        if self.encoder is not self.cpu_encoder:
+            self.encoder.close()
+            self.encoder = self.cpu_encoder
+
+    def color_frame(self, frame):
+        """BGR frame for the person detector, snapshots and alerts. Luma
+        frames are replaced by a full resolution capture from the camera,
+        made at most once per frame
+
+        Args:
+            frame (numpy.ndarray): Latest frame
+
+        Returns:
+            numpy.ndarray: BGR frame
+        """
+        if frame.ndim == 3:
+            return frame
+        source, color = self._color_frame
+        if source is not frame:
+            color = self.full_frame()
+            if color is None:
+                color = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            self._color_frame = (frame, color)
+        return color
+
+    def encode_frame(self, frame, timestamp=None):
+        """Encode a frame as a JPEG, off the detection thread
 
-    def save_last_image(self, frame, timestamp, img_name, add_text=False):
+        Args:
+            frame (numpy.ndarray): Image to encode
+            timestamp (datetime.datetime, optional): Timestamp to overlay on
+                the image. The overlay is drawn on the cpu, so this always
+                uses the cpu encoder
+
+        Returns:
+            concurrent.futures.Future: Resolves to the JPEG bytes
+        """
+        if timestamp is None:
+            return self.encoder.encode(frame)
+
+        frame = frame.copy()
+        ts = timestamp.strftime(self.ts_format_1)
+        cv2.putText(frame, ts, (10, frame.shape[0] - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 255), 1)
+        return self.cpu_encoder.encode(frame)
+
+    def save_last_image(self, frame, timestamp, img_name, add_text=False,
+                        storage_class='snapshots'):
         """Optinally overlay the timestamp on the latest image, then save it.
+        The image is encoded and written in the background.
 
         Args:
             frame (numpy.ndarray): Image to save
             timestamp (datetime.datetime): Timestamp
             img_name (str): Name to use in the file
             add_text (bool): Overlay timestamp on the image
+            storage_class (str, optional): Storage class to save the image in
 
         Returns:
-            str: Filepath of the saved image
+            concurrent.futures.Future: Resolves to the filepath of the saved
+                image
         """
-        if add_text:
-            ts = timestamp.strftime(self.ts_format_1)
-            cv2.putText(frame, ts, (10, frame.shape[0] - 10),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 255), 1)
         filename = '{}.jpg'.format(img_name)
-        fpath = os.path.join(config.IMG_DIR, filename)
-        utils.save_image(fpath, frame)
-        return fpath
+        LOGGER.debug('Saving image %s to %s', filename, storage_class)
+        jpeg = self.encode_frame(frame, timestamp if add_text else None)
+        return self.cpu_encoder.pool.submit(
+            lambda: self.storage.write_bytes(
+                storage_class, filename, jpeg.result()))
+
+    def publish(self, frame, frame_delta, result):
+        """Publish the frame and decision to the frame bus, with the frame
+        rate averaged over the last frames
+
+        Args:
+            frame (numpy.ndarray): Latest frame
+            frame_delta (numpy.ndarray): Thresholded delta mask
+            result (decision.Decision): Decision for the frame
+        """
+        now = time.monotonic()
+        if self.last_frame_time is not None and now > self.last_frame_time:
+            fps = 1 / (now - self.last_frame_time)
+            self.measured_fps = 0.9 * self.measured_fps + 0.1 * fps \
+                if self.measured_fps else fps
+        self.last_frame_time = now
+        self.frame_bus.publish(frame, frame_delta, self.measured_fps,
+                               result.state, result.score)
+
+    def render_thumbnails(self, ts):
+        """Render thumbnails of the buffered frames, for the first alert of
+        an episode. They are saved as a clip once rendered
+
+        Args:
+            ts (str): Alert timestamp
+
+        Returns:
+            tuple: (filename, future of the bytes), None if thumbnails are
+                disabled or the alert doesn't start an episode
+        """
+        if self.thumbnails is None or self.alerts.episode is not None:
+            return None
+        future = self.thumbnails.render(self.frames, self.frame_contours)
+        if future is None:
+            return None
+        filename = '{}.{}'.format(ts, self.thumbnails.extension)
+
+        def store_clip(done):
+            if done.exception() is None:
+                self.storage.write_bytes('clips', filename, done.result())
+        future.add_done_callback(store_clip)
+        return filename, future
+
+    def store_alert(self, filename, jpeg):
+        """Save an alert image, and upload it to S3 if s3_alert_images is set.
+        Run in the encoder pool
+
+        Args:
+            filename (str): Image filename
+            jpeg (concurrent.futures.Future): Resolves to the JPEG bytes
+        """
+        data = jpeg.result()
+        self.storage.write_bytes('alerts', filename, data)
+        if self.s3_alert_images:
+            utils.upload_to_s3(self.bucket, filename, 'alerts/' + filename,
+                               data)
 
     def save_pickle(
         self, frames, frame_delta, avg, contours, pir, ts, classification):
@@ -277,71 +662,106 @@ class SecuritySystem(MotionDetector):
         }
         text = 'occupied' if classification else 'unoccupied'
         filename = '{}_{}.pkl'.format(text, ts)
-        filepath = os.path.join(config.TRAIN_DIR, filename)
-        pickle.dump(data, open(filepath, "wb"))
+        with self.storage.atomic_open('samples', filename) as file_out:
+            pickle.dump(data, file_out)
+        self.events.record_sample(ts, self.storage.path('samples', filename))
 
     def run(self):
         while True:
-            if utils.redis_get('camera_status'):
+            if self.arming.state.armed:
                 stream_iterator = self.stream()
+                last_frame = None
 
                 for frame, frame_delta, contours in stream_iterator:
+                    frame_start = time.perf_counter()
+                    supervisor.heartbeat()
+                    if self.config_watcher.conf is not self.conf:
+                        self.apply_config(self.config_watcher.conf)
+                    state = self.arming.state
+                    if state is not self.arming_state:
+                        self.apply_arming(state)
                     timestamp = datetime.now()
                     ts = timestamp.strftime(self.ts_format_2)
 
                     # Classify latest frame as occupied or not
+                    classify_start = time.perf_counter()
                     occupied = self.model.classify(
                         frame, contours, self.pir_values)
-
-                    self.motion_counter.append(1 if occupied else 0)
-                    self.motion_counter = self.motion_counter[
-                        -1*self.motion_store_cnt:]
+                    person_prob = None
+                    if occupied and self.decision.needs_person_prob:
+                        person_prob = self.model.get_person_prob(
+                            self.color_frame(frame), contours)
+                    result = self.decision.update(
+                        occupied,
+                        self.pir_values[-1] if self.pir_values else None,
+                        person_prob)
+                    classify_seconds = time.perf_counter() - classify_start
+                    self.publish(frame, frame_delta, result)
 
                     # Save latest image if enough time has elapsed since last save
-                    last_save = (timestamp - self.last_save).seconds
-                    if last_save >= self.min_save_seconds:
+                    if self.save_timer.ready():
                         LOGGER.debug('Saving latest image')
-                        self.save_last_image(frame, timestamp, 'latest', True)
-                        self.last_save = timestamp
+                        self.save_last_image(self.color_frame(frame),
+                                             timestamp, 'latest', True)
+                        self.save_timer.reset()
 
                         # Save for backtesting & training
                         if not occupied and self.train:
+                            self.events.record_event(
+                                ts, False, contours, self.pir_values,
+                                result.score)
                             self.save_pickle(
                                 self.frames, frame_delta, self.avg, contours,
                                 self.pir_values, ts, classification=False
                             )
 
                     # Determine whether to notify in slack
-                    last_notified = (timestamp - self.last_notified).seconds
-                    notify_time_check = last_notified >= self.min_notify_seconds
-                    notifications_on = utils.redis_get('camera_notifications')
-                    enough_motion = np.mean(self.motion_counter) \
-                        >= self.min_occupied_fraction
-
-                    if notifications_on and notify_time_check and enough_motion:
+                    if result.alert and state.notifications:
                         LOGGER.info('Sending slack alert!')
-                        fpath = self.save_last_image(frame, timestamp, ts)
-                        self.last_notified = timestamp
-                        response = utils.slack_upload(
-                            fpath, title=os.path.basename(fpath))
-                        os.remove(fpath)
+                        filename = '{}.jpg'.format(ts)
+                        color = self.color_frame(frame)
+                        jpeg = self.encode_frame(color)
+                        self.alerts.alert(ts, jpeg, color,
+                                          self.render_thumbnails(ts))
+                        self.cpu_encoder.pool.submit(
+                            self.store_alert, filename, jpeg)
+
+                        self.events.record_event(
+                            ts, True, contours, self.pir_values,
+                            result.score)
+                        self.events.record_alert(ts, filename)
 
                         # Save for backtesting & training
                         if self.train:
-                            utils.slack_post_interactive(response)
                             self.save_pickle(
                                 self.frames, frame_delta, self.avg, contours,
                                 self.pir_values, ts, classification=True
                             )
-
-
-                    if not utils.redis_get('camera_status'):
+                    self.alerts.update(result.state)
+
+                    if self.journal is not None:
+                        loop_seconds = frame_start - last_frame \
+                            if last_frame is not None else 0.0
+                        self.journal.append(
+                            frame, contours,
+                            self.pir_values[-1] if self.pir_values else None,
+                            occupied, person_prob, result,
+                            result.alert and state.notifications,
+                            (self.detect_seconds * 1000,
+                             classify_seconds * 1000, loop_seconds * 1000))
+                    last_frame = frame_start
+                    self.watchdog.beat()
+
+                    if not state.armed:
                         LOGGER.info('Clearing stored data')
                         self.clear_stored_data()
                         LOGGER.info('Stopping camera thread')
                         stream_iterator.close()
                         break
             else:
+                supervisor.heartbeat()
+                if self.config_watcher.conf is not self.conf:
+                    self.apply_config(self.config_watcher.conf)
                 time.sleep(2)
 
 if __name__ == '__main__':
@@ -0,0 +1,403 @@
+"""
+Soak test of the whole system off the pi. Starts the local stand-ins for
+redis, Slack and S3 (see stubs/servers.py), then runs security_system.py,
+s3_upload.py and the Flask app with the hardware stubs (see stubs/), on
+settings that point them to the stand-ins and to a scratch directory. While
+they run, it polls the views and samples every process. It reports:
+
+    memory growth   rss after the warmup and at the end, and the MB/hour slope
+    fd leaks        open file descriptors after the warmup, at the end and
+                    at the peak
+    fps stability   fps of the security system, read from the frame bus
+    alert latency   seconds from the start of a motion episode in the fake
+                    camera to the Slack message of its alert
+    view latency    of the polled views
+
+Run from the app directory, i.e.
+
+    python3 soak_test.py --hours 4 --video ~/clips/driveway.mp4
+"""
+import argparse
+import csv
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import psutil
+import requests
+import yaml
+
+import config
+import frame_bus
+from stubs import servers
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(APP_DIR)
+
+# Verification token of the fake Slack app, sent with the view requests
+TOKEN = 'soak-verification-token'
+USER_ID = 'USOAK'
+FRAME_BUS_NAME = 'rpi_security_soak'
+VIEWS = ['/status', '/alert_stats', '/top']
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def slope_per_hour(times, values):
+    """Least squares slope of values over times (seconds), per hour"""
+    if len(times) < 2:
+        return 0.0
+    mean_t = statistics.mean(times)
+    mean_v = statistics.mean(values)
+    var = sum((t - mean_t) ** 2 for t in times)
+    if not var:
+        return 0.0
+    cov = sum((t - mean_t) * (v - mean_v) for t, v in zip(times, values))
+    return cov / var * 3600
+
+
+def write_settings(directory, args, slack, s3, redis_port, start):
+    """Write the settings of the processes under test to directory, starting
+    from the ones in app/config
+
+    Returns:
+        str: Settings directory, for RPI_SECURITY_CONF_DIR
+    """
+    conf_dir = os.path.join(directory, 'config')
+    os.makedirs(conf_dir, exist_ok=True)
+
+    conf = config.read_yaml(config.MAIN_CONF_PATH)
+    conf['fps'] = args.fps
+    conf['s3_upload_seconds'] = args.upload_seconds
+    conf['http'] = dict(conf.get('http', {}), slack_url=slack.url + 'api/',
+                        s3_endpoint=s3.url.rstrip('/'))
+    conf['redis'] = {'host': '127.0.0.1', 'port': redis_port, 'db': 0}
+    conf['frame_bus'] = dict(conf.get('frame_bus', {}), name=FRAME_BUS_NAME)
+    conf['event_store'] = dict(conf.get('event_store', {}),
+                               path=os.path.join(directory, 'events.db'))
+    conf['journal'] = dict(conf.get('journal', {}),
+                           path=os.path.join(directory, 'journal.bin'))
+    storage_conf = conf.get('storage', {})
+    storage_conf['classes'] = {
+        name: dict(settings, dir=os.path.join(directory, settings['dir']))
+        for name, settings in storage_conf.get('classes', {}).items()}
+    conf['soak'] = {
+        'start': start + args.warmup_seconds,
+        'motion_every': args.motion_every,
+        'motion_seconds': args.motion_seconds,
+        'video': args.video,
+    }
+    with open(os.path.join(conf_dir, 'config.yml'), 'w') as file_out:
+        yaml.safe_dump(conf, file_out)
+
+    private = {
+        'ian_uid': USER_ID,
+        'alerts_channel': 'CSOAK',
+        'rpi_cam_app': {'bot_token': 'xoxb-soak', 'oauth_token': 'xoxp-soak',
+                        'verification_token': TOKEN},
+    }
+    with open(os.path.join(conf_dir, 'private.yml'), 'w') as file_out:
+        yaml.safe_dump(private, file_out)
+
+    log_conf = config.read_yaml(os.path.join(config.CONF_DIR, 'logging.yml'))
+    log_conf['handlers']['file']['filename'] = os.path.join(
+        directory, 'logfile.log')
+    with open(os.path.join(conf_dir, 'logging.yml'), 'w') as file_out:
+        yaml.safe_dump(log_conf, file_out)
+    return conf_dir
+
+
+class Component():
+
+    def __init__(self, name, command, cwd, env, directory):
+        self.name = name
+        self.command = command
+        self.cwd = cwd
+        self.env = env
+        self.log_path = os.path.join(directory, name + '.log')
+        self.process = None
+        # psutil handle of the process, kept so cpu_percent measures the
+        # time since the previous sample
+        self.psutil_process = None
+        # Exit code when the soak test ended, None if it was still running
+        self.exit_code = None
+        self.samples = []
+
+    def start(self):
+        with open(self.log_path, 'ab') as log:
+            self.process = subprocess.Popen(
+                self.command, cwd=self.cwd, env=self.env, stdout=log,
+                stderr=subprocess.STDOUT)
+        self.psutil_process = psutil.Process(self.process.pid)
+        # the first call only starts the measurement
+        self.psutil_process.cpu_percent()
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def sample(self, elapsed):
+        """Record the rss, open fds and threads of the process
+
+        Returns:
+            dict: Sample, None if the process exited
+        """
+        if not self.alive():
+            return None
+        try:
+            process = self.psutil_process
+            with process.oneshot():
+                sample = {
+                    'elapsed': elapsed,
+                    'rss_mb': process.memory_info().rss / 2 ** 20,
+                    'fds': process.num_fds(),
+                    'threads': process.num_threads(),
+                    'cpu_percent': process.cpu_percent(),
+                }
+        except psutil.Error:
+            return None
+        self.samples.append(sample)
+        return sample
+
+    def stop(self, timeout=10):
+        self.exit_code = self.process.poll()
+        if self.exit_code is not None:
+            return
+        # SIGINT, so atexit handlers run (i.e. the frame bus is unlinked)
+        self.process.send_signal(signal.SIGINT)
+        try:
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def start_components(directory, conf_dir, flask_port):
+    env = dict(os.environ, RPI_SECURITY_CONF_DIR=conf_dir,
+               PYTHONUNBUFFERED='1', AWS_ACCESS_KEY_ID='soak',
+               AWS_SECRET_ACCESS_KEY='soak', AWS_DEFAULT_REGION='us-east-1')
+    python = sys.executable
+    components = [
+        Component('security_system',
+                  [python, '-m', 'stubs', 'security_system'], APP_DIR, env,
+                  directory),
+        Component('s3_upload', [python, '-m', 'stubs', 's3_upload'],
+                  APP_DIR, env, directory),
+        Component('flask',
+                  [python, '-m', 'app.stubs', 'flask', str(flask_port)],
+                  REPO_DIR, env, directory),
+    ]
+    for component in components:
+        component.start()
+    return components
+
+
+def post_view(url, path, timeout=10):
+    """Post a slash command to a view
+
+    Returns:
+        tuple: (seconds, whether it succeeded)
+    """
+    start = time.perf_counter()
+    try:
+        response = requests.post(url + path, timeout=timeout, data={
+            'token': TOKEN, 'user_id': USER_ID, 'channel_id': 'CSOAK'})
+        ok = response.status_code == 200 and \
+            response.text != 'Un-authenticated'
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def read_fps():
+    bus = frame_bus.FrameBus.attach(FRAME_BUS_NAME)
+    if bus is None:
+        return None
+    try:
+        snapshot = bus.read()
+    finally:
+        bus.close()
+    if snapshot is None or time.time() - snapshot.timestamp > 5:
+        return None
+    return snapshot.fps
+
+
+def alert_latencies(calls, args, start, end):
+    """Match the Slack messages to the motion episodes of the fake camera
+
+    Returns:
+        tuple: (latency of each detected episode, missed episodes, messages
+            outside of any episode)
+    """
+    messages = sorted(call.time for call in calls
+                      if call.method == 'chat.postMessage')
+    latencies = []
+    missed = 0
+    matched = set()
+    episode = start + args.warmup_seconds
+    # the last episode may not have had the time to alert
+    while episode + args.motion_every <= end:
+        window = [t for t in messages
+                  if episode <= t < episode + args.motion_every]
+        if window:
+            latencies.append(window[0] - episode)
+            matched.update(window)
+        else:
+            missed += 1
+        episode += args.motion_every
+    return latencies, missed, len(set(messages) - matched)
+
+
+def growth(samples, key, warmup):
+    after = [s for s in samples if s['elapsed'] >= warmup] or samples
+    if not after:
+        return None
+    return (after[0][key], after[-1][key],
+            max(s[key] for s in after),
+            slope_per_hour([s['elapsed'] for s in after],
+                           [s[key] for s in after]))
+
+
+def report(components, fps, views, calls, uploads, args, start, end):
+    print('### {:.2f} hours, motion every {}s'.format(
+        (end - start) / 3600, args.motion_every))
+    print('{:<16} {:>9} {:>9} {:>10} {:>6} {:>6} {:>6} {:>9} {:>8}'.format(
+        'process', 'rss MB', 'end MB', 'MB/hour', 'fds', 'end', 'max',
+        'fds/hour', 'status'))
+    for component in components:
+        memory = growth(component.samples, 'rss_mb', args.warmup_seconds)
+        fds = growth(component.samples, 'fds', args.warmup_seconds)
+        status = 'running' if component.exit_code is None else \
+            'exit {}'.format(component.exit_code)
+        if memory is None:
+            print('{:<16} {:>70}'.format(component.name, status))
+            continue
+        print('{:<16} {:>9.1f} {:>9.1f} {:>10.2f} {:>6} {:>6} {:>6} '
+              '{:>9.2f} {:>8}'.format(
+                  component.name, memory[0], memory[1], memory[3], fds[0],
+                  fds[1], fds[2], fds[3], status))
+
+    live = [value for value in fps if value is not None]
+    print('### fps (configured {})'.format(args.fps))
+    if live:
+        print('mean {:.1f}, p5 {:.1f}, min {:.1f}, stdev {:.2f}, '
+              '{} of {} samples without a frame'.format(
+                  statistics.mean(live), percentile(live, 0.05), min(live),
+                  statistics.pstdev(live), len(fps) - len(live), len(fps)))
+    else:
+        print('no frames')
+
+    latencies, missed, extra = alert_latencies(calls, args, start, end)
+    print('### alert latency, {} episodes'.format(len(latencies) + missed))
+    if latencies:
+        print('p50 {:.2f}s, p95 {:.2f}s, max {:.2f}s'.format(
+            percentile(latencies, 0.5), percentile(latencies, 0.95),
+            max(latencies)))
+    print('{} missed episodes, {} alerts outside of an episode, {} slack '
+          'calls'.format(missed, extra, len(calls)))
+
+    for path in VIEWS:
+        seconds = [s for s, _ in views[path]]
+        errors = sum(not ok for _, ok in views[path])
+        print('### {} p50 {:.0f} ms, p95 {:.0f} ms, {} errors of {}'.format(
+            path, percentile(seconds, 0.5) * 1000,
+            percentile(seconds, 0.95) * 1000, errors, len(seconds)))
+    print('### {} uploads to s3, {:.1f} MB'.format(
+        len(uploads), sum(upload.bytes for upload in uploads) / 2 ** 20))
+
+
+def soak(args):
+    directory = args.output or tempfile.mkdtemp(prefix='soak-')
+    os.makedirs(directory, exist_ok=True)
+    print('Writing logs and samples to {}'.format(directory))
+
+    slack = servers.SlackStub(delay=args.slack_delay).start()
+    s3 = servers.S3Stub().start()
+    redis_port, stop_redis = servers.start_redis()
+    flask_port = servers.free_port()
+    flask_url = 'http://127.0.0.1:{}'.format(flask_port)
+
+    start = time.time()
+    conf_dir = write_settings(directory, args, slack, s3, redis_port, start)
+    components = start_components(directory, conf_dir, flask_port)
+    fps = []
+    views = {path: [] for path in VIEWS}
+    exited = set()
+    end = start + args.hours * 3600
+    try:
+        servers.wait_for_port(flask_port, timeout=60)
+        # arm the camera and turn the notifications on
+        post_view(flask_url, '/initialize')
+        with open(os.path.join(directory, 'samples.csv'), 'w',
+                  newline='') as file_out:
+            writer = csv.writer(file_out)
+            writer.writerow(['elapsed', 'process', 'rss_mb', 'fds',
+                             'threads', 'cpu_percent', 'fps'])
+            while time.time() < end:
+                time.sleep(args.sample_seconds)
+                elapsed = time.time() - start
+                current_fps = read_fps()
+                if elapsed >= args.warmup_seconds:
+                    fps.append(current_fps)
+                for path in VIEWS:
+                    views[path].append(post_view(flask_url, path))
+                for component in components:
+                    sample = component.sample(elapsed)
+                    if sample is not None:
+                        writer.writerow([
+                            round(elapsed), component.name,
+                            round(sample['rss_mb'], 2), sample['fds'],
+                            sample['threads'], sample['cpu_percent'],
+                            current_fps])
+                    elif component.name not in exited:
+                        exited.add(component.name)
+                        print('{} exited with {}, see {}'.format(
+                            component.name, component.process.poll(),
+                            component.log_path))
+                file_out.flush()
+                if len(exited) == len(components):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        end = time.time()
+        for component in components:
+            component.stop()
+        slack.stop()
+        s3.stop()
+        stop_redis()
+    report(components, fps, views, slack.calls, s3.uploads, args, start,
+           end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--hours', type=float, default=1)
+    parser.add_argument('--fps', type=int, default=10)
+    parser.add_argument('--video', default=None,
+                        help='Loop this video instead of the synthetic scene')
+    parser.add_argument('--motion-every', type=int, default=120,
+                        help='Seconds between motion episodes')
+    parser.add_argument('--motion-seconds', type=int, default=10)
+    parser.add_argument('--sample-seconds', type=float, default=10)
+    parser.add_argument('--warmup-seconds', type=float, default=60,
+                        help='Excluded from the growth and fps stats')
+    parser.add_argument('--upload-seconds', type=int, default=60,
+                        help='Seconds between the runs of s3_upload')
+    parser.add_argument('--slack-delay', type=float, default=0.1,
+                        help='Latency of the fake Slack API')
+    parser.add_argument('--output', default=None,
+                        help='Directory for the logs, samples and data')
+    soak(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
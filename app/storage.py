@@ -0,0 +1,353 @@
+"""
+Storage manager for the images and training samples written to the SD card.
+
+Files are grouped into classes (snapshots, alerts, samples, clips), each
+with its own directory and quota. An in-memory index of every class keeps
+sizes and ages, so enforcing quotas doesn't walk the directories. Writes go
+to a temporary file that is renamed into place, so readers never see a
+partial file, and fsyncs are batched to limit SD card wear.
+"""
+import atexit
+import contextlib
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config().get('storage', {})
+
+DEFAULT_CLASSES = {
+    'snapshots': {'dir': 'imgs', 'max_mb': 50},
+    'alerts': {'dir': 'imgs/alerts', 'max_mb': 200},
+    'samples': {'dir': 'train-data', 'max_mb': 2000},
+    'clips': {'dir': 'imgs/clips', 'max_mb': 500},
+}
+
+_STORAGE = None
+_STORAGE_LOCK = threading.Lock()
+
+
+class StorageClass():
+
+    def __init__(self, name, directory, max_mb=None, max_age_days=None,
+                 policy='age'):
+        """Initialize the StorageClass class
+
+        Args:
+            name (str): Class name
+            directory (str): Directory of the class' files
+            max_mb (float, optional): Quota in MB. Defaults to None, no quota
+            max_age_days (float, optional): Evict files older than this
+            policy (str, optional): 'age' evicts the oldest files first, 'lru'
+                evicts the least recently accessed files first
+        """
+        self.name = name
+        self.directory = directory
+        self.max_bytes = max_mb * 1024 * 1024 if max_mb else None
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days else None
+        self.policy = policy
+
+        # path -> (size, mtime), oldest (or least recently used) first
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.dir_mtime = None
+        os.makedirs(directory, exist_ok=True)
+
+    def scan(self):
+        """Rebuild the index from the directory"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.startswith('.') or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+
+        self.index = OrderedDict(
+            (path, (size, mtime)) for mtime, path, size in sorted(entries))
+        self.total_bytes = sum(size for size, _ in self.index.values())
+        self.dir_mtime = os.stat(self.directory).st_mtime_ns
+
+    def refresh(self):
+        """Rescan the directory only if its contents changed, i.e. another
+        process added or removed a file
+        """
+        if os.stat(self.directory).st_mtime_ns != self.dir_mtime:
+            self.scan()
+
+    def add(self, path, size):
+        """Index a file written by this process. Call refresh() before the
+        write, the directory mtime is taken as the index' new state
+        """
+        if path in self.index:
+            self.total_bytes -= self.index.pop(path)[0]
+        self.index[path] = (size, time.time())
+        self.total_bytes += size
+        self.dir_mtime = os.stat(self.directory).st_mtime_ns
+
+    def discard(self, path):
+        if path in self.index:
+            self.total_bytes -= self.index.pop(path)[0]
+        self.dir_mtime = os.stat(self.directory).st_mtime_ns
+
+    def touch(self, path):
+        if self.policy == 'lru' and path in self.index:
+            self.index.move_to_end(path)
+
+    def eviction_candidates(self, keep=()):
+        """Files to evict to respect the quota and age limit
+
+        Args:
+            keep (tuple, optional): Paths that must not be evicted
+
+        Returns:
+            list: Paths to evict, in eviction order
+        """
+        evict = []
+        total = self.total_bytes
+        cutoff = time.time() - self.max_age if self.max_age else None
+        for path, (size, mtime) in self.index.items():
+            if path in keep:
+                continue
+            over_quota = self.max_bytes is not None and total > self.max_bytes
+            too_old = cutoff is not None and mtime < cutoff
+            if not over_quota and not too_old:
+                if self.policy == 'age':
+                    break
+                continue
+            evict.append(path)
+            total -= size
+        return evict
+
+
+class StorageManager():
+
+    def __init__(self, classes=None, fsync_seconds=None, min_free_mb=None):
+        """Initialize the StorageManager class
+
+        Args:
+            classes (dict, optional): Class name -> settings. Defaults to the
+                classes in the storage section of config.yml
+            fsync_seconds (float, optional): Seconds between batched fsyncs
+            min_free_mb (float, optional): Evict files, starting with the
+                lowest priority class, when free space drops below this
+        """
+        classes = classes or CONF.get('classes', DEFAULT_CLASSES)
+        self.classes = OrderedDict()
+        for name, settings in classes.items():
+            self.classes[name] = StorageClass(
+                name, os.path.join(config.CURR_DIR, settings['dir']),
+                settings.get('max_mb'), settings.get('max_age_days'),
+                settings.get('policy', 'age'))
+        self.eviction_order = CONF.get(
+            'eviction_order', ['clips', 'samples', 'alerts', 'snapshots'])
+        self.fsync_seconds = fsync_seconds or CONF.get('fsync_seconds', 10)
+        self.min_free_bytes = (min_free_mb or CONF.get('min_free_mb', 200)) \
+            * 1024 * 1024
+
+        self._lock = threading.RLock()
+        self._pending_fsync = set()
+        self._stop_event = threading.Event()
+
+        for storage_class in self.classes.values():
+            storage_class.scan()
+
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name='storage-fsync', daemon=True)
+        self._flusher.start()
+
+    def path(self, class_name, filename):
+        return os.path.join(self.classes[class_name].directory, filename)
+
+    @contextlib.contextmanager
+    def atomic_open(self, class_name, filename, mode='wb'):
+        """Open a temporary file that is renamed to <filename> in the class'
+        directory once the block exits without an error
+
+        Args:
+            class_name (str): Storage class
+            filename (str): Name of the file
+            mode (str, optional): File mode
+
+        Yields:
+            file: Open temporary file
+        """
+        path = self.path(class_name, filename)
+        tmp_path = os.path.join(os.path.dirname(path),
+                                '.{}.tmp'.format(filename))
+        storage_class = self.classes[class_name]
+        try:
+            with open(tmp_path, mode) as file_out:
+                yield file_out
+            with self._lock:
+                # pick up the files other processes added or removed before
+                # the rename, the index then only misses our own change
+                storage_class.refresh()
+                os.replace(tmp_path, path)
+                storage_class.add(path, os.path.getsize(path))
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._pending_fsync.add(path)
+            self.enforce(class_name, keep=(path,))
+
+    def write_bytes(self, class_name, filename, data):
+        """Atomically write bytes to a file in the class' directory
+
+        Args:
+            class_name (str): Storage class
+            filename (str): Name of the file
+            data (bytes): File contents
+
+        Returns:
+            str: Path of the written file
+        """
+        with self.atomic_open(class_name, filename) as file_out:
+            file_out.write(data)
+        return self.path(class_name, filename)
+
+    def remove(self, path):
+        """Remove a file and drop it from the index
+
+        Args:
+            path (str): Path of the file
+        """
+        with self._lock:
+            classes = [storage_class for storage_class in self.classes.values()
+                       if os.path.dirname(path) == storage_class.directory]
+            for storage_class in classes:
+                storage_class.refresh()
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            self._pending_fsync.discard(path)
+            for storage_class in classes:
+                storage_class.discard(path)
+
+    def files(self, class_name, suffixes=None):
+        """List the files of a class, oldest first, from the index
+
+        Args:
+            class_name (str): Storage class
+            suffixes (list, optional): Only return files ending with these
+
+        Returns:
+            list: File paths
+        """
+        with self._lock:
+            storage_class = self.classes[class_name]
+            storage_class.refresh()
+            paths = list(storage_class.index)
+        if suffixes:
+            paths = [p for p in paths if p.endswith(tuple(suffixes))]
+        return paths
+
+    def latest(self, class_name):
+        """Returns:
+            str: Most recently written file of a class, None if it is empty
+        """
+        files = self.files(class_name)
+        return files[-1] if files else None
+
+    def touch(self, path):
+        """Mark a file as accessed, for classes with an lru policy"""
+        with self._lock:
+            for storage_class in self.classes.values():
+                storage_class.touch(path)
+
+    def usage(self):
+        """Returns:
+            dict: Class name -> (number of files, MB used)
+        """
+        with self._lock:
+            return {name: (len(c.index), c.total_bytes / 1024 / 1024)
+                    for name, c in self.classes.items()}
+
+    def enforce(self, class_name, keep=()):
+        """Evict files of a class over its quota or age limit, then evict
+        from the other classes if the disk is nearly full
+
+        Args:
+            class_name (str): Storage class
+            keep (tuple, optional): Paths that must not be evicted
+        """
+        with self._lock:
+            for path in self.classes[class_name].eviction_candidates(keep):
+                LOGGER.info('Evicting %s from %s', path, class_name)
+                self.remove(path)
+
+            for name in self.eviction_order:
+                storage_class = self.classes.get(name)
+                if storage_class is None:
+                    continue
+                for path in list(storage_class.index):
+                    if self.free_bytes() >= self.min_free_bytes:
+                        return
+                    if path in keep:
+                        continue
+                    LOGGER.warning('Low disk space, evicting %s', path)
+                    self.remove(path)
+
+    def free_bytes(self):
+        return shutil.disk_usage(config.CURR_DIR).free
+
+    def flush(self):
+        """fsync every file written since the last flush, and their
+        directories so the renames are durable
+        """
+        with self._lock:
+            pending, self._pending_fsync = self._pending_fsync, set()
+
+        directories = set()
+        for path in pending:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            directories.add(os.path.dirname(path))
+
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.fsync_seconds):
+            try:
+                self.flush()
+            except OSError:
+                LOGGER.exception('Error while syncing files')
+
+    def close(self):
+        self._stop_event.set()
+        self.flush()
+
+
+def get_storage():
+    """Get the process wide StorageManager, creating it on first use
+
+    Returns:
+        StorageManager: Storage manager
+    """
+    global _STORAGE
+    with _STORAGE_LOCK:
+        if _STORAGE is None:
+            _STORAGE = StorageManager()
+            atexit.register(_STORAGE.close)
+    return _STORAGE
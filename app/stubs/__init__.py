@@ -0,0 +1,46 @@
+"""
+Hardware stubs, to run the security system off the pi, i.e. for soak_test.py.
+
+install() registers fake picamera, RPi.GPIO and pantilthat modules, so the
+imports inside the security system resolve to them:
+
+    picamera      PiCamera streams a looping video, or a synthetic scene with
+                  a block moving across it on a schedule (see scene.py)
+    RPi.GPIO      the PIR pin reads high while the scene has motion
+    pantilthat    keeps the pan and tilt angles in memory
+
+Redis, Slack and S3 are stood in for by local servers (see servers.py) that
+the settings point the processes to. Run a component with the stubs with
+
+    python3 -m stubs security_system
+"""
+import sys
+import types
+
+from . import camera
+from . import gpio
+from . import pantilt
+
+
+def module(name, source, attrs):
+    """Build a module exposing attributes of a stub module"""
+    fake = types.ModuleType(name)
+    fake.__doc__ = source.__doc__
+    for attr in attrs:
+        setattr(fake, attr, getattr(source, attr))
+    return fake
+
+
+def install():
+    """Register the fake hardware modules, replacing any real ones"""
+    picamera = module('picamera', camera, ['PiCamera', 'PiCameraError'])
+    picamera.array = module('picamera.array', camera, ['PiRGBArray'])
+    rpi = types.ModuleType('RPi')
+    rpi.GPIO = module('RPi.GPIO', gpio, gpio.__all__)
+    sys.modules.update({
+        'picamera': picamera,
+        'picamera.array': picamera.array,
+        'RPi': rpi,
+        'RPi.GPIO': rpi.GPIO,
+        'pantilthat': module('pantilthat', pantilt, pantilt.__all__),
+    })
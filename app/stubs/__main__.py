@@ -0,0 +1,30 @@
+"""
+Run a component with the hardware stubs installed, i.e.
+
+    python3 -m stubs security_system      # from app/
+    python3 -m stubs s3_upload
+    python3 -m app.stubs flask 52961      # from the repository root
+"""
+import runpy
+import sys
+
+from . import install
+
+
+def main():
+    install()
+    module = sys.argv[1]
+    if module == 'flask':
+        from app import application
+        from app import config
+
+        config.init_logging()
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 52961
+        application.run(host='127.0.0.1', port=port, threaded=True)
+        return
+    sys.argv = sys.argv[1:]
+    runpy.run_module(module, run_name='__main__', alter_sys=True)
+
+
+if __name__ == '__main__':
+    main()
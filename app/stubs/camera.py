@@ -0,0 +1,174 @@
+"""
+Fake picamera. PiCamera renders the scene (see scene.py) at its framerate,
+and supports what the security system uses of it: capture_continuous and
+capture in the bgr, yuv and jpeg formats, and MJPEG recordings on splitter
+ports.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from . import scene
+
+
+class PiCameraError(Exception):
+    pass
+
+
+class PiRGBArray():
+    """Output for bgr captures, like picamera.array.PiRGBArray"""
+
+    def __init__(self, camera, size=None):
+        self.camera = camera
+        self.size = size
+        self.array = None
+
+    def truncate(self, size=None):
+        if size == 0:
+            self.array = None
+
+    def close(self):
+        self.array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PiCamera():
+
+    CAPTURE_TIMEOUT = 60
+
+    def __init__(self, *args, **kwargs):
+        self.resolution = (640, 480)
+        self.framerate = 30
+        self.vflip = False
+        self.hflip = False
+        self.iso = 0
+        self.exposure_mode = 'auto'
+        self.exposure_speed = 20000
+        self.analog_gain = 1.0
+        self.digital_gain = 1.0
+        self.closed = False
+        self._scene = None
+        self._next_frame = 0.0
+        self._latest = None
+        self._lock = threading.Lock()
+        self._recordings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for port in list(self._recordings):
+            self.stop_recording(splitter_port=port)
+        self.closed = True
+
+    def _check_open(self):
+        if self.closed:
+            raise PiCameraError('Camera is closed')
+
+    def _wait_frame(self):
+        """Wait for the next frame at the framerate, and render it
+
+        Returns:
+            numpy.ndarray: BGR frame at the camera resolution
+        """
+        self._check_open()
+        with self._lock:
+            resolution = tuple(self.resolution)
+            if self._scene is None or \
+                    (self._scene.width, self._scene.height) != resolution:
+                self._scene = scene.Scene(resolution)
+            now = time.monotonic()
+            self._next_frame = max(self._next_frame + 1 / self.framerate,
+                                   now)
+            delay = self._next_frame - now
+        if delay > 0:
+            time.sleep(delay)
+        frame = self._scene.frame()
+        if self.vflip:
+            frame = frame[::-1]
+        if self.hflip:
+            frame = frame[:, ::-1]
+        self._latest = frame
+        return frame
+
+    def _frame(self, use_video_port):
+        """Latest frame of the video port, or a new one"""
+        if use_video_port and self._latest is not None:
+            return self._latest
+        return self._wait_frame()
+
+    def _write(self, output, fmt, frame, resize=None, quality=85):
+        if resize is not None:
+            frame = cv2.resize(frame, tuple(resize))
+        if fmt == 'bgr':
+            output.array = np.ascontiguousarray(frame)
+        elif fmt == 'yuv':
+            height, width = frame.shape[:2]
+            padded_width = (width + 31) // 32 * 32
+            padded_height = (height + 15) // 16 * 16
+            luma_size = padded_width * padded_height
+            luma = output[:luma_size].reshape(padded_height, padded_width)
+            luma[:height, :width] = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            output[luma_size:] = 128
+        elif fmt in ('jpeg', 'mjpeg'):
+            ok, jpeg = cv2.imencode(
+                '.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality or 85])
+            if not ok:
+                raise PiCameraError('Unable to encode the frame')
+            output.write(jpeg.tobytes())
+        else:
+            raise PiCameraError('Unsupported format {}'.format(fmt))
+
+    def capture(self, output, format='jpeg', use_video_port=False,
+                resize=None, splitter_port=0, **options):
+        self._write(output, format, self._frame(use_video_port), resize,
+                    options.get('quality'))
+
+    def capture_continuous(self, output, format='jpeg', use_video_port=False,
+                           resize=None, splitter_port=0, **options):
+        while True:
+            self._write(output, format, self._wait_frame(), resize,
+                        options.get('quality'))
+            yield output
+
+    def start_recording(self, output, format='h264', resize=None,
+                        splitter_port=1, **options):
+        """Record MJPEG, each frame written to output in one write call"""
+        self._check_open()
+        if format != 'mjpeg':
+            raise PiCameraError('Unsupported recording format {}'.format(
+                format))
+        if splitter_port in self._recordings:
+            raise PiCameraError('Already recording on port {}'.format(
+                splitter_port))
+        stopped = threading.Event()
+
+        def record():
+            last = None
+            while not stopped.wait(1 / self.framerate):
+                frame = self._latest
+                if frame is None or frame is last:
+                    continue
+                last = frame
+                self._write(output, 'mjpeg', frame, resize,
+                            options.get('quality'))
+
+        thread = threading.Thread(target=record, daemon=True,
+                                  name='recording-{}'.format(splitter_port))
+        self._recordings[splitter_port] = (thread, stopped)
+        thread.start()
+
+    def stop_recording(self, splitter_port=1):
+        thread, stopped = self._recordings.pop(splitter_port)
+        stopped.set()
+        thread.join()
@@ -0,0 +1,51 @@
+"""
+Fake RPi.GPIO. Input pins (the PIR sensor) read high while the scene has
+motion, see scene.py.
+"""
+from . import scene
+
+__all__ = ['BCM', 'BOARD', 'IN', 'OUT', 'HIGH', 'LOW', 'PUD_UP', 'PUD_DOWN',
+           'setmode', 'setwarnings', 'setup', 'input', 'output', 'cleanup']
+
+BCM = 11
+BOARD = 10
+IN = 1
+OUT = 0
+HIGH = 1
+LOW = 0
+PUD_UP = 22
+PUD_DOWN = 21
+
+_MODE = [None]
+_OUTPUTS = {}
+
+
+def setmode(mode):
+    _MODE[0] = mode
+
+
+def setwarnings(flag):
+    pass
+
+
+def setup(channel, direction, pull_up_down=None, initial=None):
+    if _MODE[0] is None:
+        raise RuntimeError('Please set pin numbering mode using '
+                           'GPIO.setmode(GPIO.BOARD) or '
+                           'GPIO.setmode(GPIO.BCM)')
+    if direction == OUT:
+        _OUTPUTS[channel] = initial or LOW
+
+
+def input(channel):
+    if channel in _OUTPUTS:
+        return _OUTPUTS[channel]
+    return HIGH if scene.episode() is not None else LOW
+
+
+def output(channel, value):
+    _OUTPUTS[channel] = value
+
+
+def cleanup(channel=None):
+    _OUTPUTS.clear()
@@ -0,0 +1,28 @@
+"""
+Fake pantilthat, keeping the angles in memory.
+"""
+__all__ = ['pan', 'tilt', 'get_pan', 'get_tilt']
+
+_ANGLES = {'pan': 0, 'tilt': 0}
+
+
+def _set(axis, angle):
+    if not -90 <= angle <= 90:
+        raise ValueError('Angle should be between -90 and 90')
+    _ANGLES[axis] = angle
+
+
+def pan(angle):
+    _set('pan', angle)
+
+
+def tilt(angle):
+    _set('tilt', angle)
+
+
+def get_pan():
+    return _ANGLES['pan']
+
+
+def get_tilt():
+    return _ANGLES['tilt']
@@ -0,0 +1,112 @@
+"""
+What the fake camera sees. Motion episodes start every motion_every seconds
+after start, and last motion_seconds:
+
+    soak:
+      start: 1700000000 # epoch seconds, shared by every process
+      motion_every: 120
+      motion_seconds: 10
+      video: null # loop this video instead of the synthetic scene
+
+The synthetic scene is a textured background with sensor noise, and a dark
+block walking across it during the episodes. A video is looped as is, its
+motion is whatever it shows.
+"""
+import threading
+import time
+
+import cv2
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+# Noise frames cycled through, instead of drawing noise for every frame
+NOISE_FRAMES = 8
+
+
+def settings():
+    return config.load_config().get('soak', {})
+
+
+def episode(now=None, conf=None):
+    """Motion episode at a time
+
+    Args:
+        now (float, optional): Epoch seconds, defaults to now
+        conf (dict, optional): soak settings
+
+    Returns:
+        tuple: (episode start, seconds into it), None without motion
+    """
+    conf = conf if conf is not None else settings()
+    now = time.time() if now is None else now
+    start = conf.get('start', 0)
+    every = conf.get('motion_every', 120)
+    offset = (now - start) % every
+    if now < start or offset >= conf.get('motion_seconds', 10):
+        return None
+    return now - offset, offset
+
+
+class Scene():
+
+    def __init__(self, resolution, conf=None):
+        """Initialize the Scene class
+
+        Args:
+            resolution (tuple): (width, height) of the frames
+            conf (dict, optional): soak settings
+        """
+        self.conf = conf if conf is not None else settings()
+        self.width, self.height = resolution
+        self.video = None
+        if self.conf.get('video'):
+            self.video = cv2.VideoCapture(self.conf['video'])
+            if not self.video.isOpened():
+                raise IOError('Unable to open {}'.format(self.conf['video']))
+        rng = np.random.RandomState(0)
+        texture = cv2.resize(
+            rng.randint(60, 200, (self.height // 16, self.width // 16, 3),
+                        dtype=np.uint8),
+            (self.width, self.height), interpolation=cv2.INTER_CUBIC)
+        self.background = texture.astype(np.int16)
+        self.noise = [rng.randint(-3, 4, texture.shape).astype(np.int16)
+                      for _ in range(NOISE_FRAMES)]
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def read_video(self):
+        ok, frame = self.video.read()
+        if not ok:
+            # loop
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ok, frame = self.video.read()
+            if not ok:
+                raise IOError('Unable to read {}'.format(self.conf['video']))
+        return cv2.resize(frame, (self.width, self.height))
+
+    def frame(self, now=None):
+        """Render the scene
+
+        Args:
+            now (float, optional): Epoch seconds, defaults to now
+
+        Returns:
+            numpy.ndarray: BGR frame
+        """
+        with self.lock:
+            self.count += 1
+            if self.video is not None:
+                return self.read_video()
+            frame = self.background + self.noise[self.count % NOISE_FRAMES]
+            current = episode(now, self.conf)
+            if current is not None:
+                progress = current[1] / self.conf.get('motion_seconds', 10)
+                size = self.height // 2
+                x = int(progress * (self.width - size // 2))
+                y = self.height // 4
+                frame[y:y + size, x:x + size // 2] = 30
+            return np.clip(frame, 0, 255).astype(np.uint8)
@@ -0,0 +1,288 @@
+"""
+Local stand-ins for the network services, run by soak_test.py in its own
+process:
+
+    SlackStub  answers the Web API methods the alerts call, and records when
+               each call arrived
+    S3Stub     accepts put_object calls (path style, any credentials), and
+               records the keys and sizes without keeping the data
+    RouterStub the router's login and connected devices pages, as
+               presence.RouterSource uses them
+    redis      fakeredis' TCP server (fakeredis >= 2.25), or a redis-server
+               without persistence when fakeredis isn't installed
+"""
+import collections
+import hashlib
+import json
+import logging
+import shutil
+import itertools
+import socket
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+LOGGER = logging.getLogger(__name__)
+
+Call = collections.namedtuple('Call', ['time', 'method', 'bytes'])
+Upload = collections.namedtuple('Upload', ['time', 'bucket', 'key', 'bytes'])
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def read_body(self):
+        """Read the request body, chunked or not, and return its size"""
+        size = 0
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            while True:
+                length = int(self.rfile.readline().split(b';')[0], 16)
+                size += len(self.rfile.read(length))
+                self.rfile.readline()
+                if not length:
+                    return size
+        length = int(self.headers.get('Content-Length', 0))
+        while size < length:
+            chunk = self.rfile.read(min(length - size, 1 << 16))
+            if not chunk:
+                break
+            size += len(chunk)
+        return size
+
+    def respond(self, status, body=b'', content_type='application/json',
+                headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format, *args)
+
+
+class StubServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, handler, port=0):
+        super(StubServer, self).__init__(('127.0.0.1', port), handler)
+        self.lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}/'.format(self.server_address[1])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       name=type(self).__name__, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SlackHandler(Handler):
+
+    def do_POST(self):
+        size = self.read_body()
+        method = urlparse(self.path).path.rsplit('/', 1)[-1]
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        now = time.time()
+        with server.lock:
+            server.calls.append(Call(now, method, size))
+            count = len(server.calls)
+        response = {'ok': True}
+        if method == 'chat.postMessage':
+            response.update(ts='{:.6f}'.format(now), channel='CSOAK')
+        elif method == 'files.upload':
+            response['file'] = {'id': 'F{}'.format(count)}
+        self.respond(200, json.dumps(response).encode())
+
+
+class SlackStub(StubServer):
+
+    def __init__(self, port=0, delay=0.0):
+        """Initialize the SlackStub class
+
+        Args:
+            port (int, optional): Port to listen on, defaults to a free one
+            delay (float, optional): Seconds to wait before answering, i.e.
+                to simulate the latency of the real API
+        """
+        super(SlackStub, self).__init__(SlackHandler, port)
+        self.delay = delay
+        self.calls = []
+
+
+class S3Handler(Handler):
+
+    def do_PUT(self):
+        size = self.read_body()
+        bucket, _, key = urlparse(self.path).path.lstrip('/').partition('/')
+        with self.server.lock:
+            self.server.uploads.append(Upload(time.time(), bucket, key, size))
+        etag = '"{}"'.format(hashlib.md5(self.path.encode()).hexdigest())
+        self.respond(200, content_type='application/xml',
+                     headers={'ETag': etag})
+
+    def do_GET(self):
+        self.respond(404, b'<Error><Code>NoSuchKey</Code></Error>',
+                     content_type='application/xml')
+
+    do_HEAD = do_GET
+
+
+class S3Stub(StubServer):
+
+    def __init__(self, port=0):
+        super(S3Stub, self).__init__(S3Handler, port)
+        self.uploads = []
+
+
+class RouterHandler(Handler):
+
+    def do_GET(self):
+        server = self.server
+        path = urlparse(self.path).path
+        if path == '/login':
+            self.respond(200, server.LOGIN_PAGE, content_type='text/html')
+            return
+        cookie = self.headers.get('Cookie', '')
+        user_id = cookie.partition('userid=')[2].split(';')[0]
+        with server.lock:
+            server.device_requests += 1
+            valid = user_id in server.sessions
+            devices = [{'hostName': name} for name in server.devices]
+        if not valid:
+            # like the router, an expired session gets the login page
+            self.respond(200, server.LOGIN_PAGE, content_type='text/html')
+            return
+        self.respond(200, json.dumps(devices).encode())
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode())
+        if form.get('user') != [server.user] or \
+                form.get('pws') != [server.pws]:
+            self.respond(403, b'', content_type='text/html')
+            return
+        with server.lock:
+            user_id = str(next(server.ids))
+            server.sessions.add(user_id)
+            server.logins += 1
+        self.respond(200, server.LOGIN_PAGE, content_type='text/html',
+                     headers={'Set-Cookie': 'userid={}; path=/'.format(
+                         user_id)})
+
+
+class RouterStub(StubServer):
+
+    LOGIN_PAGE = b'<html><body>Login</body></html>'
+
+    def __init__(self, port=0, devices=(), user='admin', pws='secret'):
+        """Initialize the RouterStub class
+
+        Args:
+            port (int, optional): Port to listen on, defaults to a free one
+            devices (iterable, optional): Host names of the connected
+                devices, change it to simulate arrivals and departures
+            user (str, optional): Login user
+            pws (str, optional): Login password
+        """
+        super(RouterStub, self).__init__(RouterHandler, port)
+        self.devices = list(devices)
+        self.user = user
+        self.pws = pws
+        self.ids = itertools.count(1)
+        self.sessions = set()
+        self.logins = 0
+        self.device_requests = 0
+
+    def router_conf(self):
+        """Returns:
+            dict: router section of private.yml for the stub
+        """
+        return {
+            'user': self.user,
+            'pws': self.pws,
+            'login_get': self.url + 'login',
+            'login_post': self.url + 'login',
+            'get_connected_url': self.url + 'devices?_={}',
+            'headers': {},
+            'base_cookie': 'user={};pws={};userid={}',
+        }
+
+    def expire_sessions(self):
+        """Reject every session, as the router does after a while"""
+        with self.lock:
+            self.sessions.clear()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def start_redis(port=0):
+    """Start a local redis
+
+    Args:
+        port (int, optional): Port to listen on, defaults to a free one
+
+    Returns:
+        tuple: (port, function that stops it)
+    """
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        TcpFakeServer = None
+    if TcpFakeServer is not None:
+        server = TcpFakeServer(('127.0.0.1', port), server_type='redis')
+        threading.Thread(target=server.serve_forever, name='fakeredis',
+                         daemon=True).start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+        return server.server_address[1], stop
+
+    binary = shutil.which('redis-server')
+    if binary is None:
+        raise RuntimeError('Soak tests need fakeredis >= 2.25, or '
+                           'redis-server on the PATH')
+    port = port or free_port()
+    process = subprocess.Popen(
+        [binary, '--port', str(port), '--bind', '127.0.0.1', '--save', '',
+         '--appendonly', 'no'], stdout=subprocess.DEVNULL)
+    wait_for_port(port)
+
+    def stop():
+        process.terminate()
+        process.wait()
+    return port, stop
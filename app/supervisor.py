@@ -0,0 +1,306 @@
+"""
+Supervisor for the security system components. Replaces the separate nohup
+launches in start.sh with managed child processes that are health checked,
+restarted with backoff, and shut down gracefully on SIGTERM.
+
+The heavy modules (OpenCV, numpy, boto3...) are imported once in the
+supervisor, and the python components are forked from it, so they start
+without re-importing them and share those pages copy-on-write.
+"""
+import atexit
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import config
+
+LOGGER = logging.getLogger('supervisor')
+CONF = config.load_config()
+
+config.init_logging()
+
+REPO_DIR = os.path.dirname(config.CURR_DIR)
+
+# Modules imported by the supervisor before forking any components
+PRELOAD_MODULES = ['numpy', 'cv2', 'imutils', 'boto3', 'requests', 'redis',
+                   'psutil', 'picamera', 'utils.redis_store', 'utils.http',
+                   'utils.slack', 'utils.s3', 'model']
+
+# Set in supervised children, see heartbeat()
+_HEARTBEAT = None
+
+
+def heartbeat():
+    """Record that the current process is alive and making progress.
+
+    A no-op when the process is not running under the supervisor, so
+    components can call it unconditionally.
+    """
+    if _HEARTBEAT is not None:
+        _HEARTBEAT.value = time.monotonic()
+
+
+def run_security_system():
+    import security_system
+    security_system.SecuritySystem().run()
+
+
+def run_who_is_home():
+    import who_is_home
+    who_is_home.loop()
+
+
+def run_s3_upload():
+    import s3_upload
+    s3_upload.loop()
+
+
+class Component():
+
+    def __init__(self, name, target=None, command=None, log_file=None,
+                 heartbeat_timeout=None, stop_timeout=10):
+        """Initialize the Component class
+
+        Args:
+            name (str): Component name
+            target (callable, optional): Function to run in a forked child
+            command (list, optional): Command to exec instead of forking,
+                used for components with their own process model (gunicorn)
+            log_file (str, optional): File in config.LOG_DIR that the
+                component's stdout and stderr are appended to
+            heartbeat_timeout (float, optional): Restart the component if it
+                hasn't called heartbeat() within this many seconds. Defaults
+                to None, which only checks that the process is alive
+            stop_timeout (float, optional): Seconds to wait after SIGTERM
+                before sending SIGKILL
+        """
+        self.name = name
+        self.target = target
+        self.command = command
+        self.log_file = log_file or '{}.log'.format(name)
+        self.heartbeat_timeout = heartbeat_timeout
+        self.stop_timeout = stop_timeout
+
+        self.process = None
+        self.started = None
+        self.failures = 0
+        self.restart_at = 0
+        self.last_heartbeat = multiprocessing.Value('d', 0.0)
+
+    @property
+    def pid(self):
+        return self.process.pid if self.process else None
+
+    def _log_fd(self):
+        log_path = os.path.join(config.LOG_DIR, self.log_file)
+        return os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def _bootstrap(self):
+        """Entrypoint of forked children"""
+        # the supervisor's exit handlers are its own, not the child's
+        atexit._clear()
+        # set on the importable module, since the supervisor itself usually
+        # runs as __main__
+        supervisor_module = importlib.import_module('supervisor')
+        supervisor_module._HEARTBEAT = self.last_heartbeat
+        supervisor_module.heartbeat()
+
+        # same as the nohup redirect in start.sh
+        log_fd = self._log_fd()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(log_fd, 1)
+        os.dup2(log_fd, 2)
+
+        # exit with SystemExit so context managers (i.e. the camera) are
+        # closed. multiprocessing ends children with os._exit, which skips
+        # the atexit handlers (i.e. unlinking the frame bus, the final
+        # fsync of the storage), so they're run here
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        try:
+            self.target()
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            atexit._run_exitfuncs()
+
+    def start(self):
+        LOGGER.info('Starting %s', self.name)
+        self.last_heartbeat.value = time.monotonic()
+        if self.command:
+            log_fd = self._log_fd()
+            self.process = subprocess.Popen(
+                self.command, cwd=REPO_DIR, stdout=log_fd,
+                stderr=subprocess.STDOUT)
+            os.close(log_fd)
+        else:
+            context = multiprocessing.get_context('fork')
+            self.process = context.Process(
+                target=self._bootstrap, name=self.name)
+            self.process.start()
+        self.started = time.monotonic()
+        LOGGER.info('%s started with pid %s', self.name, self.pid)
+
+    def is_alive(self):
+        if self.process is None:
+            return False
+        if self.command:
+            return self.process.poll() is None
+        return self.process.is_alive()
+
+    def is_healthy(self):
+        """Check the component is alive and, if configured, has recently
+        reported a heartbeat
+
+        Returns:
+            bool: True if the component is healthy
+        """
+        if not self.is_alive():
+            return False
+        if self.heartbeat_timeout and not self.command:
+            since = time.monotonic() - self.last_heartbeat.value
+            if since > self.heartbeat_timeout:
+                LOGGER.warning('No heartbeat from %s in %.0fs', self.name,
+                               since)
+                return False
+        return True
+
+    def stop(self):
+        """Send SIGTERM, then SIGKILL if the component hasn't exited within
+        <self.stop_timeout> seconds
+        """
+        if not self.is_alive():
+            return
+        LOGGER.info('Stopping %s (pid %s)', self.name, self.pid)
+        self.process.terminate()
+        if self.command:
+            try:
+                self.process.wait(self.stop_timeout)
+            except subprocess.TimeoutExpired:
+                pass
+        else:
+            self.process.join(self.stop_timeout)
+
+        if self.is_alive():
+            LOGGER.warning('%s did not exit after SIGTERM, killing it',
+                           self.name)
+            self.process.kill()
+            if self.command:
+                self.process.wait()
+            else:
+                self.process.join()
+
+
+class Supervisor():
+
+    def __init__(self, components, check_interval=None, min_backoff=None,
+                 max_backoff=None, stable_seconds=None, preload=True):
+        """Initialize the Supervisor class
+
+        Args:
+            components (list): Components to supervise
+            check_interval (float, optional): Seconds between health checks
+            min_backoff (float, optional): Seconds to wait before the first
+                restart of a failed component, doubled on each further failure
+            max_backoff (float, optional): Maximum seconds between restarts
+            stable_seconds (float, optional): A component that has been up
+                this long has its failure count reset
+            preload (bool, optional): Import PRELOAD_MODULES before forking
+        """
+        conf = CONF.get('supervisor', {})
+        self.components = components
+        self.check_interval = check_interval or conf.get('check_interval', 5)
+        self.min_backoff = min_backoff or conf.get('min_backoff', 2)
+        self.max_backoff = max_backoff or conf.get('max_backoff', 300)
+        self.stable_seconds = stable_seconds or conf.get('stable_seconds', 60)
+        self.preload = preload
+        self.stopping = False
+
+    def preload_modules(self):
+        start = time.monotonic()
+        for module in PRELOAD_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                LOGGER.warning('Unable to preload %s', module)
+        LOGGER.info('Preloaded modules in %.2fs', time.monotonic() - start)
+
+    def handle_signal(self, signum, frame):
+        LOGGER.info('Received signal %s, shutting down', signum)
+        self.stopping = True
+
+    def schedule_restart(self, component):
+        """Stop an unhealthy component and schedule it to be restarted with
+        exponential backoff
+
+        Args:
+            component (Component): Failed component
+        """
+        component.stop()
+        if time.monotonic() - component.started >= self.stable_seconds:
+            component.failures = 0
+        backoff = min(self.max_backoff,
+                      self.min_backoff * 2 ** component.failures)
+        component.failures += 1
+        component.restart_at = time.monotonic() + backoff
+        LOGGER.warning('%s failed (%s consecutive), restarting in %ss',
+                       component.name, component.failures, backoff)
+
+    def check(self):
+        now = time.monotonic()
+        for component in self.components:
+            if component.restart_at:
+                if now >= component.restart_at:
+                    component.restart_at = 0
+                    component.start()
+            elif not component.is_healthy():
+                self.schedule_restart(component)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+
+        if self.preload:
+            self.preload_modules()
+
+        for component in self.components:
+            component.start()
+
+        while not self.stopping:
+            time.sleep(self.check_interval)
+            if not self.stopping:
+                self.check()
+
+        for component in reversed(self.components):
+            component.stop()
+        LOGGER.info('All components stopped')
+
+
+def default_components():
+    """Build the components that make up the security system, skipping any
+    disabled in the supervisor section of config.yml
+
+    Returns:
+        list: Components to supervise
+    """
+    conf = CONF.get('supervisor', {})
+    components = [
+        Component('flask', command=[
+            'gunicorn', '-c', 'gunicorn.conf', 'run_flask']),
+        Component('who_is_home', target=run_who_is_home),
+        Component('security_system', target=run_security_system,
+                  heartbeat_timeout=conf.get('heartbeat_timeout', 120)),
+        Component('s3_upload', target=run_s3_upload),
+    ]
+    disabled = conf.get('disabled', [])
+    return [c for c in components if c.name not in disabled]
+
+
+if __name__ == '__main__':
+    LOGGER.info('Running supervisor')
+    Supervisor(default_components()).run()
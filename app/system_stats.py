@@ -0,0 +1,215 @@
+"""
+Background sampler for system stats (CPU, memory, SoC temperature and the
+security system processes), kept in a small in-memory time series so the
+/status and /top views never have to spawn a process.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+import psutil
+
+try:
+    from app import config
+    from app import utils
+except ImportError:
+    import config
+    import utils
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+# Substrings of the command lines of the processes we want to track
+PROCESS_NAMES = ['gunicorn', 'security_system.py', 'who_is_home.py',
+                 's3_upload.py', 'supervisor.py', 'redis-server']
+
+_SAMPLER = None
+_SAMPLER_LOCK = threading.Lock()
+
+
+class StatsSampler(threading.Thread):
+
+    def __init__(self, interval=None, history_seconds=None,
+                 process_names=None):
+        """Initialize the StatsSampler class
+
+        Args:
+            interval (float, optional): Seconds between samples. Defaults to
+                stats_interval in config.yml
+            history_seconds (float, optional): Seconds of samples to keep.
+                Defaults to stats_history_seconds in config.yml
+            process_names (list, optional): Command line substrings of the
+                processes to track. Defaults to PROCESS_NAMES
+        """
+        super(StatsSampler, self).__init__(name='stats-sampler', daemon=True)
+        self.interval = interval or CONF.get('stats_interval', 5)
+        history_seconds = history_seconds or CONF.get(
+            'stats_history_seconds', 600)
+        self.process_names = process_names or PROCESS_NAMES
+        self.samples = deque(maxlen=max(1, int(history_seconds
+                                               / self.interval)))
+        self._processes = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _tracked_processes(self):
+        """Refresh the tracked processes, keeping the psutil.Process objects
+        between samples so their cpu_percent is measured over the interval.
+
+        Returns:
+            list: psutil.Process objects
+        """
+        current = {}
+        for proc in psutil.process_iter():
+            try:
+                cmdline = ' '.join(proc.cmdline())
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+            if any(name in cmdline for name in self.process_names):
+                current[proc.pid] = self._processes.get(proc.pid, proc)
+        self._processes = current
+        return list(current.values())
+
+    def sample(self):
+        """Take a single sample of the system stats
+
+        Returns:
+            dict: Sample of the system stats
+        """
+        memory = psutil.virtual_memory()
+        processes = []
+        for proc in self._tracked_processes():
+            try:
+                with proc.oneshot():
+                    processes.append({
+                        'pid': proc.pid,
+                        'cmdline': ' '.join(proc.cmdline()),
+                        'status': proc.status(),
+                        'cpu_percent': proc.cpu_percent(),
+                        'memory_mb': proc.memory_info().rss / 1024 / 1024,
+                        'threads': proc.num_threads(),
+                    })
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+        return {
+            'ts': time.time(),
+            'cpu_percent': psutil.cpu_percent(),
+            'load_avg': psutil.getloadavg(),
+            'memory_percent': memory.percent,
+            'memory_available_mb': memory.available / 1024 / 1024,
+            'temperature': utils.measure_temp(),
+            'processes': processes,
+        }
+
+    def run(self):
+        LOGGER.info('Sampling system stats every %ss', self.interval)
+        while not self._stop_event.is_set():
+            try:
+                sample = self.sample()
+                with self._lock:
+                    self.samples.append(sample)
+            except Exception:
+                LOGGER.exception('Error while sampling system stats')
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def latest(self):
+        """Get the latest sample, taking one if none have been collected yet
+
+        Returns:
+            dict: Latest sample of the system stats
+        """
+        with self._lock:
+            if self.samples:
+                return self.samples[-1]
+        sample = self.sample()
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+
+    def history(self, seconds=None):
+        """Get the samples from the last <seconds> seconds
+
+        Args:
+            seconds (float, optional): Size of the window. Defaults to None,
+                which returns all stored samples
+
+        Returns:
+            list: Samples, oldest first
+        """
+        with self._lock:
+            samples = list(self.samples)
+        if seconds is None:
+            return samples
+        cutoff = time.time() - seconds
+        return [sample for sample in samples if sample['ts'] >= cutoff]
+
+    def trend(self, key, seconds=None):
+        """Summarize a stat over the last <seconds> seconds
+
+        Args:
+            key (str): Sample key, i.e. 'temperature' or 'cpu_percent'
+            seconds (float, optional): Size of the window
+
+        Returns:
+            dict: min, mean, max and change of the stat over the window, None
+                if there are no samples
+        """
+        values = [sample[key] for sample in self.history(seconds)
+                  if sample.get(key) is not None]
+        if not values:
+            return None
+        return {
+            'min': min(values),
+            'mean': sum(values) / len(values),
+            'max': max(values),
+            'change': values[-1] - values[0],
+        }
+
+
+def get_sampler():
+    """Get the process wide StatsSampler, starting it on first use
+
+    Returns:
+        StatsSampler: Running sampler
+    """
+    global _SAMPLER
+    with _SAMPLER_LOCK:
+        if _SAMPLER is None:
+            _SAMPLER = StatsSampler()
+            _SAMPLER.start()
+    return _SAMPLER
+
+
+def format_top(sample, max_processes=20):
+    """Format a sample like the header and process list of `top`
+
+    Args:
+        sample (dict): Sample from StatsSampler
+        max_processes (int, optional): Number of processes to list
+
+    Returns:
+        str: Formatted sample
+    """
+    lines = [
+        'cpu: {:.1f}%  load average: {}'.format(
+            sample['cpu_percent'],
+            ', '.join('{:.2f}'.format(load) for load in sample['load_avg'])),
+        'mem: {:.1f}% used, {:.0f} MB available'.format(
+            sample['memory_percent'], sample['memory_available_mb']),
+        'temp: {}'.format(sample['temperature']),
+        '',
+        '{:>6} {:>6} {:>8} {:>4}  {}'.format('PID', '%CPU', 'RES(MB)', 'THR',
+                                             'COMMAND'),
+    ]
+    processes = sorted(sample['processes'], key=lambda p: p['cpu_percent'],
+                       reverse=True)
+    for proc in processes[:max_processes]:
+        lines.append('{:>6} {:>6.1f} {:>8.1f} {:>4}  {}'.format(
+            proc['pid'], proc['cpu_percent'], proc['memory_mb'],
+            proc['threads'], proc['cmdline'][:80]))
+    return '\n'.join(lines)
@@ -0,0 +1,210 @@
+"""
+Thumbnails of the buffered camera frames for alerts: a contact sheet, or a
+short animated GIF or WebP, with the motion boxes of every frame overlaid.
+
+The frames are resized into a single preallocated array, and the contact
+sheet is tiled with a reshape. Rendering runs on a worker thread, and the
+frames are subsampled to fit within a memory budget.
+
+Animations need Pillow, which is only imported when one is rendered.
+"""
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config()
+
+BOX_COLOR = (0, 0, 255)
+
+
+def downsample(frames, width):
+    """Downsample frames of the same shape by an integer factor, averaging
+    blocks of pixels (INTER_AREA) into one preallocated array
+
+    Args:
+        frames (list): BGR or grayscale frames of the same shape
+        width (int): Target width. The actual width is the frame width
+            divided by the nearest integer factor
+
+    Returns:
+        tuple: (numpy.ndarray of shape (N, H, W, 3), factor)
+    """
+    height, frame_width = frames[0].shape[:2]
+    factor = max(1, frame_width // width)
+    out_h, out_w = height // factor, frame_width // factor
+
+    small = np.empty((len(frames), out_h, out_w, 3), np.uint8)
+    for frame, out in zip(frames, small):
+        if frame.ndim == 2:
+            # luma frames, gray thumbnails the boxes can be drawn on in color
+            cv2.cvtColor(cv2.resize(frame, (out_w, out_h),
+                                    interpolation=cv2.INTER_AREA),
+                         cv2.COLOR_GRAY2BGR, dst=out)
+        else:
+            cv2.resize(frame, (out_w, out_h), interpolation=cv2.INTER_AREA,
+                       dst=out)
+    return small, factor
+
+
+def draw_boxes(thumbnails, contours, scale):
+    """Draw the bounding boxes of the motion contours on the thumbnails
+
+    Args:
+        thumbnails (numpy.ndarray): Thumbnails, drawn on in place
+        contours (list): List of contours meta per thumbnail
+        scale (float): Thumbnail size over the contour coords size
+    """
+    for thumbnail, frame_contours in zip(thumbnails, contours):
+        for contour in frame_contours or []:
+            x, y, w, h = [int(v * scale) for v in contour['coords']]
+            cv2.rectangle(thumbnail, (x, y), (x + w, y + h), BOX_COLOR, 1)
+
+
+def contact_sheet(thumbnails, columns=3):
+    """Tile thumbnails into a single image
+
+    Args:
+        thumbnails (numpy.ndarray or list): Thumbnails of the same shape
+        columns (int, optional): Number of columns
+
+    Returns:
+        numpy.ndarray: Contact sheet
+    """
+    thumbnails = np.asarray(thumbnails)
+    count, height, width = thumbnails.shape[:3]
+    columns = min(columns, count)
+    rows = -(-count // columns)
+    padding = rows * columns - count
+    if padding:
+        thumbnails = np.concatenate([
+            thumbnails, np.zeros((padding, height, width, 3), np.uint8)])
+    return thumbnails.reshape(rows, columns, height, width, 3) \
+        .transpose(0, 2, 1, 3, 4).reshape(rows * height, columns * width, 3)
+
+
+def encode_animation(thumbnails, fps, image_format='GIF'):
+    """Encode thumbnails as an animated GIF or WebP
+
+    Args:
+        thumbnails (numpy.ndarray): BGR thumbnails
+        fps (float): Frames per second of the animation
+        image_format (str, optional): GIF or WEBP
+
+    Returns:
+        bytes: Encoded animation
+    """
+    from PIL import Image
+
+    images = [Image.fromarray(t[:, :, ::-1]) for t in thumbnails]
+    buffer = io.BytesIO()
+    images[0].save(buffer, format=image_format, save_all=True,
+                   append_images=images[1:], duration=int(1000 / fps),
+                   loop=0)
+    return buffer.getvalue()
+
+
+class ThumbnailRenderer():
+
+    FORMATS = {'sheet': 'jpg', 'gif': 'gif', 'webp': 'webp'}
+
+    def __init__(self, conf=None):
+        """Initialize the ThumbnailRenderer class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml
+        """
+        conf = conf or CONF
+        settings = conf.get('thumbnails', {})
+        self.kind = settings.get('kind', 'sheet')
+        if self.kind not in self.FORMATS:
+            raise ValueError('Unknown thumbnails kind {}, expected one of {}'
+                             .format(self.kind, sorted(self.FORMATS)))
+        self.width = settings.get('width', 160)
+        self.columns = settings.get('columns', 6)
+        self.fps = settings.get('fps', conf.get('fps', 10))
+        self.quality = conf.get('jpeg_quality', 90)
+        self.frame_width = conf['frame_width']
+        self.memory_bytes = settings.get('memory_mb', 32) * 1024 * 1024
+        self.pool = ThreadPoolExecutor(max_workers=1,
+                                       thread_name_prefix='thumbnails')
+        # Renders waiting or running, at most one of each
+        self._pending = threading.Semaphore(2)
+
+    @property
+    def extension(self):
+        return self.FORMATS[self.kind]
+
+    def fit_budget(self, frames, contours):
+        """Subsample the frames so their stacked copy and the thumbnails fit
+        in the memory budget
+
+        Returns:
+            tuple: (frames, contours)
+        """
+        frame_bytes = frames[0].nbytes
+        max_frames = max(1, int(self.memory_bytes // (frame_bytes * 1.25)))
+        if len(frames) <= max_frames:
+            return frames, contours
+        step = -(-len(frames) // max_frames)
+        LOGGER.debug('Keeping every %s frames of %s to fit the thumbnails '
+                     'memory budget', step, len(frames))
+        return frames[::step], contours[::step]
+
+    def render_now(self, frames, contours=None):
+        """Render the frames on the calling thread
+
+        Args:
+            frames (list): BGR or grayscale frames of the same shape, oldest
+                first
+            contours (list, optional): List of contours meta per frame, with
+                coords at <frame_width> resolution
+
+        Returns:
+            bytes: Encoded contact sheet or animation
+        """
+        contours = contours or [None] * len(frames)
+        frames, contours = self.fit_budget(frames, contours)
+        thumbnails, _ = downsample(frames, self.width)
+        draw_boxes(thumbnails, contours,
+                   thumbnails.shape[2] / self.frame_width)
+
+        if self.kind == 'sheet':
+            sheet = contact_sheet(thumbnails, self.columns)
+            ok, buffer = cv2.imencode(
+                '.jpg', sheet, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+            if not ok:
+                raise ValueError('Unable to encode contact sheet')
+            return buffer.tobytes()
+        return encode_animation(thumbnails, self.fps, self.kind.upper())
+
+    def render(self, frames, contours=None):
+        """Render the frames on the worker thread
+
+        Args:
+            frames (list): BGR frames, must not be modified after
+            contours (list, optional): List of contours meta per frame
+
+        Returns:
+            concurrent.futures.Future: Resolves to the encoded bytes, None if
+                a render is already waiting, so renders never pile up
+        """
+        if not self._pending.acquire(blocking=False):
+            LOGGER.warning('Thumbnails still rendering, skipping')
+            return None
+        future = self.pool.submit(self.render_now, list(frames),
+                                  list(contours) if contours else None)
+        future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def close(self):
+        self.pool.shutdown(wait=True)
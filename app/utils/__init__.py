@@ -0,0 +1,46 @@
+"""
+Utils package, contains utility functions used throughout the codebase.
+
+The helpers live in submodules (slack, s3, http, redis_store, hardware,
+process, files) that are only imported the first time one of their functions
+is accessed, i.e. `utils.redis_get` imports `utils.redis_store` but not
+OpenCV, boto3 or requests.
+"""
+import importlib
+
+_SUBMODULES = {
+    'files': ['save_image', 'encode_image', 'latest_file', 'search_path',
+              'clean_dir'],
+    'hardware': ['get_tilt', 'get_pan', 'pan', 'tilt', 'measure_temp'],
+    'http': ['get_session'],
+    'process': ['spawn_python_process', 'kill_python_process',
+                'check_process'],
+    'redis_store': ['get_redis', 'redis_get', 'redis_set'],
+    's3': ['get_s3', 'upload_to_s3'],
+    'slack': ['slack_api_call', 'validate_slack', 'parse_slash_post',
+              'slack_post_interactive', 'slack_delete_file', 'slack_post',
+              'slack_upload'],
+}
+_ATTRIBUTES = {
+    attr: module for module, attrs in _SUBMODULES.items() for attr in attrs
+}
+
+__all__ = sorted(_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module('.' + name, __name__)
+
+    module_name = _ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = getattr(importlib.import_module('.' + module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_SUBMODULES) + __all__)
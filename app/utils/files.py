@@ -0,0 +1,107 @@
+"""
+Filesystem helpers.
+"""
+import glob
+import logging
+import os
+import shutil
+
+LOGGER = logging.getLogger(__name__)
+
+
+def save_image(filepath, frame):
+    """Save an image
+    Args:
+        filepath (str): Filepath to save image to
+        frame (numpy.ndarray): Image to save
+    """
+    import cv2
+    LOGGER.debug('Saving image to %s' % filepath)
+    cv2.imwrite(filepath, frame)
+    return
+
+
+def encode_image(frame, ext='.jpg'):
+    """Encode an image in memory
+
+    Args:
+        frame (numpy.ndarray): Image to encode
+        ext (str, optional): Image format extension. Defaults to '.jpg'
+
+    Returns:
+        bytes: Encoded image
+    """
+    import cv2
+    ok, buffer = cv2.imencode(ext, frame)
+    if not ok:
+        raise ValueError('Unable to encode image as {}'.format(ext))
+    return buffer.tobytes()
+
+def latest_file(path, ftype='*'):
+    """Return the last file created in a directory.
+
+    Args:
+        path (str): Path of the directory
+        ftype (str): Filetype to match. For example, supply '*.csv' to get the
+            latest csv, or 'Master*'' to get the latest filename starting with
+            'Master'. Defaults to '*' which matches all files.
+    Returns:
+        last_file (str): Last file created in the directory.
+    """
+    last_file = None
+    if not os.path.isdir(path):
+        LOGGER.error('Please supply a valid directory')
+        return None
+
+    if not path.endswith('/'):
+        path += '/'
+
+    list_of_files = glob.glob(path + ftype) # all filetypes
+    list_of_files = [f for f in list_of_files if os.path.isfile(f)]
+    if list_of_files:
+        last_file = max(list_of_files, key=os.path.getctime)
+    else:
+        LOGGER.error('No files in directory')
+
+    return last_file
+
+
+def search_path(path, filetypes=None):
+    """Recursively search a path, optionally matching specific filetypes, and
+    return all filenames.
+
+    Args:
+        path (str): Path to search
+        filetypes (list, optional): Filetypes to return
+
+    Returns:
+        files (list): List of files
+    """
+    files = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        if filetypes:
+            files.extend([os.path.join(dirpath, file) for file in filenames
+                          if file.endswith(tuple(filetypes))])
+        else:
+            files.extend([os.path.join(dirpath, file) for file in filenames])
+    return files
+
+
+def clean_dir(path, exclude=None):
+    """Clear folders and files in a specified path
+
+    Args:
+        path (str): Path to clean files/folders
+        exclude (list, optiona): Filenames to exclude from deletion
+    """
+    if not exclude:
+        exclude = []
+
+    for file in os.listdir(path):
+        full_path = os.path.join(path, file)
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path)
+            assert not os.path.isdir(full_path)
+        elif os.path.isfile(full_path) and file not in exclude:
+            os.remove(full_path)
+            assert not os.path.isfile(full_path)
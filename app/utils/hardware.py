@@ -0,0 +1,64 @@
+"""
+Hardware helpers for the pan-tilt hat and the SoC temperature sensor.
+pantilthat is imported on first use.
+"""
+import logging
+
+LOGGER = logging.getLogger(__name__)
+
+
+def _pantilthat():
+    import pantilthat
+    return pantilthat
+
+def get_tilt():
+    """Get the current tilt value
+
+    Returns:
+        int: Current tilt value
+    """
+    return _pantilthat().get_tilt()
+
+
+def get_pan():
+    """Get the current pan value
+
+    Returns:
+        int: Current pan value
+    """
+    return _pantilthat().get_pan()
+
+
+def pan(angle):
+    """Pan the camera
+
+    Args:
+        angle (int): Pan angle, between -90 and 90
+    """
+    _pantilthat().pan(angle)
+
+
+def tilt(angle):
+    """Tilt the camera
+
+    Args:
+        angle (int): Tilt angle, between -90 and 90
+    """
+    _pantilthat().tilt(angle)
+
+
+def measure_temp(path='/sys/class/thermal/thermal_zone0/temp'):
+    """Read the SoC temperature from sysfs
+
+    Args:
+        path (str, optional): sysfs file with the temperature in millidegrees
+
+    Returns:
+        float: Temperature in degrees celsius, None if it can't be read
+    """
+    try:
+        with open(path) as file_in:
+            return int(file_in.read().strip()) / 1000.0
+    except (OSError, ValueError):
+        LOGGER.warning('Unable to read temperature from %s', path)
+        return None
@@ -0,0 +1,185 @@
+"""
+Shared HTTP client for the Slack and S3 helpers. Calls go through one
+requests session per process, which keeps connections alive in a pool, so
+only the first call to a host pays for the TCP and TLS handshakes.
+
+Every call is timed per endpoint (i.e. 'slack chat.postMessage'), and the
+latency and error counts are logged every metrics_log_seconds.
+
+    http:
+      timeout: [3.05, 10] # connect, read seconds
+      pool_maxsize: 4
+      slack_url: https://slack.com/api/
+      s3_endpoint: null
+"""
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_config().get('http', {})
+
+TIMEOUT = tuple(CONF.get('timeout', (3.05, 10)))
+
+_SESSION = None
+_SESSION_PID = None
+_SESSION_LOCK = threading.Lock()
+
+
+def get_session():
+    """Get the process wide session, creating it on first use. A forked
+    child gets its own, so processes never share a pooled connection
+
+    Returns:
+        requests.Session: Session
+    """
+    global _SESSION, _SESSION_PID
+    if _SESSION is None or _SESSION_PID != os.getpid():
+        with _SESSION_LOCK:
+            if _SESSION is None or _SESSION_PID != os.getpid():
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=CONF.get('pool_connections', 4),
+                    pool_maxsize=CONF.get('pool_maxsize', 4))
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                _SESSION, _SESSION_PID = session, os.getpid()
+    return _SESSION
+
+
+class EndpointMetrics():
+    """Call count, errors and latency of an endpoint"""
+
+    def __init__(self, history=100):
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.recent = collections.deque(maxlen=history)
+
+    def record(self, seconds, error=False):
+        self.calls += 1
+        self.errors += bool(error)
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        """Returns:
+            dict: calls, errors, and mean, p50, p95 and max milliseconds. The
+            percentiles are over the last calls
+        """
+        recent = sorted(self.recent)
+
+        def percentile(fraction):
+            if not recent:
+                return 0.0
+            return recent[min(len(recent) - 1, int(fraction * len(recent)))]
+
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'mean_ms': self.total_seconds * 1000 / max(1, self.calls),
+            'p50_ms': percentile(0.5) * 1000,
+            'p95_ms': percentile(0.95) * 1000,
+            'max_ms': self.max_seconds * 1000,
+        }
+
+
+_METRICS = collections.defaultdict(EndpointMetrics)
+_METRICS_LOCK = threading.Lock()
+_METRICS_LOGGED = [time.monotonic()]
+
+
+def record(endpoint, seconds, error=False):
+    """Record a call to an endpoint
+
+    Args:
+        endpoint (str): Endpoint name, i.e. 'slack files.upload'
+        seconds (float): Latency of the call
+        error (bool, optional): Whether the call failed
+    """
+    with _METRICS_LOCK:
+        _METRICS[endpoint].record(seconds, error)
+        now = time.monotonic()
+        log_seconds = CONF.get('metrics_log_seconds', 600)
+        if not log_seconds or now - _METRICS_LOGGED[0] < log_seconds:
+            return
+        _METRICS_LOGGED[0] = now
+    LOGGER.info('HTTP endpoints:\n%s', format_metrics())
+
+
+def metrics():
+    """Returns:
+        dict: Endpoint -> summary, see EndpointMetrics.summary
+    """
+    with _METRICS_LOCK:
+        return {endpoint: stats.summary()
+                for endpoint, stats in sorted(_METRICS.items())}
+
+
+def format_metrics():
+    """Returns:
+        str: Table of the endpoint metrics
+    """
+    lines = ['{:<28} {:>6} {:>6} {:>8} {:>8} {:>8}'.format(
+        'endpoint', 'calls', 'errors', 'p50 ms', 'p95 ms', 'max ms')]
+    for endpoint, summary in metrics().items():
+        lines.append('{:<28} {calls:>6} {errors:>6} {p50_ms:>8.0f} '
+                     '{p95_ms:>8.0f} {max_ms:>8.0f}'.format(endpoint,
+                                                            **summary))
+    return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def timed(endpoint):
+    """Time the calls made in the block, counting exceptions as errors
+
+    Args:
+        endpoint (str): Endpoint name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        record(endpoint, time.perf_counter() - start, error=True)
+        raise
+    record(endpoint, time.perf_counter() - start)
+
+
+def request(method, url, endpoint=None, **kwargs):
+    """Make a request on the shared session, with the configured timeout
+
+    Args:
+        method (str): HTTP method
+        url (str): URL
+        endpoint (str, optional): Endpoint name for the metrics, defaults to
+            the url
+        **kwargs: requests arguments
+
+    Returns:
+        requests.Response: Response. Status codes of 400 and above count as
+            errors
+    """
+    kwargs.setdefault('timeout', TIMEOUT)
+    endpoint = endpoint or url
+    start = time.perf_counter()
+    try:
+        response = get_session().request(method, url, **kwargs)
+    except Exception:
+        record(endpoint, time.perf_counter() - start, error=True)
+        raise
+    record(endpoint, time.perf_counter() - start,
+           error=response.status_code >= 400)
+    return response
@@ -0,0 +1,94 @@
+"""
+Helpers to spawn, check and stop python processes.
+"""
+import logging
+import os
+import subprocess
+import sys
+
+import psutil
+
+LOGGER = logging.getLogger(__name__)
+
+
+def spawn_python_process(fname):
+    """Spawn a python process.
+
+    Args:
+        fname (str): Name of the python job to start
+
+    Returns:
+        pid (int): process identification number of spawned process
+    """
+    pid = None
+    try:
+        LOGGER.info('Spawning python job %s', fname)
+        process = subprocess.Popen(
+            [sys.executable, fname],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT
+            )
+        pid = process.pid
+        LOGGER.info('Process succesfully spawned: %s', pid)
+    except Exception as exc:
+        LOGGER.error('Unable to spawn process due to error: \n %s', str(exc))
+    return pid
+
+
+def kill_python_process(pid, timeout=10):
+    """Stop a running python process, first with SIGTERM so it can clean up,
+    then with SIGKILL if it hasn't exited within <timeout> seconds.
+
+    Args:
+        pid (int): process identification number of process to kill
+        timeout (float, optional): Seconds to wait for the process to exit
+            after each signal
+
+    Returns:
+        killed (bool): True if process was killed, otherwise False.
+    """
+    killed = False
+    LOGGER.info('Attempting to kill %s', pid)
+    try:
+        if check_process(pid):
+            proc = psutil.Process(pid)
+            LOGGER.info('Terminating pid: %s', pid)
+            proc.terminate()
+            gone, alive = psutil.wait_procs([proc], timeout=timeout)
+            if alive:
+                LOGGER.warning('Process %s ignored SIGTERM, killing it', pid)
+                proc.kill()
+                gone, alive = psutil.wait_procs([proc], timeout=timeout)
+            if not alive:
+                LOGGER.info('Successfully killed process')
+                killed = True
+        else:
+            killed = True
+    except psutil.NoSuchProcess:
+        killed = True
+    except Exception as exc:
+        LOGGER.error('Unable to kill process due to error %s', str(exc))
+
+    return killed
+
+
+def check_process(pid):
+    """Check if process is running.
+    Args:
+        pid (int): process identification number of process to check
+    Returns:
+        (bool): True if process is running, otherwise False
+    """
+    LOGGER.info('Checking if %s is running', pid)
+    try:
+        os.kill(pid, 0)
+        proc = psutil.Process(pid)
+        if proc.status() == psutil.STATUS_ZOMBIE:
+            status = False
+        else:
+            LOGGER.info('Process %s is running', pid)
+            status = True
+    except OSError:
+        status = False
+
+    return status
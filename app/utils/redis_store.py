@@ -0,0 +1,71 @@
+"""
+Redis helpers. The connection is created on first use.
+"""
+import ast
+import logging
+import threading
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+LOGGER = logging.getLogger(__name__)
+
+_REDIS_CONN = None
+_REDIS_LOCK = threading.Lock()
+
+
+def get_redis():
+    """Get the shared redis connection, creating it on first use
+
+    Returns:
+        redis.StrictRedis: Redis connection
+    """
+    global _REDIS_CONN
+    if _REDIS_CONN is None:
+        with _REDIS_LOCK:
+            if _REDIS_CONN is None:
+                import redis
+                settings = config.load_config().get('redis', {})
+                _REDIS_CONN = redis.StrictRedis(
+                    host=settings.get('host', 'localhost'),
+                    port=settings.get('port', 6379),
+                    db=settings.get('db', 0),
+                    encoding="utf-8",
+                    decode_responses=True
+                )
+    return _REDIS_CONN
+
+def redis_get(key):
+    """Fetch a key from redis
+
+    Args:
+        key (str): Key to fetch
+
+    Returns:
+        Value associated with redis key
+    """
+    str_obj = get_redis().get(key)
+
+    # Need to research a better way of parsing underlying Python object types
+    # from strings redis returns..
+    try:
+        value = ast.literal_eval(str_obj)
+    except ValueError:
+        value = str_obj
+    except SyntaxError:
+        value = str_obj
+    return value
+
+
+def redis_set(key, value):
+    """Summary
+
+    Args:
+        key (str): Redis key name
+        value (): Value to be associated with key. Stored as its str, which
+            redis_get parses back
+    """
+    # redis-py 3 refuses bools, dicts... instead of storing their str
+    get_redis().set(key, value if isinstance(value, bytes) else str(value))
@@ -0,0 +1,62 @@
+"""
+S3 helpers. boto3 is imported, and the S3 client created, on first use. The
+client is thread safe and keeps its connections alive in a pool, with the
+timeouts and endpoint of the http settings (see utils.http).
+"""
+import contextlib
+import logging
+import threading
+
+from . import http
+
+LOGGER = logging.getLogger(__name__)
+
+_S3 = None
+_S3_LOCK = threading.Lock()
+
+
+def get_s3():
+    """Get the shared S3 client, creating it on first use
+
+    Returns:
+        botocore.client.S3: S3 client
+    """
+    global _S3
+    if _S3 is None:
+        with _S3_LOCK:
+            if _S3 is None:
+                import boto3
+                from botocore.config import Config
+
+                connect_timeout, read_timeout = http.TIMEOUT
+                _S3 = boto3.session.Session().client(
+                    's3', endpoint_url=http.CONF.get('s3_endpoint'),
+                    config=Config(
+                        connect_timeout=connect_timeout,
+                        read_timeout=read_timeout,
+                        max_pool_connections=http.CONF.get('pool_maxsize', 4),
+                        retries={'max_attempts': http.CONF.get(
+                            's3_max_attempts', 3)}))
+    return _S3
+
+
+def upload_to_s3(s3_bucket, local, key, data=None):
+    """Upload a file to S3.
+
+    Args:
+        s3_bucket (str): Name of the S3 bucket.
+        local (str): Path of the file to upload
+        key (str): S3 key
+        data (bytes or file, optional): Contents to upload instead of
+            reading local
+    """
+    LOGGER.info("Attempting to load %s to s3 bucket: s3://%s, key: %s", local,
+                s3_bucket, key)
+    with contextlib.ExitStack() as stack:
+        if data is None:
+            # pass the open file, so boto streams it instead of holding it
+            # in memory
+            data = stack.enter_context(open(local, 'rb'))
+        with http.timed('s3 put_object'):
+            get_s3().put_object(Bucket=s3_bucket, Key=key, Body=data,
+                                ServerSideEncryption='AES256')
@@ -0,0 +1,261 @@
+"""
+Slack helpers. Web API calls are made on the shared keep-alive session of
+utils.http, so alerts don't pay for a TLS handshake per call.
+"""
+import json
+import logging
+import os
+import threading
+
+try:
+    from app import config
+except ImportError:
+    import config
+
+from . import http
+
+LOGGER = logging.getLogger(__name__)
+CONF = config.load_private_config()
+SLACK_BOT_TOKEN = CONF['rpi_cam_app']['bot_token']
+SLACK_URL = http.CONF.get('slack_url', 'https://slack.com/api/')
+
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+
+
+class SlackClient():
+    """Slack Web API client, with the api_call interface of slackclient"""
+
+    def __init__(self, token, url=SLACK_URL):
+        self.token = token
+        self.url = url.rstrip('/') + '/'
+
+    def api_call(self, method, **kwargs):
+        """Call a Web API method
+
+        Args:
+            method (str): API method, i.e. chat.postMessage
+            **kwargs: Method arguments. Lists and dicts (i.e. attachments)
+                are sent as JSON, and file as a multipart upload
+
+        Returns:
+            dict: Slack response object, with the HTTP response headers
+                under 'headers'. Connection errors are returned as
+                {'ok': False, 'error': ...} like API errors
+        """
+        data = {'token': self.token}
+        files = None
+        for key, value in kwargs.items():
+            if value is None:
+                continue
+            if key == 'file' and not isinstance(value, str):
+                files = {'file': value}
+            elif isinstance(value, (list, dict)):
+                data[key] = json.dumps(value)
+            else:
+                data[key] = value
+
+        try:
+            response = http.request(
+                'POST', self.url + method, endpoint='slack ' + method,
+                data=data, files=files)
+            result = response.json()
+        except Exception as err:
+            LOGGER.warning('Slack %s failed: %r', method, err)
+            return {'ok': False, 'error': repr(err), 'headers': {}}
+        result['headers'] = dict(response.headers)
+        return result
+
+
+def get_client(token=SLACK_BOT_TOKEN):
+    """Get the SlackClient for a token, creating it on first use
+
+    Args:
+        token (str, optional): Slack token. Defaults to bot_token specified
+            in private.yml
+
+    Returns:
+        SlackClient: Slack client
+    """
+    client = _CLIENTS.get(token)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(token)
+            if client is None:
+                client = _CLIENTS[token] = SlackClient(token)
+    return client
+
+
+def slack_api_call(method, token=SLACK_BOT_TOKEN, **kwargs):
+    """Call a Slack Web API method
+
+    Args:
+        method (str): API method, i.e. chat.postMessage
+        token (str, optional): Token to use with SlackClient. Defaults to
+            bot_token specified in private.yml
+        **kwargs: Method arguments
+
+    Returns:
+        dict: Slack response object, with the HTTP response headers under
+            'headers', i.e. Retry-After when rate limited
+    """
+    return get_client(token).api_call(method, **kwargs)
+
+
+def validate_slack(token):
+    """Verify the request is coming from Slack by checking that the
+    verification token in the request matches our app's settings
+
+    Args:
+        token (str): Slack token
+
+    Returns:
+        bool: Indicate whether token received matches known verification token
+    """
+    if CONF['rpi_cam_app']['verification_token'] != token:
+        return False
+    return True
+
+
+def parse_slash_post(form):
+    """Parses the Slack slash command data
+
+    Args:
+        form (ImmutableMultiDict): Info from the POST request, as an IMD object.
+
+    Returns :
+        data (dict): dictionary representation of the IMD if request was
+            verified. Otherwise, returns False
+    """
+    raw_dict = form.to_dict(flat=False)
+    data = {k:v[0] for k, v in raw_dict.items()}
+    return data
+
+
+def slack_post_interactive(response):
+    """Ingest the picture upload response and add a follow up message with
+    buttons to tag the image
+
+    Args:
+        response (dict): Slack response from the image upload
+    """
+    if response['ok']:
+        file_id = response['file']['id']
+        filename = response['file']['title']
+        slack_client = get_client()
+        response = slack_client.api_call(
+            "chat.postMessage",
+            as_user=True,
+            channel=CONF['alerts_channel'],
+            text='Tag Image {}'.format(filename),
+            attachments= [{
+                    "text": "How should this image be tagged",
+                    "callback_id": "tag_image",
+                    "color": "#3AA3E3",
+                    "attachment_type": "default",
+                    'actions': [
+                        {
+                            "name": "occupied",
+                            "text": "Occupied",
+                            "type": "button",
+                            "style": "primary",
+                            "value": str({
+                                'occupied': True,
+                                'file_id': file_id,
+                                'filename': filename
+                            })
+                        },
+                        {
+                            "name": "unoccupied",
+                            "text": "Unoccupied",
+                            "type": "button",
+                            "style": "danger",
+                            "value": str({
+                                'occupied': False,
+                                'file_id': file_id,
+                                'filename': filename
+                            })
+                        }
+                    ]
+                }]
+            )
+    else:
+        LOGGER.error('Failed image upload %s', response)
+
+
+def slack_delete_file(file_id):
+    """Delete a file in slack
+
+    Args:
+        file_id (str): File to delete
+
+    Returns:
+        dict: Slack response object
+    """
+    slack_client = get_client(CONF['rpi_cam_app']['oauth_token'])
+    response = slack_client.api_call(
+        'files.delete',
+        file=file_id
+    )
+    return response
+
+
+def slack_post(message, channel=CONF['alerts_channel'],
+               token=SLACK_BOT_TOKEN):
+    """Post a message to a channel
+
+    Args:
+        message (str): Message to post
+        channel (str): Channel id. Defaults to alerts_channel specified in
+            private.yml
+        token (str): Token to use with SlackClient. Defaults to bot_token
+            specified in private.yml
+    """
+    LOGGER.debug("Posting to slack")
+    slack_client = get_client(token)
+    response = slack_client.api_call(
+        "chat.postMessage",
+        as_user=True,
+        channel=channel,
+        text=message
+        )
+    if response['ok']:
+        LOGGER.info('Posted succesfully')
+    else:
+        LOGGER.error('Unable to post, response: %s', response)
+
+    return
+
+
+def slack_upload(fname, title=None, channel=CONF['alerts_channel'],
+                 token=SLACK_BOT_TOKEN, data=None):
+    """Upload a file to a channel
+
+    Args:
+        fname (str): Filepath, or just the filename if data is provided
+        title (str, optional): Title of the file. Defaults to fname
+        channel (str): Channel id. Defaults to alerts_channel specified in
+            private.yml
+        token (str): Token to use with SlackClient. Defaults to bot_token
+            specified in private.yml
+        data (bytes, optional): File contents to upload from memory instead
+            of reading fname
+
+    Returns:
+        dict: Slack response object
+    """
+    if title is None:
+        title = os.path.basename(fname)
+    slack_client = get_client(token)
+    if data is None:
+        with open(fname, 'rb') as file_in:
+            data = file_in.read()
+    response = slack_client.api_call(
+        "files.upload",
+        channels=channel,
+        filename=os.path.basename(fname),
+        file=data,
+        title=title
+        )
+
+    return response
@@ -1,23 +1,35 @@
 """
 Flask views module
 """
+import ast
 import time
 import json
 import os
-import subprocess
 import logging
+import threading
 from functools import wraps
 
-from flask import request, make_response, render_template, Response, jsonify
-import pantilthat
+from flask import (request, make_response, render_template, Response, jsonify,
+                   stream_with_context)
 
 from app import application as app
 from app import config
 from app import utils
+from app import log_tail
+from app import system_stats
+from app import event_store
+from app import storage
+from app import arming
+from app import frame_bus
+from app import camera_watchdog
 
 logging.basicConfig(level=logging.DEBUG)
 LOGGER = logging.getLogger(__name__)
 CONF = config.load_private_config()
+STATS = system_stats.get_sampler()
+
+# Seconds after which a frame bus snapshot is too old to be the current frame
+FRAME_MAX_AGE = 5
 
 def slack_verification(user=None):
     """Verify post request came from Slack by checking the token sent with the
@@ -48,8 +60,8 @@ def initialize():
     """
     # set redis variables
     LOGGER.info('Initializing camera redis variables')
-    pantilthat.pan(40)
-    pantilthat.tilt(10)
+    utils.pan(40)
+    utils.tilt(10)
     utils.redis_set('home', False)
     utils.redis_set('auto_detect_status', True)
     utils.redis_set('camera_status', True)
@@ -61,12 +73,12 @@ def initialize():
 @app.route('/top', methods=["GET", "POST"])
 @slack_verification()
 def top():
-    with open('top.log', 'w') as outfile:
-        subprocess.call("top -n1 -b -c", shell=True, stdout=outfile)
+    """Get the latest cpu, memory and process stats
 
-    with open('top.log', 'r') as f:
-        contents = "".join([next(f) for x in range(20)])
-    return contents
+    Returns:
+        str: Response to slack
+    """
+    return system_stats.format_top(STATS.latest())
 
 @app.route('/status', methods=["GET", "POST"])
 @slack_verification()
@@ -78,22 +90,47 @@ def status():
     """
     summary = """**PI SUMMARY**:
     pi_temperature: {}
+    pi_temperature_10min: {}
+    cpu_percent: {}
     camera_position: Panned to {}. Tilted to {}
     camera_status: {}
+    detector: {}
+    camera_health: {}
     camera_notifications: {}
+    arming_profile: {}
     auto_detect_status: {}
     home: {}
     """
+    latest = STATS.latest()
+    temp_trend = STATS.trend('temperature', 600)
+    if temp_trend:
+        temp_trend = 'min {min:.1f}, mean {mean:.1f}, max {max:.1f}'.format(
+            **temp_trend)
     return summary.format(
-        utils.measure_temp(),
+        latest['temperature'],
+        temp_trend,
+        latest['cpu_percent'],
         utils.get_pan(),
         utils.get_tilt(),
         utils.redis_get('camera_status'),
+        detector_status(),
+        camera_watchdog.health_status(utils.redis_get('camera_health')),
         utils.redis_get('camera_notifications'),
+        arming.selected_profile(),
         utils.redis_get('auto_detect_status'),
         utils.redis_get('home')
     )
 
+def detector_status():
+    """Returns:
+        str: Frame rate and decision state of the security system
+    """
+    snapshot = frame_bus.read_snapshot(max_age=FRAME_MAX_AGE)
+    if snapshot is None:
+        return 'not running'
+    return '{:.1f} fps, {} (score {:.2f})'.format(
+        snapshot.fps, snapshot.state, snapshot.score)
+
 @app.route('/interactive', methods=["POST"])
 def interactive():
     """This function is triggered after one of the buttons is clicked in slack
@@ -105,18 +142,63 @@ def interactive():
     data = utils.parse_slash_post(request.form)
 
     payload = json.loads((data['payload']))
+    # interactive payloads carry the verification token in the payload
+    if not utils.validate_slack(payload.get('token')):
+        return 'Un-authenticated'
     action = payload['actions'][0]
-    action_value = eval(action['value'])
+    # the button values are the str of a dict, see alerts.py
+    try:
+        action_value = ast.literal_eval(action['value'])
+    except (ValueError, SyntaxError):
+        return 'Invalid action', 400
     tag = action_value['occupied']
-    img_filename = action_value['filename']
 
-    # Save an empty file with the logged tag
-    filename = "{}_{}.txt".format(tag, img_filename.replace('.jpg', ''))
-    filepath = os.path.join(config.TRAIN_DIR, filename)
-    open(filepath, 'w').close()
+    # Buttons are posted per alert episode, or per image for older alerts
+    if 'episode' in action_value:
+        name = action_value['episode']
+        samples = action_value['samples']
+        file_ids = action_value['file_ids']
+    else:
+        name = action_value['filename']
+        samples = [name.replace('.jpg', '')]
+        file_ids = [action_value['file_id']]
+
+    # the tag and samples become filenames in the samples directory
+    if not isinstance(tag, bool) or any(
+            not isinstance(sample, str) or os.sep in sample or '/' in sample
+            or sample.startswith('.') for sample in samples):
+        return 'Invalid action', 400
+
+    events = event_store.get_store()
+    for sample in samples:
+        # Save an empty file with the logged tag
+        filename = "{}_{}.txt".format(tag, sample)
+        storage.get_storage().write_bytes('samples', filename, b'')
+        events.record_tag(sample, tag)
+
+    for file_id in file_ids:
+        utils.slack_delete_file(file_id)
+        events.record_slack_file_deleted(file_id)
+    return 'Response for {} logged'.format(name)
+
+@app.route('/alert_stats', methods=["GET", "POST"])
+@slack_verification()
+def alert_stats():
+    """Summarize the alerts of the last week: how many are still untagged and
+    the false positive rate by hour of the day
 
-    utils.slack_delete_file(action_value['file_id'])
-    return 'Response for {} logged'.format(img_filename)
+    Returns:
+        str: Response to slack
+    """
+    events = event_store.get_store()
+    since = time.time() - 7*24*60*60
+    lines = ['**ALERTS (LAST 7 DAYS)**:',
+             'untagged: {}'.format(len(events.untagged_alerts(since))),
+             'false positive rate by hour:']
+    for row in events.false_positive_rate_per_hour(since):
+        lines.append('    {}:00  {:.0%} of {}'.format(
+            row['hour'], row['rate'], row['tagged']))
+    return '\n'.join(lines)
 
 @app.route('/pycam_on', methods=["POST"])
 @slack_verification(CONF['ian_uid'])
@@ -193,6 +275,28 @@ def notifications_on():
     utils.redis_set('camera_notifications', True)
     return "Notications have been enable"
 
+@app.route('/arming', methods=["POST"])
+@slack_verification(CONF['ian_uid'])
+def arming_profile():
+    """Switch the arming profile, i.e. `/arming away`. Without a profile,
+    list the available ones
+
+    Returns:
+        str: Response to slack
+    """
+    data = utils.parse_slash_post(request.form)
+    profile = data.get('text', '').strip()
+    profiles = arming.profile_names()
+    current = arming.selected_profile()
+    if not profile:
+        return 'Arming profile is {}. Available profiles: {}'.format(
+            current, ', '.join(profiles))
+    if profile not in profiles:
+        return 'Unknown profile {}. Available profiles: {}'.format(
+            profile, ', '.join(profiles))
+    utils.redis_set('arming_profile', profile)
+    return 'Switched arming profile from {} to {}'.format(current, profile)
+
 
 @app.route('/rotate', methods=["POST"])
 @slack_verification(CONF['ian_uid'])
@@ -220,8 +324,8 @@ def rotate():
         utils.redis_set('camera_status', False)
         time.sleep(1)
 
-    pantilthat.pan(pan)
-    pantilthat.tilt(tilt)
+    utils.pan(pan)
+    utils.tilt(tilt)
 
     if curr_status:
         utils.redis_set('camera_status', True)
@@ -250,6 +354,13 @@ def last_image():
         str: Response to slack
     """
     data = utils.parse_slash_post(request.form)
+    snapshot = frame_bus.read_snapshot(max_age=FRAME_MAX_AGE)
+    if snapshot is not None:
+        utils.slack_upload('latest.jpg', channel=data['channel_id'],
+                           data=utils.encode_image(snapshot.frame))
+        return 'Latest image uploaded'
+
+    # The camera is off, fall back to the last saved image
     latest_image = os.path.join(config.IMG_DIR, 'latest.jpg')
     utils.slack_upload(latest_image, channel=data['channel_id'])
     return 'Latest image uploaded'
@@ -293,34 +404,94 @@ def hears():
 def logz():
     return render_template('logz.html')
 
-def tail(filepath, num_lines="20"):
-    """"""
-    proc = subprocess.Popen(
-        ['tail', '-n', num_lines, filepath], stdout=subprocess.PIPE)
-    return proc.stdout.read()
+LOG_PATH = '/home/pi/rpi-security-system/app/logs/'
+LOG_FILES = {
+    'glances': '/tmp/glances-pi.log',
+    'flask_app': LOG_PATH + 'app.log',
+    'flask_access': LOG_PATH + 'access.log',
+    'security_system': LOG_PATH + 'security_system.log',
+    's3_upload': LOG_PATH + 's3_upload.log',
+}
+
+# Close event streams periodically so a gunicorn worker thread is never held
+# forever by an abandoned browser tab. EventSource reconnects automatically.
+LOG_STREAM_MAX_SECONDS = 300
+# Each stream holds a gunicorn worker thread, so only a few of the threads
+# (see gunicorn.conf) stream logs and the rest stay free for the slack
+# commands, which time out after 3s. /logz uses a single stream
+LOG_STREAM_MAX_CLIENTS = 2
+LOG_STREAM_SLOTS = threading.BoundedSemaphore(LOG_STREAM_MAX_CLIENTS)
 
 @app.route('/glances_logstream')
 def glances_logstream():
-    return Response(tail('/tmp/glances-pi.log', '50'),  mimetype='text/plain')
-
-LOG_PATH = '/home/pi/rpi-security-system/app/logs/'
+    contents = log_tail.tail(LOG_FILES['glances'], 50)
+    return Response(contents,  mimetype='text/plain')
 
 @app.route('/flask_app_logstream')
 def flask_app_logstream():
-    contents = tail(LOG_PATH + 'app.log', '50')
+    contents = log_tail.tail(LOG_FILES['flask_app'], 50)
     return Response(contents,  mimetype='text/plain')
 
 @app.route('/flask_access_logstream')
 def flask_access_logstream():
-    contents = tail(LOG_PATH + 'access.log', '50')
+    contents = log_tail.tail(LOG_FILES['flask_access'], 50)
     return Response(contents,  mimetype='text/plain')
 
 @app.route('/security_system_logstream')
 def security_system_logstream():
-    contents = tail(LOG_PATH + 'security_system.log', '50')
+    contents = log_tail.tail(LOG_FILES['security_system'], 50)
     return Response(contents,  mimetype='text/plain')
 
 @app.route('/s3_upload_logstream')
 def s3_upload_logstream():
-    contents = tail(LOG_PATH + 's3_upload.log', '50')
+    contents = log_tail.tail(LOG_FILES['s3_upload'], 50)
     return Response(contents,  mimetype='text/plain')
+
+@app.route('/logstream')
+@app.route('/logstream/<name>')
+def logstream(name=None):
+    """Push new log lines to the browser as server-sent events. The lines of
+    each log are sent as events named after it
+
+    Args:
+        name (str, optional): Key of the log file in LOG_FILES. Defaults to
+            None, which streams every log
+
+    Returns:
+        Response: text/event-stream response following the log files, 503
+            if LOG_STREAM_MAX_CLIENTS streams are open already
+    """
+    if name is None:
+        log_files = LOG_FILES
+    elif name in LOG_FILES:
+        log_files = {name: LOG_FILES[name]}
+    else:
+        return make_response('Unknown log {}'.format(name), 404)
+
+    if not LOG_STREAM_SLOTS.acquire(blocking=False):
+        return make_response('Too many log streams open', 503,
+                             {'Retry-After': '30'})
+
+    def events():
+        partial = {log_name: b'' for log_name in log_files}
+        for log_name, chunk in log_tail.follow_many(
+                log_files, num_lines=50, max_seconds=LOG_STREAM_MAX_SECONDS):
+            if not chunk:
+                yield ': keepalive\n\n'
+                continue
+
+            # only send complete lines, hold on to the rest for next time
+            lines = (partial[log_name] + chunk).split(b'\n')
+            partial[log_name] = lines.pop()
+            if lines:
+                payload = ''.join(
+                    'data: {}\n'.format(line.decode('utf-8', 'replace'))
+                    for line in lines)
+                yield 'event: {}\n{}\n'.format(log_name, payload)
+
+    response = Response(stream_with_context(events()),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+    # released once the stream ends or the client goes away
+    response.call_on_close(LOG_STREAM_SLOTS.release)
+    return response
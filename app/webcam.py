@@ -1,134 +1,266 @@
+"""
+Interactive debugger for the motion detection pipeline. Runs the frames of a
+webcam, a video file or a training sample pickle through the production
+MotionDetector and MotionModel, and shows a 2x2 grid of the frame with its
+motion boxes, the background average, the thresholded delta and the
+classification with the time spent in each stage.
+
+The detection parameters are trackbars, so they can be tuned for accuracy
+and cpu cost on live or recorded input. Press q to quit, p to pause and s to
+print the current parameters as config.yml settings.
+
+    python3 webcam.py --source 0
+    python3 webcam.py --source train-data/occupied_<ts>.pkl --loop
+"""
+import argparse
+import pickle
 import time
+from collections import OrderedDict
 
-
-import numpy as np
-import imutils
 import cv2
+import numpy as np
 
-
+import config
 from model import MotionModel
+from security_system import MotionDetector
 
+CONF = config.load_config()
 
-model = MotionModel()
-
-cap = cv2.VideoCapture(0)
+WINDOW = 'motion debugger'
+TEXT_COLOR = (0, 0, 255)
+BOX_COLOR = (0, 255, 0)
 
-time.sleep(5)
+# Trackbar -> (maximum, detector/model attribute, to attribute value,
+# from attribute value)
+PARAMETERS = OrderedDict([
+    ('alpha x1000', (500, 'alpha', lambda v: v / 1000,
+                     lambda a: int(a * 1000))),
+    ('delta_thresh', (100, 'delta_thresh', int, int)),
+    ('dilate_iterations', (10, 'dilate_iterations', int, int)),
+    ('ksize', (51, 'ksize', lambda v: (v | 1, v | 1), lambda a: a[0])),
+    ('min_area', (20000, 'min_area', int, int)),
+])
 
 
-
-def compare_frame(frame, avg):
-    """Compare the latest frame to the background image
-
-    1) Take the difference between the background average and the latest frame
-    2) Threshold it
-    3) Dilute it
-    4) Find contours and return metadata about them (area and coordinates)
+def read_frames(source, loop=False):
+    """Yield BGR frames from a camera index, a video file or a pickle saved
+    by SecuritySystem.save_pickle
 
     Args:
-        frame (numpy.ndarray): Blurred, grayscale frame
-        avg (numpy.ndarray): Running average of the images
-
-    Returns:
-        tuple: (List of metadata for delta areas, delta frame)
-    """
+        source (str): Camera index, video path or pickle path
+        loop (bool, optional): Replay recorded input forever
 
-
-    frame_delta = cv2.absdiff(frame, cv2.convertScaleAbs(avg))
-
-    # threshold the delta image, dilate the thresholded image to fill
-    # in holes, then find contours on thresholded image
-    thresh = cv2.threshold(frame_delta, 5, 255, cv2.THRESH_BINARY)[1]
-    thresh = cv2.dilate(thresh, None, iterations=2)
-    contours = cv2.findContours(thresh.copy(), cv2.RETR_EXTERNAL,
-                                cv2.CHAIN_APPROX_SIMPLE)
-    contours = contours[1]
-
-    contours_meta = []
-
-    # loop over the contours
-    for contour in contours:
-        meta = {}
-        meta['coords'] = cv2.boundingRect(contour)
-        meta['size'] = cv2.contourArea(contour)
-        contours_meta.append(meta)
-    return contours_meta, thresh
-
-
-def make_grid(avg, frame, dilated, contour_check, person_prob):
-    """Make a grid to show all the different images
+    Yields:
+        numpy.ndarray: BGR frame
     """
-    avg_rgb = cv2.cvtColor(cv2.convertScaleAbs(avg), cv2.COLOR_GRAY2RGB)
-    cv2.putText(avg_rgb, 'Background Avg', (0, 20),
-                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-    dilated_rgb = cv2.cvtColor(dilated, cv2.COLOR_GRAY2RGB)
-    cv2.putText(dilated_rgb, 'Dilated & Thresholded Difference', (0, 20),
-            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-
-    if contour_check:
-        text = "Motion detected!"
-    else:
-        text = "Difference from background image is too small."
-    with_classification = np.zeros((frame.shape[0], frame.shape[1], 3), np.uint8)
-    cv2.putText(with_classification, text, (0, 20),
-            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 0, 255), 2)
-
-    grid_top = np.concatenate((frame, avg_rgb), axis=1)
-    grid_bottom = np.concatenate((dilated_rgb, with_classification), axis=1)
-    grid = np.concatenate((grid_top, grid_bottom), axis=0)
-    return grid
-
-avg = None
-
-while(True):
-    ret, frame = cap.read()
-
-    frame = imutils.resize(frame, width=500)
-
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-    gray_blur = cv2.GaussianBlur(gray, (21, 21), 0)
-
-    if avg is None:
-        print("Starting background model...")
-        avg = gray_blur.copy().astype("float")
-        continue
-
-    # toggle alpha to how quickly the background average is updated
-    # higher alpha = quicker updates to the background image
-    cv2.accumulateWeighted(gray_blur, avg, 0.075)
-
-    # difference between blurred frame and background avg
-    delta = cv2.absdiff(gray_blur, cv2.convertScaleAbs(avg))
-
-    # thresholded difference
-    thresholded = cv2.threshold(delta, 5, 255, cv2.THRESH_BINARY)[1]
-
-    # dilated difference (close the gaps)
-    dilated = cv2.dilate(thresholded.copy(), None, iterations=2)
-
-    image, contours, hierarchy = cv2.findContours(
-        dilated.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    
-    contours_meta, _ = compare_frame(gray_blur, avg)
-    contour_check = model.check_contours(contours_meta)
-    person_prob = 0
-
-    # Only run the model if there is a significant difference between the 
-    # current frame and background frame
-    if contour_check:
-        person_prob = model.get_person_prob(frame)
-
-    grid = make_grid(avg, frame, dilated, contour_check, person_prob)
-
-    cv2.imshow('all', grid)
-
-
-    k = cv2.waitKey(1) & 0xff
-    if k == ord('q'):
-        break
-
-
-cap.release()
-cv2.destroyAllWindows()
\ No newline at end of file
+    if source.endswith('.pkl'):
+        with open(source, 'rb') as file_in:
+            frames = pickle.load(file_in)['frames']
+        while True:
+            for frame in frames:
+                yield frame
+            if not loop:
+                return
+
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                if loop and not source.isdigit():
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                return
+            yield frame
+    finally:
+        capture.release()
+
+
+class Debugger():
+
+    def __init__(self, conf=None, person=False):
+        """Initialize the Debugger class
+
+        Args:
+            conf (dict, optional): Settings to use instead of config.yml
+            person (bool, optional): Also run the person detector on frames
+                with motion
+        """
+        conf = conf or CONF
+        self.detector = MotionDetector(conf)
+        self.model = MotionModel(conf)
+        self.person = person
+        self.canvas = None
+        self.small = None
+        # stage -> exponential moving average of its milliseconds
+        self.timings = OrderedDict()
+
+    def create_trackbars(self):
+        cv2.namedWindow(WINDOW)
+        for name, (maximum, attr, _, from_attr) in PARAMETERS.items():
+            cv2.createTrackbar(name, WINDOW, from_attr(self.attribute(attr)),
+                               maximum, lambda _: None)
+
+    def attribute(self, attr):
+        target = self.model if attr == 'min_area' else self.detector
+        return getattr(target, attr)
+
+    def read_trackbars(self):
+        for name, (_, attr, to_attr, _) in PARAMETERS.items():
+            value = to_attr(cv2.getTrackbarPos(name, WINDOW))
+            if attr == 'min_area':
+                if value != self.model.min_area:
+                    self.model.min_area = value
+                    self.model.set_sensitivity()
+            else:
+                setattr(self.detector, attr, value)
+
+    def time_stage(self, stage, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = (time.perf_counter() - start) * 1000
+        previous = self.timings.get(stage, elapsed)
+        self.timings[stage] = 0.9 * previous + 0.1 * elapsed
+        return result
+
+    def allocate(self, gray):
+        """Allocate the grid canvas once the processed frame size is known"""
+        height, width = gray.shape[:2]
+        if self.canvas is None or self.canvas.shape[:2] != (2 * height,
+                                                             2 * width):
+            self.canvas = np.zeros((2 * height, 2 * width, 3), np.uint8)
+            self.small = np.zeros((height, width, 3), np.uint8)
+
+    def process(self, frame):
+        """Run a frame through the pipeline and render the grid
+
+        Args:
+            frame (numpy.ndarray): BGR frame
+
+        Returns:
+            numpy.ndarray: Grid canvas, None while the background model
+                starts
+        """
+        detector = self.detector
+        gray = self.time_stage('gray & blur', detector.process_frame, frame)
+        if detector.avg is None or detector.avg.shape != gray.shape:
+            detector.avg = gray.astype('float')
+            return None
+
+        self.time_stage('accumulate', cv2.accumulateWeighted, gray,
+                        detector.avg, detector.alpha)
+        delta = self.time_stage('delta', detector.frame_delta, gray,
+                                detector.avg)
+        contours, thresh = self.time_stage('contours',
+                                           detector.find_contours, delta)
+        motion = self.time_stage('classify', self.model.check_contours,
+                                 contours)
+        person_prob = None
+        if self.person and motion:
+            person_prob = self.time_stage(
+                'person', self.model.get_person_prob, frame, contours)
+        self.render(frame, gray, thresh, contours, motion, person_prob)
+        return self.canvas
+
+    def render(self, frame, gray, thresh, contours, motion, person_prob):
+        """Draw the grid into the preallocated canvas"""
+        start = time.perf_counter()
+        self.allocate(gray)
+        height, width = gray.shape[:2]
+        canvas = self.canvas
+        top_left = canvas[:height, :width]
+        top_right = canvas[:height, width:]
+        bottom_left = canvas[height:, :width]
+        bottom_right = canvas[height:, width:]
+
+        if frame.ndim == 2:
+            # luma frames, from samples saved in the yuv capture format
+            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        cv2.resize(frame, (width, height), dst=self.small)
+        top_left[:] = self.small
+        for contour in contours:
+            x, y, w, h = contour['coords']
+            color = BOX_COLOR if contour['size'] > \
+                self.model.contour_threshold(contour) else TEXT_COLOR
+            cv2.rectangle(top_left, (x, y), (x + w, y + h), color, 1)
+        top_right[:] = cv2.convertScaleAbs(self.detector.avg)[..., None]
+        bottom_left[:] = thresh[..., None]
+        bottom_right[:] = 0
+
+        put_text(top_left, 'Frame & contours', 0)
+        put_text(top_right, 'Background Avg', 0)
+        put_text(bottom_left, 'Dilated & Thresholded Difference', 0)
+        put_text(bottom_right, 'Motion detected!' if motion else
+                 'Difference from background image is too small.', 0)
+        line = 1
+        if person_prob is not None:
+            put_text(bottom_right, 'person prob {:.2f}'.format(person_prob),
+                     line)
+            line += 1
+        for stage, ms in self.timings.items():
+            put_text(bottom_right, '{:<12} {:6.2f} ms'.format(stage, ms),
+                     line)
+            line += 1
+        self.timings['render'] = 0.9 * self.timings.get('render', 0) + \
+            0.1 * (time.perf_counter() - start) * 1000
+
+    def settings(self):
+        """Returns:
+            str: Current parameters, as config.yml settings
+        """
+        lines = []
+        for _, (_, attr, _, _) in PARAMETERS.items():
+            value = self.attribute(attr)
+            if isinstance(value, tuple):
+                value = list(value)
+            lines.append('{}: {}'.format(attr, value))
+        return '\n'.join(lines)
+
+
+def put_text(image, text, line):
+    cv2.putText(image, text, (5, 20 + 18 * line), cv2.FONT_HERSHEY_SIMPLEX,
+                0.5, TEXT_COLOR, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--source', default='0',
+                        help='Camera index, video file or sample pickle')
+    parser.add_argument('--loop', action='store_true',
+                        help='Replay recorded input forever')
+    parser.add_argument('--person', action='store_true',
+                        help='Run the person detector on frames with motion')
+    parser.add_argument('--fps', type=float, default=CONF['fps'],
+                        help='Playback rate of recorded input')
+    args = parser.parse_args()
+
+    debugger = Debugger(person=args.person)
+    debugger.create_trackbars()
+    delay = 1 if args.source.isdigit() else max(1, int(1000 / args.fps))
+    paused = False
+    frames = read_frames(args.source, args.loop)
+    frame = None
+    while True:
+        if not paused or frame is None:
+            frame = next(frames, None)
+            if frame is None:
+                break
+        debugger.read_trackbars()
+        grid = debugger.process(frame)
+        if grid is not None:
+            cv2.imshow(WINDOW, grid)
+
+        key = cv2.waitKey(delay) & 0xff
+        if key == ord('q'):
+            break
+        elif key == ord('p'):
+            paused = not paused
+        elif key == ord('s'):
+            print(debugger.settings())
+
+    cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
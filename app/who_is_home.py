@@ -5,74 +5,88 @@ import time
 import os
 import logging
 
-import requests
-
-import utils
-import config
+try:
+    from app import config
+    from app import presence
+    from app import utils
+except ImportError:
+    import config
+    import presence
+    import utils
 
 config.init_logging()
 
 LOGGER = logging.getLogger('who_is_home')
 CURR_DIR = os.path.dirname(__file__)
 CONF = config.load_private_config()
+PRESENCE_CONF = config.load_config().get('presence', {})
 
 ROUTER = CONF['router']
-USERNAME = ROUTER['user']
-PWD = ROUTER['pws']
-LOGIN_DATA = {'user': USERNAME, 'pws': PWD}
-LOGIN_GET = ROUTER['login_get']
-LOGIN_POST = ROUTER['login_post']
-GET_CONNECTED_URL = ROUTER['get_connected_url']
-BASE_HEADERS = ROUTER['headers']
-BASE_COOKIE = ROUTER['base_cookie']
-KNOWN_HOSTS = ["Ians-iPhone", 'iPhone']
-
-def get_connected_humans():
-    session = requests.session()
-    response = session.get(LOGIN_GET)
-
-    headers = BASE_HEADERS.copy()
-    response = session.post(LOGIN_POST, LOGIN_DATA, headers=headers)
-    user_str = response.headers['Set-Cookie']
-    user_id = user_str.split(';')[0].split('userid=')[1]
-
-    new_cookie = BASE_COOKIE.format(USERNAME, PWD, user_id)
-    headers['Cookie'] = new_cookie
-
-    url = GET_CONNECTED_URL.format(int(time.time())*1000)
-    response = session.get(url, headers=headers)
-    devices = response.json()
-
-    device_names = [d['hostName'] for d in devices]
-    connected_humans = list(set(KNOWN_HOSTS).intersection(device_names))
-    return connected_humans
+KNOWN_HOSTS = PRESENCE_CONF.get('known_hosts', ["Ians-iPhone", 'iPhone'])
+
+
+def build_sources():
+    """Build the presence sources enabled in the presence section of
+    config.yml
+
+    Returns:
+        list: Presence sources
+    """
+    sources = []
+    enabled = PRESENCE_CONF.get('sources', ['router'])
+    if 'router' in enabled:
+        sources.append(presence.RouterSource(
+            ROUTER, KNOWN_HOSTS,
+            session_ttl=PRESENCE_CONF.get('router_session_ttl', 600)))
+    if 'arp' in enabled:
+        sources.append(presence.ArpSource(PRESENCE_CONF.get('known_macs', {})))
+    if 'ping' in enabled:
+        sources.append(presence.PingSource(PRESENCE_CONF.get('known_ips', {})))
+    return sources
+
+
+def build_engine():
+    return presence.PresenceEngine(
+        build_sources(),
+        home_debounce=PRESENCE_CONF.get('home_debounce', 1),
+        away_debounce=PRESENCE_CONF.get('away_debounce', 3),
+        intervals=PRESENCE_CONF.get('intervals'),
+        transition_windows=PRESENCE_CONF.get('transition_windows')
+    )
+
+
+def sync(engine):
+    """Poll the presence sources, and store the home and camera status.
+
+    They're stored after every successful poll, not only when the home/away
+    state changes, so the camera is armed again while no one is home even
+    if it was turned off (i.e. with /pycam_off) in the meantime.
+
+    Args:
+        engine (presence.PresenceEngine): Presence engine
+
+    Returns:
+        float: Seconds until the next poll
+    """
+    changed = engine.poll()
+    if not engine.last_poll_ok:
+        LOGGER.warning('Error while fetching connected_humans')
+    elif engine.home is not None:
+        if changed and engine.home:
+            LOGGER.info('%s are connected. Turning off camera',
+                        list(engine.present))
+        elif changed:
+            LOGGER.info('No humans are connected.')
+        utils.redis_set('home', engine.home)
+        utils.redis_set('camera_status', not engine.home)
+    return engine.next_interval()
 
 
 def loop():
+    engine = build_engine()
     while True:
         if utils.redis_get('auto_detect_status'):
-
-            try:
-                connected_humans = get_connected_humans()        
-            except:
-                LOGGER.exception("message")
-                LOGGER.warning('Error while fetching connected_humans')
-                time.sleep(5)
-                continue
-
-            if connected_humans:
-                LOGGER.info('%s are connected. Turning off camera', 
-                            connected_humans)
-                utils.redis_set('home', True)
-                utils.redis_set('camera_status', False)
-                time.sleep(60*5)
-            else:
-                LOGGER.info('No humans are connected.')
-                utils.redis_set('home', False)
-                utils.redis_set('camera_status', True)
-                # newly connected devices take ~ 30 seconds to show up
-                time.sleep(30)
-
+            time.sleep(sync(engine))
         else:
             time.sleep(60)
 
@@ -0,0 +1,45 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+CONF_DIR = os.path.join(REPO_DIR, 'app', 'config')
+
+# The app package is imported from the repo root, as run_flask.py does
+sys.path.insert(0, REPO_DIR)
+
+
+def pytest_configure(config):
+    """Run against a copy of the settings with test credentials, as
+    private.yml isn't in the repo
+    """
+    directory = tempfile.mkdtemp(prefix='rpi-security-tests-')
+    shutil.copy(os.path.join(CONF_DIR, 'config.yml'), directory)
+    # modules that init_logging on import log to the scratch directory
+    with open(os.path.join(CONF_DIR, 'logging.yml')) as file_in:
+        log_conf = yaml.safe_load(file_in)
+    log_conf['handlers']['file']['filename'] = os.path.join(
+        directory, 'logfile.log')
+    with open(os.path.join(directory, 'logging.yml'), 'w') as file_out:
+        yaml.safe_dump(log_conf, file_out)
+    with open(os.path.join(directory, 'private.yml'), 'w') as file_out:
+        yaml.safe_dump({
+            'ian_uid': 'UTEST',
+            'alerts_channel': 'CTEST',
+            'rpi_cam_app': {'bot_token': 'xoxb-test',
+                            'oauth_token': 'xoxp-test',
+                            'verification_token': 'test-token'},
+            # the tests point presence.RouterSource to a stub router instead
+            'router': {},
+        }, file_out)
+    os.environ['RPI_SECURITY_CONF_DIR'] = directory
+    config.rpi_security_conf_dir = directory
+
+
+def pytest_unconfigure(config):
+    directory = getattr(config, 'rpi_security_conf_dir', None)
+    if directory is not None:
+        shutil.rmtree(directory, ignore_errors=True)
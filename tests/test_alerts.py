@@ -0,0 +1,97 @@
+import ast
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from app import alerts
+from app.decision import IDLE
+
+CONF = {'alerts': {'channel': 'CTEST', 'rate_per_minute': 600, 'burst': 5}}
+
+
+class RecordingSlack():
+    """Stands in for utils.slack_api_call, recording every call"""
+
+    def __init__(self, ratelimited=0, retry_after=0.2):
+        self.calls = []
+        self.ratelimited = ratelimited
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+
+    def __call__(self, method, **kwargs):
+        with self.lock:
+            self.calls.append((time.monotonic(), method, kwargs))
+            if self.ratelimited:
+                self.ratelimited -= 1
+                return {'ok': False, 'error': 'ratelimited', 'headers': {
+                    'Retry-After': str(self.retry_after)}}
+            if method == 'chat.postMessage':
+                return {'ok': True, 'ts': '1700000000.000100'}
+            return {'ok': True, 'file': {'id': 'F{}'.format(len(self.calls))}}
+
+
+def resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+def run_episode(slack, alert_count=3):
+    aggregator = alerts.AlertAggregator(CONF, api_call=slack)
+    aggregator.start()
+    frame = np.zeros((48, 64, 3), np.uint8)
+    for i in range(alert_count):
+        aggregator.alert('ts{}'.format(i), resolved(b'jpeg'), frame + i)
+    aggregator.update(IDLE)
+    aggregator.flush()
+    return [(method, kwargs) for _, method, kwargs in slack.calls]
+
+
+def test_episode_calls():
+    slack = RecordingSlack()
+    calls = run_episode(slack)
+
+    assert [method for method, _ in calls] == [
+        'chat.postMessage', 'files.upload', 'files.upload',
+        'chat.postMessage']
+    message, upload, sheet, buttons = [kwargs for _, kwargs in calls]
+    assert message['text'] == 'Motion detected at ts0'
+    assert message['channel'] == 'CTEST'
+    # the image and contact sheet are uploaded in the alert's thread
+    assert upload['filename'] == 'ts0.jpg'
+    assert upload['file'] == b'jpeg'
+    assert upload['thread_ts'] == '1700000000.000100'
+    assert sheet['filename'] == 'ts0_sheet.jpg'
+    assert sheet['thread_ts'] == '1700000000.000100'
+    assert sheet['file'][:2] == b'\xff\xd8'
+
+    # a single pair of buttons tags every sample of the episode
+    actions = buttons['attachments'][0]['actions']
+    values = [ast.literal_eval(action['value']) for action in actions]
+    assert [value['occupied'] for value in values] == [True, False]
+    for value in values:
+        assert value['episode'] == 'ts0'
+        assert value['samples'] == ['ts0', 'ts1', 'ts2']
+        assert value['file_ids'] == ['F2', 'F3']
+
+
+def test_single_alert_has_no_contact_sheet():
+    calls = run_episode(RecordingSlack(), alert_count=1)
+    assert [kwargs.get('filename') for _, kwargs in calls] == [
+        None, 'ts0.jpg', None]
+
+
+def test_ratelimited_call_is_retried_after_retry_after():
+    slack = RecordingSlack(ratelimited=1, retry_after=0.2)
+    run_episode(slack)
+
+    (first, method, kwargs), (retry, retried, retried_kwargs) = \
+        slack.calls[:2]
+    assert method == retried == 'chat.postMessage'
+    assert retried_kwargs == kwargs
+    assert retry - first >= 0.2
+    assert [method for _, method, _ in slack.calls[1:]] == [
+        'chat.postMessage', 'files.upload', 'files.upload',
+        'chat.postMessage']
@@ -0,0 +1,104 @@
+import time
+from datetime import datetime
+
+import pytest
+
+from app import presence
+from app.stubs import servers
+
+
+@pytest.fixture
+def router():
+    stub = servers.RouterStub(devices=['iPhone', 'printer']).start()
+    yield stub
+    stub.stop()
+
+
+def router_source(router, session_ttl=600):
+    return presence.RouterSource(router.router_conf(), ['iPhone'],
+                                 session_ttl=session_ttl)
+
+
+def test_router_session_is_reused(router):
+    source = router_source(router)
+    for _ in range(3):
+        assert source.detect() == {'iPhone'}
+    assert router.logins == 1
+    assert router.device_requests == 3
+
+
+def test_router_logs_in_again_after_the_session_ttl(router):
+    source = router_source(router, session_ttl=0.05)
+    source.detect()
+    time.sleep(0.1)
+    source.detect()
+    assert router.logins == 2
+
+
+def test_router_logs_in_again_when_the_session_is_rejected(router):
+    source = router_source(router)
+    source.detect()
+    router.expire_sessions()
+    assert source.detect() == {'iPhone'}
+    assert router.logins == 2
+
+
+def test_engine_debounces_departures(router):
+    engine = presence.PresenceEngine([router_source(router)],
+                                     away_debounce=3)
+    assert engine.poll()
+    assert engine.home
+
+    router.devices = ['printer']
+    assert [engine.poll() for _ in range(3)] == [False, False, True]
+    assert engine.home is False
+    assert engine.present == set()
+
+    # a device dropping off for a single poll doesn't arm the camera
+    router.devices = ['iPhone']
+    engine.poll()
+    assert engine.home
+    router.devices = []
+    engine.poll()
+    router.devices = ['iPhone']
+    engine.poll()
+    assert engine.home and engine.streak == 0
+
+
+def test_engine_merges_sources_and_survives_failures(router):
+    class Failing():
+        name = 'failing'
+
+        def detect(self):
+            raise OSError('unreachable')
+
+    class Arp():
+        name = 'arp'
+
+        def detect(self):
+            return {'laptop'}
+
+    engine = presence.PresenceEngine(
+        [router_source(router), Failing(), Arp()])
+    assert engine.detect() == {'iPhone', 'laptop'}
+    assert presence.PresenceEngine([Failing()]).detect() is None
+
+
+def test_next_interval():
+    engine = presence.PresenceEngine(
+        [], intervals={'home': 60, 'away': 30, 'pending': 5,
+                       'transition': 10},
+        transition_windows=[['07:30', '09:00'], ['23:00', '01:00']])
+    engine.home = True
+    assert engine.in_transition_window(datetime(2026, 1, 5, 8, 0))
+    assert engine.in_transition_window(datetime(2026, 1, 5, 0, 30))
+    assert not engine.in_transition_window(datetime(2026, 1, 5, 12, 0))
+
+    engine.in_transition_window = lambda: False
+    assert engine.next_interval() == 60
+    engine.home = False
+    assert engine.next_interval() == 30
+    engine.in_transition_window = lambda: True
+    assert engine.next_interval() == 10
+    engine.streak = 1
+    assert engine.next_interval() == 5
@@ -0,0 +1,58 @@
+import pytest
+
+from app import who_is_home
+
+
+class FakeSource():
+
+    name = 'fake'
+
+    def __init__(self):
+        self.present = set()
+
+    def detect(self):
+        return set(self.present)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    store = {}
+    monkeypatch.setattr(who_is_home.utils, 'redis_set', store.__setitem__)
+    monkeypatch.setattr(who_is_home.utils, 'redis_get', store.get)
+    return store
+
+
+def test_sync_stores_the_state_on_every_poll(redis):
+    source = FakeSource()
+    engine = who_is_home.presence.PresenceEngine([source])
+
+    who_is_home.sync(engine)
+    assert redis == {'home': False, 'camera_status': True}
+
+    # i.e. /pycam_off while no one is home, the next poll arms it again
+    redis['camera_status'] = False
+    who_is_home.sync(engine)
+    assert redis['camera_status'] is True
+
+
+def test_sync_switches_the_camera_after_debounce(redis):
+    source = FakeSource()
+    engine = who_is_home.presence.PresenceEngine([source], home_debounce=2)
+    who_is_home.sync(engine)
+
+    source.present = {'iPhone'}
+    who_is_home.sync(engine)
+    assert redis == {'home': False, 'camera_status': True}
+    who_is_home.sync(engine)
+    assert redis == {'home': True, 'camera_status': False}
+
+
+def test_sync_keeps_the_state_when_every_source_fails(redis):
+    source = FakeSource()
+    engine = who_is_home.presence.PresenceEngine([source])
+    who_is_home.sync(engine)
+    redis['camera_status'] = 'untouched'
+
+    source.detect = lambda: 1 / 0
+    who_is_home.sync(engine)
+    assert redis['camera_status'] == 'untouched'